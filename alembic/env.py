@@ -66,6 +66,11 @@ def run_migrations_online() -> None:
     connectable = engine
 
     with connectable.connect() as connection:
+        if connection.dialect.name == "sqlite":
+            # batch mode recreates tables: SQLite would refuse to drop a table
+            # referenced by foreign keys, so enforcement stays off while migrating
+            connection.exec_driver_sql("PRAGMA foreign_keys=OFF")
+            connection.commit()
         context.configure(connection=connection, target_metadata=target_metadata)
 
         with context.begin_transaction():
@@ -0,0 +1,27 @@
+"""Index uploaded_files on (created_at, id) for keyset pagination
+
+Revision ID: 0f6a3d8b2e91
+Revises: c5d1a9e83f46
+Create Date: 2025-10-30 09:48:55.730142
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = '0f6a3d8b2e91'
+down_revision: Union[str, Sequence[str], None] = 'c5d1a9e83f46'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_uploaded_files_created_at_id', 'uploaded_files', ['created_at', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_uploaded_files_created_at_id', table_name='uploaded_files')
@@ -0,0 +1,86 @@
+"""Add full-text search index over markdown files
+
+Revision ID: 2c4f8a1e6d35
+Revises: 7b9e2d4c1a68
+Create Date: 2025-11-06 09:47:21.630194
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '2c4f8a1e6d35'
+down_revision: Union[str, Sequence[str], None] = '7b9e2d4c1a68'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 500
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE search_documents_fts USING fts5("
+    "filename, body, content='search_documents', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER search_documents_ai AFTER INSERT ON search_documents BEGIN "
+    "INSERT INTO search_documents_fts(rowid, filename, body) "
+    "VALUES (new.id, new.filename, new.body); END",
+    "CREATE TRIGGER search_documents_ad AFTER DELETE ON search_documents BEGIN "
+    "INSERT INTO search_documents_fts(search_documents_fts, rowid, filename, body) "
+    "VALUES ('delete', old.id, old.filename, old.body); END",
+]
+POSTGRES_DDL = [
+    "CREATE INDEX ix_search_documents_tsv ON search_documents "
+    "USING gin (to_tsvector('simple', filename || ' ' || body))",
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'search_documents',
+        sa.Column('id', sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column('file_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('filename', sa.String(), nullable=False),
+        sa.Column('body', sa.Text(), nullable=False),
+        sa.ForeignKeyConstraint(['file_id'], ['uploaded_files.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('file_id'),
+    )
+
+    # Backfill the markdown files in batches; the index is fed by the triggers
+    # on SQLite and by the GIN index built afterwards on PostgreSQL
+    conn = op.get_bind()
+    dialect = conn.dialect.name
+    if dialect == 'sqlite':
+        for statement in SQLITE_DDL:
+            op.execute(statement)
+    rows = conn.execution_options(stream_results=True).execute(
+        sa.text("SELECT id, filename, content FROM uploaded_files WHERE filetype = 'markdown'")
+    )
+    insert = sa.text(
+        "INSERT INTO search_documents (file_id, filename, body) VALUES (:file_id, :filename, :body)"
+    )
+    while True:
+        batch = rows.fetchmany(BATCH_SIZE)
+        if not batch:
+            break
+        conn.execute(
+            insert,
+            [
+                {"file_id": row[0], "filename": row[1], "body": bytes(row[2]).decode("utf-8", errors="replace")}
+                for row in batch
+            ],
+        )
+    if dialect == 'postgresql':
+        for statement in POSTGRES_DDL:
+            op.execute(statement)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    if op.get_bind().dialect.name == 'sqlite':
+        op.execute("DROP TABLE IF EXISTS search_documents_fts")
+    op.drop_table('search_documents')
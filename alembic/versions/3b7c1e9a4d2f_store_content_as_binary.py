@@ -0,0 +1,61 @@
+"""Store UploadedFile content as binary
+
+Revision ID: 3b7c1e9a4d2f
+Revises: 1ca96f0a8064
+Create Date: 2025-10-27 09:12:40.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3b7c1e9a4d2f'
+down_revision: Union[str, Sequence[str], None] = '1ca96f0a8064'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 500
+
+
+def _convert(source: str, target: str, transform) -> None:
+    """Copy `source` into `target` row by row, applying `transform`."""
+    conn = op.get_bind()
+    rows = conn.execution_options(stream_results=True).execute(
+        sa.text(f"SELECT id, {source} FROM uploaded_files")
+    )
+    update = sa.text(f"UPDATE uploaded_files SET {target} = :value WHERE id = :id")
+    while True:
+        batch = rows.fetchmany(BATCH_SIZE)
+        if not batch:
+            break
+        conn.execute(
+            update,
+            [{"id": row[0], "value": transform(row[1])} for row in batch],
+        )
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    import base64
+
+    op.add_column('uploaded_files', sa.Column('content_bin', sa.LargeBinary(), nullable=True))
+    _convert('content', 'content_bin', base64.b64decode)
+
+    with op.batch_alter_table('uploaded_files') as batch_op:
+        batch_op.drop_column('content')
+        batch_op.alter_column('content_bin', new_column_name='content', nullable=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    import base64
+
+    op.add_column('uploaded_files', sa.Column('content_b64', sa.String(), nullable=True))
+    _convert('content', 'content_b64', lambda value: base64.b64encode(value).decode('utf-8'))
+
+    with op.batch_alter_table('uploaded_files') as batch_op:
+        batch_op.drop_column('content')
+        batch_op.alter_column('content_b64', new_column_name='content', nullable=False)
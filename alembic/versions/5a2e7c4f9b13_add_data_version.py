@@ -0,0 +1,34 @@
+"""Add data_version table
+
+Revision ID: 5a2e7c4f9b13
+Revises: 0f6a3d8b2e91
+Create Date: 2025-10-31 11:22:09.613458
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5a2e7c4f9b13'
+down_revision: Union[str, Sequence[str], None] = '0f6a3d8b2e91'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'data_version',
+        sa.Column('id', sa.Integer(), primary_key=True, nullable=False),
+        sa.Column('version', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+    )
+    op.execute("INSERT INTO data_version (id, version, updated_at) VALUES (1, 0, CURRENT_TIMESTAMP)")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('data_version')
@@ -0,0 +1,44 @@
+"""Add storage backend to blobs
+
+Revision ID: 5f3b8d0e2a17
+Revises: e4a7c2f9b816
+Create Date: 2025-11-12 10:22:37.518240
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5f3b8d0e2a17'
+down_revision: Union[str, Sequence[str], None] = 'e4a7c2f9b816'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing blobs live in the database; content is NULL for other backends
+    with op.batch_alter_table('blobs') as batch_op:
+        batch_op.add_column(
+            sa.Column('backend', sa.String(length=16), server_default='db', nullable=False)
+        )
+        batch_op.alter_column('content', existing_type=sa.LargeBinary(), nullable=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Older revisions read content from the database only
+    outside = op.get_bind().execute(
+        sa.text("SELECT COUNT(*) FROM blobs WHERE backend != 'db'")
+    ).scalar_one()
+    if outside:
+        raise RuntimeError(
+            f"{outside} blobs are stored outside the database: "
+            "run 'python -m rapid_md.manage migrate-storage --to db' first"
+        )
+    with op.batch_alter_table('blobs') as batch_op:
+        batch_op.alter_column('content', existing_type=sa.LargeBinary(), nullable=False)
+        batch_op.drop_column('backend')
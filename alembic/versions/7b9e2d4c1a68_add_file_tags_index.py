@@ -0,0 +1,59 @@
+"""Add normalized file_tags table
+
+Revision ID: 7b9e2d4c1a68
+Revises: d8b3f1c6a524
+Create Date: 2025-11-05 10:12:37.418205
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7b9e2d4c1a68'
+down_revision: Union[str, Sequence[str], None] = 'd8b3f1c6a524'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 500
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    import json
+
+    op.create_table(
+        'file_tags',
+        sa.Column('file_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('tag', sa.String(), nullable=False),
+        sa.ForeignKeyConstraint(['file_id'], ['uploaded_files.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('file_id', 'tag'),
+    )
+    op.create_index('ix_file_tags_tag_file_id', 'file_tags', ['tag', 'file_id'], unique=False)
+
+    # Backfill from the JSON column in batches; ids are copied as stored
+    conn = op.get_bind()
+    rows = conn.execution_options(stream_results=True).execute(
+        sa.text("SELECT id, tags FROM uploaded_files WHERE tags IS NOT NULL")
+    )
+    insert = sa.text("INSERT INTO file_tags (file_id, tag) VALUES (:file_id, :tag)")
+    while True:
+        batch = rows.fetchmany(BATCH_SIZE)
+        if not batch:
+            break
+        params = []
+        for file_id, tags in batch:
+            if isinstance(tags, str):
+                tags = json.loads(tags)
+            params.extend({"file_id": file_id, "tag": tag} for tag in sorted(set(tags or [])))
+        if params:
+            conn.execute(insert, params)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_file_tags_tag_file_id', table_name='file_tags')
+    op.drop_table('file_tags')
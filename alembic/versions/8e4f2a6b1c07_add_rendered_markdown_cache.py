@@ -0,0 +1,60 @@
+"""Add content_hash to UploadedFile and rendered_markdown cache table
+
+Revision ID: 8e4f2a6b1c07
+Revises: 3b7c1e9a4d2f
+Create Date: 2025-10-28 15:40:02.551873
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8e4f2a6b1c07'
+down_revision: Union[str, Sequence[str], None] = '3b7c1e9a4d2f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 500
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    import hashlib
+
+    op.add_column('uploaded_files', sa.Column('content_hash', sa.String(length=64), nullable=True))
+
+    # Compute the hash of existing rows in batches
+    conn = op.get_bind()
+    rows = conn.execution_options(stream_results=True).execute(
+        sa.text("SELECT id, content FROM uploaded_files")
+    )
+    update = sa.text("UPDATE uploaded_files SET content_hash = :content_hash WHERE id = :id")
+    while True:
+        batch = rows.fetchmany(BATCH_SIZE)
+        if not batch:
+            break
+        conn.execute(
+            update,
+            [{"id": row[0], "content_hash": hashlib.sha256(row[1]).hexdigest()} for row in batch],
+        )
+
+    with op.batch_alter_table('uploaded_files') as batch_op:
+        batch_op.alter_column('content_hash', nullable=False)
+    op.create_index(op.f('ix_uploaded_files_content_hash'), 'uploaded_files', ['content_hash'], unique=False)
+
+    op.create_table(
+        'rendered_markdown',
+        sa.Column('content_hash', sa.String(length=64), primary_key=True, nullable=False),
+        sa.Column('html', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('rendered_markdown')
+    op.drop_index(op.f('ix_uploaded_files_content_hash'), table_name='uploaded_files')
+    op.drop_column('uploaded_files', 'content_hash')
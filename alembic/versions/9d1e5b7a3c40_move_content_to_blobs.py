@@ -0,0 +1,89 @@
+"""Move file content to a deduplicated blobs table
+
+Revision ID: 9d1e5b7a3c40
+Revises: 2c4f8a1e6d35
+Create Date: 2025-11-07 16:05:44.271930
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d1e5b7a3c40'
+down_revision: Union[str, Sequence[str], None] = '2c4f8a1e6d35'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+BATCH_SIZE = 500
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'blobs',
+        sa.Column('content_hash', sa.String(length=64), nullable=False),
+        sa.Column('content', sa.LargeBinary(), nullable=False),
+        sa.Column('size', sa.BigInteger(), nullable=False),
+        sa.Column('refcount', sa.Integer(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('content_hash'),
+    )
+
+    # One blob per distinct hash, referenced by every file with that hash
+    conn = op.get_bind()
+    refs = {
+        row[0]: (row[1], row[2])
+        for row in conn.execute(
+            sa.text("SELECT content_hash, COUNT(*), MIN(created_at) FROM uploaded_files GROUP BY content_hash")
+        )
+    }
+    rows = conn.execution_options(stream_results=True).execute(
+        sa.text("SELECT content_hash, content FROM uploaded_files")
+    )
+    insert = sa.text(
+        "INSERT INTO blobs (content_hash, content, size, refcount, created_at) "
+        "VALUES (:content_hash, :content, :size, :refcount, :created_at)"
+    )
+    while True:
+        batch = rows.fetchmany(BATCH_SIZE)
+        if not batch:
+            break
+        params = []
+        for content_hash, content in batch:
+            if content_hash not in refs:
+                continue  # already stored
+            refcount, created_at = refs.pop(content_hash)
+            params.append(
+                {
+                    "content_hash": content_hash,
+                    "content": content,
+                    "size": len(content),
+                    "refcount": refcount,
+                    "created_at": created_at,
+                }
+            )
+        if params:
+            conn.execute(insert, params)
+    rows.close()
+
+    with op.batch_alter_table('uploaded_files') as batch_op:
+        batch_op.drop_column('content')
+        batch_op.create_foreign_key(
+            'fk_uploaded_files_content_hash_blobs', 'blobs', ['content_hash'], ['content_hash']
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.add_column('uploaded_files', sa.Column('content', sa.LargeBinary(), nullable=True))
+    op.execute(
+        "UPDATE uploaded_files SET content = "
+        "(SELECT blobs.content FROM blobs WHERE blobs.content_hash = uploaded_files.content_hash)"
+    )
+    with op.batch_alter_table('uploaded_files') as batch_op:
+        batch_op.drop_constraint('fk_uploaded_files_content_hash_blobs', type_='foreignkey')
+        batch_op.alter_column('content', nullable=False)
+    op.drop_table('blobs')
@@ -0,0 +1,55 @@
+"""Add ingest_jobs table for background zip extraction
+
+Revision ID: a3c6e1f4b7d2
+Revises: 5f3b8d0e2a17
+Create Date: 2025-11-13 15:41:52.087316
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a3c6e1f4b7d2'
+down_revision: Union[str, Sequence[str], None] = '5f3b8d0e2a17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'ingest_jobs',
+        sa.Column('id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('filename', sa.String(), nullable=False),
+        sa.Column(
+            'status',
+            sa.Enum('queued', 'running', 'done', 'failed', name='jobstatusenum'),
+            nullable=False,
+        ),
+        sa.Column('upload_session', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('members_total', sa.Integer(), nullable=True),
+        sa.Column('members_done', sa.Integer(), nullable=False),
+        sa.Column('bytes_total', sa.BigInteger(), nullable=True),
+        sa.Column('bytes_done', sa.BigInteger(), nullable=False),
+        sa.Column('bytes_saved', sa.BigInteger(), nullable=False),
+        sa.Column('error_count', sa.Integer(), nullable=False),
+        sa.Column('errors', sa.JSON(), nullable=True),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.Column('created_at', sa.DateTime(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=False),
+        sa.Column('finished_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_ingest_jobs_status', 'ingest_jobs', ['status'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_ingest_jobs_status', table_name='ingest_jobs')
+    op.drop_table('ingest_jobs')
+    if op.get_bind().dialect.name == 'postgresql':
+        op.execute('DROP TYPE IF EXISTS jobstatusenum')
@@ -0,0 +1,43 @@
+"""Add file_changes log for incremental sync
+
+Revision ID: b8d2f5a9c3e6
+Revises: a3c6e1f4b7d2
+Create Date: 2025-11-17 09:12:40.553871
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b8d2f5a9c3e6'
+down_revision: Union[str, Sequence[str], None] = 'a3c6e1f4b7d2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        'file_changes',
+        sa.Column('seq', sa.BigInteger().with_variant(sa.Integer(), 'sqlite'), autoincrement=True, nullable=False),
+        sa.Column('file_id', postgresql.UUID(as_uuid=True), nullable=False),
+        sa.Column('op', sa.String(length=8), nullable=False),
+        sa.Column('changed_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('seq'),
+        sqlite_autoincrement=True,
+    )
+    # Existing files become the first insert changes, in upload order, so that
+    # a client syncing from since=0 receives the whole corpus
+    op.execute(
+        "INSERT INTO file_changes (file_id, op, changed_at) "
+        "SELECT id, 'insert', created_at FROM uploaded_files ORDER BY created_at, id"
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('file_changes')
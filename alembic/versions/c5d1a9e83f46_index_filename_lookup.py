@@ -0,0 +1,27 @@
+"""Index uploaded_files on (filename, created_at)
+
+Revision ID: c5d1a9e83f46
+Revises: 8e4f2a6b1c07
+Create Date: 2025-10-29 10:05:17.204611
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c5d1a9e83f46'
+down_revision: Union[str, Sequence[str], None] = '8e4f2a6b1c07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_uploaded_files_filename_created_at', 'uploaded_files', ['filename', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_uploaded_files_filename_created_at', table_name='uploaded_files')
@@ -0,0 +1,32 @@
+"""Add size to UploadedFile
+
+Revision ID: d8b3f1c6a524
+Revises: 5a2e7c4f9b13
+Create Date: 2025-11-03 14:31:48.092716
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd8b3f1c6a524'
+down_revision: Union[str, Sequence[str], None] = '5a2e7c4f9b13'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('uploaded_files', sa.Column('size', sa.BigInteger(), nullable=True))
+    # length() counts bytes for both SQLite blobs and PostgreSQL bytea
+    op.execute("UPDATE uploaded_files SET size = length(content)")
+    with op.batch_alter_table('uploaded_files') as batch_op:
+        batch_op.alter_column('size', nullable=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('uploaded_files', 'size')
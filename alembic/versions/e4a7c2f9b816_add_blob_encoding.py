@@ -0,0 +1,42 @@
+"""Add encoding to blobs for compression at rest
+
+Revision ID: e4a7c2f9b816
+Revises: 9d1e5b7a3c40
+Create Date: 2025-11-10 11:18:06.904417
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4a7c2f9b816'
+down_revision: Union[str, Sequence[str], None] = '9d1e5b7a3c40'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Existing blobs stay uncompressed (NULL encoding); new uploads are compressed
+    op.add_column('blobs', sa.Column('encoding', sa.String(length=16), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    import gzip
+
+    # Older revisions expect uncompressed content; one blob in memory at a time
+    conn = op.get_bind()
+    hashes = conn.execute(
+        sa.text("SELECT content_hash FROM blobs WHERE encoding = 'gzip'")
+    ).scalars().all()
+    select = sa.text("SELECT content FROM blobs WHERE content_hash = :content_hash")
+    update = sa.text("UPDATE blobs SET content = :content WHERE content_hash = :content_hash")
+    for content_hash in hashes:
+        content = conn.execute(select, {"content_hash": content_hash}).scalar_one()
+        conn.execute(update, {"content_hash": content_hash, "content": gzip.decompress(content)})
+    with op.batch_alter_table('blobs') as batch_op:
+        batch_op.drop_column('encoding')
@@ -0,0 +1,455 @@
+"""
+Benchmark di upload_file, list_files, render_file e home su un corpus
+sintetico in SQLite:
+
+    python -m benchmarks.bench seed --rows 100k --db bench/100k.db
+    python -m benchmarks.bench run --rows 100k --db bench/100k.db --output results.json
+    python -m benchmarks.bench compare baseline.json results.json
+
+`run` esegue ogni scenario in-process (ASGI, senza rete) e attraverso un
+uvicorn locale, su una copia del database: gli upload non alterano il corpus
+e le esecuzioni successive partono dagli stessi dati.
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable
+import httpx
+from sqlalchemy import create_engine
+from benchmarks.corpus import parse_scale, sample_filenames, seed_corpus
+from rapid_md.models import FileTypeEnum
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+API_KEY = "bench"
+SCENARIOS = ["list", "render", "home", "upload"]
+MODES = ["inprocess", "uvicorn"]
+
+# Soglia oltre la quale un peggioramento rispetto al baseline e' una regressione
+DEFAULT_THRESHOLD = 0.2
+
+# Metriche confrontate: True se un valore piu' alto e' peggiore
+METRICS = {
+    "p50_ms": True,
+    "p95_ms": True,
+    "p99_ms": True,
+    "throughput_rps": False,
+    "peak_rss_kb": True,
+}
+
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """
+    Percentile con il metodo nearest-rank
+    """
+    if not sorted_values:
+        return 0.0
+    rank = max(1, round(p / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def summarize(latencies: list[float], errors: int, elapsed: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "p50_ms": percentile(values, 50) * 1000,
+        "p95_ms": percentile(values, 95) * 1000,
+        "p99_ms": percentile(values, 99) * 1000,
+        "throughput_rps": len(values) / elapsed if elapsed else 0.0,
+    }
+
+
+def make_requests(engine_url: str, seed: int = 0) -> dict[str, Callable[[int], dict]]:
+    """
+    Per ogni scenario, una funzione che descrive l'i-esima richiesta
+    (argomenti di httpx.AsyncClient.request)
+    """
+    engine = create_engine(engine_url)
+    markdown = sample_filenames(engine, FileTypeEnum.markdown, 500)
+    others = sample_filenames(engine, FileTypeEnum.document, 100)
+    engine.dispose()
+    rng = random.Random(seed)
+    headers = {"x-api-key": API_KEY}
+    run_id = f"{time.time_ns():x}"
+
+    def list_files(i: int) -> dict:
+        params = {"limit": 100}
+        if i % 2:
+            params["tag"] = f"tag{rng.randrange(50):02d}"
+        return {"method": "GET", "url": "/files", "params": params, "headers": headers}
+
+    def render(i: int) -> dict:
+        # Una richiesta su cinque a file non markdown, serviti dallo storage
+        names = others if others and i % 5 == 4 else markdown
+        return {"method": "GET", "url": f"/render/{rng.choice(names)}"}
+
+    def home(i: int) -> dict:
+        return {"method": "GET", "url": "/", "headers": {"Accept-Encoding": "gzip"}}
+
+    def upload(i: int) -> dict:
+        content = f"# Upload {run_id} {i}\n\n" + "benchmark text " * 50
+        return {
+            "method": "POST",
+            "url": "/upload-file",
+            "headers": headers,
+            "json": {
+                "filepath": f"bench/{run_id}-{i}.md",
+                "content_base64": base64.b64encode(content.encode()).decode(),
+                "tags": ["bench"],
+            },
+        }
+
+    return {"list": list_files, "render": render, "home": home, "upload": upload}
+
+
+async def drive(
+    client: httpx.AsyncClient,
+    request_for: Callable[[int], dict],
+    requests: int,
+    concurrency: int,
+    warmup: int,
+) -> dict:
+    """
+    Esegue `requests` richieste con `concurrency` client concorrenti e
+    misura la latenza di ciascuna; le prime `warmup` non sono misurate
+    """
+    for i in range(warmup):
+        await client.request(**request_for(i))
+
+    latencies = []
+    errors = 0
+    counter = iter(range(warmup, warmup + requests))
+
+    async def worker() -> None:
+        nonlocal errors
+        for i in counter:
+            start = time.perf_counter()
+            try:
+                response = await client.request(**request_for(i))
+                failed = response.status_code >= 400
+            except httpx.HTTPError:
+                failed = True
+            latencies.append(time.perf_counter() - start)
+            errors += failed
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def self_peak_rss_kb() -> int:
+    # ru_maxrss e' in KiB su Linux, in byte su macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def process_tree_peak_rss_kb(pid: int) -> int | None:
+    """
+    Somma dei picchi di memoria (VmHWM) del processo e dei suoi figli,
+    cioe' dei worker di uvicorn; None dove /proc non e' disponibile
+    """
+    total = 0
+    pending = [pid]
+    try:
+        while pending:
+            current = pending.pop()
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        total += int(line.split()[1])
+            with open(f"/proc/{current}/task/{current}/children") as f:
+                pending.extend(int(child) for child in f.read().split())
+    except (FileNotFoundError, ProcessLookupError):
+        return total or None
+    return total
+
+
+async def run_scenarios(
+    client: httpx.AsyncClient,
+    requests_by_scenario: dict[str, Callable[[int], dict]],
+    scenarios: list[str],
+    requests: int,
+    concurrency: int,
+    warmup: int,
+    peak_rss: Callable[[], int | None],
+) -> dict:
+    results = {}
+    for scenario in scenarios:
+        result = await drive(
+            client, requests_by_scenario[scenario], requests, concurrency, warmup
+        )
+        # Picco del processo fino alla fine dello scenario
+        result["peak_rss_kb"] = peak_rss()
+        results[scenario] = result
+        print(
+            f"  {scenario:<8} p50 {result['p50_ms']:8.2f} ms  "
+            f"p95 {result['p95_ms']:8.2f} ms  p99 {result['p99_ms']:8.2f} ms  "
+            f"{result['throughput_rps']:8.1f} req/s  errors {result['errors']}",
+            file=sys.stderr,
+        )
+    return results
+
+
+def configure_environment(database_url: str, workdir: str) -> dict:
+    env = {
+        "DATABASE_URL": database_url,
+        "RAPID_MD_API_KEY": API_KEY,
+        "RAPID_MD_JOBS_PATH": os.path.join(workdir, "jobs"),
+        "RAPID_MD_STORAGE_PATH": os.path.join(workdir, "blobs"),
+    }
+    os.environ.update(env)
+    return env
+
+
+async def run_inprocess(options: argparse.Namespace, database_url: str) -> dict:
+    # L'applicazione legge DATABASE_URL all'import
+    from main import app
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(
+        transport=transport, base_url="http://bench"
+    ) as client:
+        return await run_scenarios(
+            client,
+            make_requests(database_url, options.seed),
+            options.scenarios,
+            options.requests,
+            options.concurrency,
+            options.warmup,
+            self_peak_rss_kb,
+        )
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout: float = 30) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            if (await client.get("/")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        if time.monotonic() > deadline:
+            raise RuntimeError("uvicorn did not start in time")
+        await asyncio.sleep(0.2)
+
+
+async def run_uvicorn(options: argparse.Namespace, database_url: str) -> dict:
+    port = free_port()
+    server = subprocess.Popen(
+        [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            "main:app",
+            "--host",
+            "127.0.0.1",
+            "--port",
+            str(port),
+            "--workers",
+            str(options.workers),
+            "--log-level",
+            "warning",
+            "--no-access-log",
+        ],
+        cwd=ROOT,
+        env=os.environ.copy(),
+    )
+    limits = httpx.Limits(max_connections=options.concurrency)
+    try:
+        async with httpx.AsyncClient(
+            base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=60
+        ) as client:
+            await wait_until_ready(client)
+            return await run_scenarios(
+                client,
+                make_requests(database_url, options.seed),
+                options.scenarios,
+                options.requests,
+                options.concurrency,
+                options.warmup,
+                lambda: process_tree_peak_rss_kb(server.pid),
+            )
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+
+
+def seed(path: str, rows: int, seed: int = 0) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    engine = create_engine(f"sqlite:///{path}")
+    start = time.perf_counter()
+    inserted = seed_corpus(engine, rows, seed)
+    engine.dispose()
+    print(
+        f"Seeded {inserted} files into {path} in {time.perf_counter() - start:.1f}s",
+        file=sys.stderr,
+    )
+
+
+def run(options: argparse.Namespace) -> dict:
+    if not os.path.exists(options.db):
+        # Processo separato: il picco di memoria del seeding non entra nei risultati
+        subprocess.run(
+            [
+                sys.executable,
+                "-m",
+                "benchmarks.bench",
+                "seed",
+                "--rows",
+                str(options.rows),
+                "--db",
+                options.db,
+                "--seed",
+                str(options.seed),
+            ],
+            cwd=ROOT,
+            check=True,
+        )
+
+    results = {}
+    runners = {"inprocess": run_inprocess, "uvicorn": run_uvicorn}
+    with tempfile.TemporaryDirectory() as workdir:
+        for mode in options.modes:
+            # Ogni modalita' lavora su una copia del corpus originale
+            path = os.path.join(workdir, f"{mode}.db")
+            shutil.copyfile(options.db, path)
+            database_url = f"sqlite:///{path}"
+            configure_environment(database_url, workdir)
+            label = (
+                f"uvicorn ({options.workers} workers)" if mode == "uvicorn" else mode
+            )
+            print(label, file=sys.stderr)
+            results[mode] = asyncio.run(runners[mode](options, database_url))
+
+    return {
+        "meta": {
+            "rows": options.rows,
+            "requests": options.requests,
+            "concurrency": options.concurrency,
+            "workers": options.workers,
+            "seed": options.seed,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        },
+        "results": results,
+    }
+
+
+def compare(baseline: dict, current: dict, threshold: float) -> list[str]:
+    """
+    Regressioni di `current` rispetto a `baseline`: metriche peggiorate di
+    oltre `threshold` (0.2 = 20%) negli scenari presenti in entrambi
+    """
+    regressions = []
+    for mode, scenarios in current["results"].items():
+        for scenario, result in scenarios.items():
+            reference = baseline["results"].get(mode, {}).get(scenario)
+            if reference is None:
+                continue
+            for metric, higher_is_worse in METRICS.items():
+                old, new = reference.get(metric), result.get(metric)
+                if not old or new is None:
+                    continue
+                change = (new - old) / old
+                if (change if higher_is_worse else -change) > threshold:
+                    regressions.append(
+                        f"{mode}/{scenario} {metric}: {old:.2f} -> {new:.2f} "
+                        f"({change:+.0%})"
+                    )
+            if result.get("errors", 0) > reference.get("errors", 0):
+                regressions.append(
+                    f"{mode}/{scenario} errors: {reference.get('errors', 0)} -> "
+                    f"{result['errors']}"
+                )
+    return regressions
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    seed_parser = commands.add_parser("seed", help="Create a synthetic corpus")
+    seed_parser.add_argument("--rows", type=parse_scale, default="1k")
+    seed_parser.add_argument("--db", required=True, help="SQLite file to create")
+    seed_parser.add_argument("--seed", type=int, default=0)
+
+    run_parser = commands.add_parser("run", help="Run the benchmarks")
+    run_parser.add_argument(
+        "--rows", type=parse_scale, default="1k", help="1k, 100k, 1M, ..."
+    )
+    run_parser.add_argument(
+        "--db", help="Seeded corpus, created if missing (default: bench/<rows>.db)"
+    )
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--requests", type=int, default=500)
+    run_parser.add_argument("--warmup", type=int, default=20)
+    run_parser.add_argument("--concurrency", type=int, default=8)
+    run_parser.add_argument("--workers", type=int, default=2)
+    run_parser.add_argument(
+        "--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS
+    )
+    run_parser.add_argument("--modes", nargs="+", choices=MODES, default=MODES)
+    run_parser.add_argument("--output", default="bench_results.json")
+    run_parser.add_argument("--baseline", help="Compare with a saved result")
+    run_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    compare_parser = commands.add_parser(
+        "compare", help="Flag regressions against a baseline"
+    )
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "seed":
+        seed(args.db, args.rows, args.seed)
+        return 0
+
+    if args.command == "run":
+        args.db = args.db or os.path.join(ROOT, "bench", f"{args.rows}.db")
+        current = run(args)
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Results written to {args.output}", file=sys.stderr)
+        if not args.baseline:
+            return 0
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    else:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        with open(args.current) as f:
+            current = json.load(f)
+
+    regressions = compare(baseline, current, args.threshold)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if not regressions:
+        print("No regressions")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""
+Corpus sintetico per i benchmark: file markdown, immagini e documenti con
+tag e sessioni di upload, generati in modo deterministico da un seed
+"""
+
+import random
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select, true
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+from rapid_md.changes import INSERT, record_changes
+from rapid_md.ingest import insert_file_rows
+from rapid_md.models import Base, DataVersion, FileTag, FileTypeEnum, UploadedFile
+from rapid_md.storage import BlobData, decode, prepare_blob
+from rapid_md.versioning import DATA_VERSION_ID, bump_data_version
+
+SEED_BATCH_SIZE = 5000
+
+# Proporzioni dei tipi di file nel corpus
+FILETYPE_WEIGHTS = {
+    FileTypeEnum.markdown: 6,
+    FileTypeEnum.image: 2,
+    FileTypeEnum.document: 2,
+}
+EXTENSIONS = {
+    FileTypeEnum.markdown: [".md"],
+    FileTypeEnum.image: [".png", ".jpg", ".svg"],
+    FileTypeEnum.document: [".pdf", ".txt", ".csv"],
+}
+
+TAGS = [f"tag{i:02d}" for i in range(50)]
+WORDS = (
+    "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod "
+    "tempor incididunt ut labore et dolore magna aliqua rapid markdown file "
+    "upload render search archive session version cache index query"
+).split()
+
+# Data del file piu' vecchio; i successivi arrivano a intervalli casuali
+CORPUS_START = datetime(2024, 1, 1)
+
+
+def parse_scale(value: str) -> int:
+    """
+    Numero di righe del corpus: intero o con suffisso k/M (es. 1k, 100k, 1M)
+    """
+    multipliers = {"k": 1_000, "m": 1_000_000}
+    suffix = value[-1:].lower()
+    if suffix in multipliers:
+        return int(float(value[:-1]) * multipliers[suffix])
+    return int(value)
+
+
+def markdown_body(rng: random.Random, n: int) -> bytes:
+    lines = [f"# Document {n}", ""]
+    for _ in range(rng.randint(3, 30)):
+        lines.append(" ".join(rng.choices(WORDS, k=rng.randint(8, 40))))
+        lines.append("")
+    if rng.random() < 0.3:
+        lines += ["| a | b |", "|---|---|", "| 1 | 2 |", ""]
+    if rng.random() < 0.3:
+        lines += ["```python", "print('hello')", "```", ""]
+    return "\n".join(lines).encode("utf-8")
+
+
+def content_pool(rng: random.Random, size: int) -> dict[FileTypeEnum, list[BlobData]]:
+    """
+    Contenuti distinti per tipo di file: i file del corpus li condividono,
+    come i duplicati reali deduplicati nella tabella blobs
+    """
+    pool = {}
+    for filetype, extensions in EXTENSIONS.items():
+        blobs = []
+        for n in range(size):
+            if filetype == FileTypeEnum.markdown:
+                content = markdown_body(rng, n)
+            else:
+                content = rng.randbytes(rng.randint(1_000, 20_000))
+            blobs.append(prepare_blob(f"f{extensions[0]}", filetype, content))
+        pool[filetype] = blobs
+    return pool
+
+
+def corpus_rows(rows: int, seed: int = 0):
+    """
+    Righe per insert_file_rows con i relativi tag, SEED_BATCH_SIZE alla volta
+    """
+    rng = random.Random(seed)
+    pool = content_pool(rng, max(10, min(rows // 10, 10_000)))
+    # Contenuto originale per l'indice di ricerca, decompresso una volta per blob
+    texts = {}
+    filetypes = list(FILETYPE_WEIGHTS)
+    weights = list(FILETYPE_WEIGHTS.values())
+    created_at = CORPUS_START
+    upload_session = None
+    batch = []
+    for n in range(rows):
+        # Sessioni da un file (upload singoli) o da molti (archivi zip)
+        if upload_session is None or rng.random() < 0.2:
+            upload_session = uuid.UUID(int=rng.getrandbits(128))
+            created_at += timedelta(seconds=rng.randint(1, 3600))
+        filetype = rng.choices(filetypes, weights)[0]
+        extension = rng.choice(EXTENSIONS[filetype])
+        blob = rng.choice(pool[filetype])
+        if blob.content_hash not in texts:
+            texts[blob.content_hash] = decode(blob.data, blob.encoding)
+        tags = sorted(set(rng.choices(TAGS, k=rng.randint(0, 3)))) or None
+        batch.append(
+            {
+                "id": uuid.UUID(int=rng.getrandbits(128)),
+                "filename": f"file{n:07d}{extension}",
+                "content": texts[blob.content_hash],
+                "blob": blob,
+                "content_hash": blob.content_hash,
+                "size": blob.size,
+                "created_at": created_at,
+                "filetype": filetype,
+                "tags": tags,
+                "upload_session": upload_session,
+            }
+        )
+        if len(batch) >= SEED_BATCH_SIZE:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def seed_corpus(engine: Engine, rows: int, seed: int = 0) -> int:
+    """
+    Crea lo schema e inserisce `rows` file, con un commit per blocco.
+    Restituisce il numero di file inseriti.
+    """
+    Base.metadata.create_all(engine)
+    inserted = 0
+    with Session(engine) as db:
+        if db.get(DataVersion, DATA_VERSION_ID) is None:
+            db.add(DataVersion(id=DATA_VERSION_ID, version=0))
+            db.commit()
+        for batch in corpus_rows(rows, seed):
+            insert_file_rows(db, batch)
+            tags = [
+                {"file_id": row["id"], "tag": tag}
+                for row in batch
+                for tag in row["tags"] or []
+            ]
+            if tags:
+                db.execute(insert(FileTag), tags)
+            db.commit()
+            inserted += len(batch)
+        # Una sola modifica di versione e un solo INSERT ... SELECT nel
+        # registro delle modifiche per tutto il corpus
+        bump_data_version(db)
+        record_changes(db, INSERT, true())
+        db.commit()
+    return inserted
+
+
+def sample_filenames(engine: Engine, filetype: FileTypeEnum, n: int) -> list[str]:
+    """
+    Nomi di file del corpus distribuiti su tutta la tabella, per i benchmark
+    di render
+    """
+    with Session(engine) as db:
+        return list(
+            db.execute(
+                select(UploadedFile.filename)
+                .where(UploadedFile.filetype == filetype)
+                .order_by(UploadedFile.id)
+                .limit(n)
+            ).scalars()
+        )
@@ -1,10 +1,35 @@
+from contextlib import asynccontextmanager
+
+import anyio
 from fastapi import FastAPI
 
+from rapid_md.db import SessionLocal
+from rapid_md.jobs import resume_ingest_jobs, stop_jobs
+from rapid_md.metrics import MetricsMiddleware
+from rapid_md.profiling import ProfilingMiddleware, profiling_enabled
+from rapid_md.render_pool import render_pool
 from rapid_md.router_api import router as api_router
 from rapid_md.router_web import render_router
 
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # I job di estrazione rimasti a meta' riprendono all'avvio; allo
+    # spegnimento quelli in corso si fermano dopo il blocco corrente, poi si
+    # chiude il pool di processi del rendering
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(resume_ingest_jobs, SessionLocal)
+        yield
+        stop_jobs.set()
+        tg.cancel_scope.cancel()
+    # shutdown aspetta i processi figli: in un thread, per non bloccare l'event loop
+    await anyio.to_thread.run_sync(render_pool.shutdown)
+
+
+app = FastAPI(lifespan=lifespan)
+if profiling_enabled():
+    app.add_middleware(ProfilingMiddleware)
+app.add_middleware(MetricsMiddleware)
 
 app.include_router(api_router)
 app.include_router(render_router)
@@ -0,0 +1,23 @@
+"""
+Chiave API condivisa dalle route di router_api e dalla profilazione
+"""
+
+import os
+
+API_KEY_ENV = "RAPID_MD_API_KEY"
+
+
+def get_api_key_from_env() -> str:
+    api_key = os.getenv(API_KEY_ENV)
+    if not api_key:
+        raise RuntimeError(f"Environment variable {API_KEY_ENV} not set")
+    return api_key
+
+
+def is_valid_api_key(x_api_key: str | None) -> bool:
+    """
+    True se `x_api_key` e' la chiave configurata; senza chiave configurata
+    nessuna richiesta e' autorizzata
+    """
+    api_key = os.getenv(API_KEY_ENV)
+    return bool(api_key) and x_api_key == api_key
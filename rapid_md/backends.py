@@ -0,0 +1,203 @@
+import os
+import shutil
+import tempfile
+import time
+from typing import BinaryIO, Iterable, Iterator
+from sqlalchemy import LargeBinary, func, select
+from sqlalchemy.orm import Session
+from rapid_md.models import Blob
+
+STORAGE_BACKEND_ENV = "RAPID_MD_STORAGE_BACKEND"
+STORAGE_PATH_ENV = "RAPID_MD_STORAGE_PATH"
+
+# Estensione dei file su disco per ogni codifica dei blob
+ENCODING_SUFFIXES = {None: "", "gzip": ".gz"}
+
+TEMP_PREFIX = ".tmp-"
+
+# Blocchi con cui i contenuti su file vengono copiati nel backend
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class DatabaseBackend:
+    """
+    Contenuto salvato nella colonna blobs.content (default)
+    """
+
+    name = "db"
+
+    def save(
+        self,
+        content_hash: str,
+        encoding: str | None,
+        data: bytes | BinaryIO | Iterable[bytes],
+    ) -> bytes:
+        # Il valore restituito va nella colonna blobs.content
+        if isinstance(data, bytes):
+            return data
+        if not hasattr(data, "read"):
+            return b"".join(data)
+        data.seek(0)
+        return data.read()
+
+    def read(self, db: Session, content_hash: str, encoding: str | None) -> bytes:
+        return db.execute(
+            select(Blob.content).where(Blob.content_hash == content_hash)
+        ).scalar_one()
+
+    def read_range(
+        self,
+        db: Session,
+        content_hash: str,
+        encoding: str | None,
+        start: int,
+        length: int,
+    ) -> bytes:
+        # substr e' 1-based sia su SQLite (blob) che su PostgreSQL (bytea)
+        return db.execute(
+            select(
+                func.substr(Blob.content, start + 1, length, type_=LargeBinary)
+            ).where(Blob.content_hash == content_hash)
+        ).scalar_one()
+
+    def path(self, content_hash: str, encoding: str | None) -> str | None:
+        return None
+
+    def remove(self, content_hash: str, encoding: str | None) -> None:
+        # Il contenuto sparisce insieme alla riga di blobs
+        pass
+
+
+class FilesystemBackend:
+    """
+    Un file per blob in `root`, in sottocartelle dai primi caratteri
+    dell'hash (root/ab/cd/abcd...) per non avere milioni di file in una
+    sola directory. Le scritture sono atomiche: file temporaneo nella stessa
+    cartella, fsync e rename.
+    """
+
+    name = "fs"
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+
+    def path(self, content_hash: str, encoding: str | None) -> str:
+        return os.path.join(
+            self.root,
+            content_hash[:2],
+            content_hash[2:4],
+            content_hash + ENCODING_SUFFIXES[encoding],
+        )
+
+    def save(
+        self,
+        content_hash: str,
+        encoding: str | None,
+        data: bytes | BinaryIO | Iterable[bytes],
+    ) -> None:
+        """
+        Scrive il contenuto, copiandolo a blocchi se `data` e' un file o
+        un iteratore di blocchi
+        """
+        path = self.path(content_hash, encoding)
+        if os.path.exists(path):
+            # Stesso hash e codifica: stessi byte. Aggiorna mtime, che
+            # protegge il file dal garbage collection (vedi orphan_files)
+            os.utime(path)
+            return None
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=TEMP_PREFIX)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                if isinstance(data, bytes):
+                    f.write(data)
+                elif hasattr(data, "read"):
+                    data.seek(0)
+                    shutil.copyfileobj(data, f, COPY_CHUNK_SIZE)
+                else:
+                    for chunk in data:
+                        f.write(chunk)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except FileNotFoundError:
+                pass
+            raise
+        return None
+
+    def read(self, db: Session, content_hash: str, encoding: str | None) -> bytes:
+        with open(self.path(content_hash, encoding), "rb") as f:
+            return f.read()
+
+    def read_range(
+        self,
+        db: Session,
+        content_hash: str,
+        encoding: str | None,
+        start: int,
+        length: int,
+    ) -> bytes:
+        with open(self.path(content_hash, encoding), "rb") as f:
+            f.seek(start)
+            return f.read(length)
+
+    def remove(self, content_hash: str, encoding: str | None) -> None:
+        try:
+            os.unlink(self.path(content_hash, encoding))
+        except FileNotFoundError:
+            pass
+
+    def iter_files(self) -> Iterator[str]:
+        for directory, _, filenames in os.walk(self.root):
+            for filename in filenames:
+                yield os.path.join(directory, filename)
+
+    def orphan_files(self, db: Session, grace_seconds: float) -> Iterator[str]:
+        """
+        File senza una riga di blobs che li usi, piu' vecchi di
+        `grace_seconds`. Il periodo di grazia copre gli upload in corso,
+        che scrivono il file prima di fare commit della riga.
+        """
+        cutoff = time.time() - grace_seconds
+        suffixes = {suffix: encoding for encoding, suffix in ENCODING_SUFFIXES.items()}
+        for path in self.iter_files():
+            if os.path.getmtime(path) > cutoff:
+                continue
+            name = os.path.basename(path)
+            if name.startswith(TEMP_PREFIX):
+                # Scrittura interrotta
+                yield path
+                continue
+            content_hash, suffix = name[:64], name[64:]
+            if suffix not in suffixes:
+                continue
+            referenced = db.execute(
+                select(Blob.content_hash).where(
+                    Blob.content_hash == content_hash,
+                    Blob.backend == self.name,
+                    Blob.encoding.is_(None)
+                    if suffixes[suffix] is None
+                    else Blob.encoding == suffixes[suffix],
+                )
+            ).first()
+            if referenced is None:
+                yield path
+
+
+def get_backend(name: str) -> DatabaseBackend | FilesystemBackend:
+    if name == DatabaseBackend.name:
+        return DatabaseBackend()
+    if name == FilesystemBackend.name:
+        return FilesystemBackend(os.getenv(STORAGE_PATH_ENV, "./blobs"))
+    raise ValueError(f"Unknown storage backend '{name}'")
+
+
+def default_backend_name() -> str:
+    """
+    Backend in cui vengono salvati i nuovi blob
+    """
+    return os.getenv(STORAGE_BACKEND_ENV, DatabaseBackend.name)
@@ -0,0 +1,154 @@
+import asyncio
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Iterator
+from sqlalchemy import DateTime, delete, event, func, insert, literal, select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import ColumnElement
+from rapid_md.models import FileChange, UploadedFile
+
+INSERT = "insert"
+DELETE = "delete"
+
+CHANGES_PAGE_SIZE = 1000
+CHANGES_MAX_PAGE_SIZE = 10000
+
+# Secondi massimi di attesa di un long-poll
+CHANGES_MAX_WAIT = 60
+# Intervallo di controllo del database durante l'attesa: le modifiche fatte
+# da altri processi non arrivano tramite il notifier
+CHANGES_POLL_INTERVAL = 1.0
+# Commento inviato sugli stream SSE inattivi, per non farli chiudere dai proxy
+CHANGES_KEEPALIVE = 15.0
+
+
+def record_changes(db: Session, op: str, condition: ColumnElement[bool]) -> None:
+    """
+    Registra una modifica per ogni file che soddisfa `condition`, con un
+    INSERT ... SELECT: le cancellazioni vanno registrate prima di eliminare
+    le righe. Va chiamata dopo bump_data_version, nella stessa transazione:
+    il lock sulla riga di data_version serializza le scritture, quindi i
+    seq diventano visibili in ordine crescente anche su PostgreSQL.
+    """
+    db.execute(
+        insert(FileChange).from_select(
+            ["file_id", "op", "changed_at"],
+            select(
+                UploadedFile.id,
+                literal(op),
+                literal(datetime.utcnow(), DateTime),
+            )
+            .where(condition)
+            .order_by(UploadedFile.created_at, UploadedFile.id),
+        )
+    )
+    db.info["changes_recorded"] = True
+
+
+def fetch_changes(db: Session, since: int, limit: int) -> list:
+    """
+    Modifiche con seq maggiore di `since`, con i metadati dei file ancora
+    presenti. Chiude la transazione: chi attende nuove modifiche non tiene
+    occupata una connessione e alla lettura successiva vede i nuovi commit.
+    """
+    try:
+        return db.execute(
+            select(
+                FileChange.seq,
+                FileChange.op,
+                FileChange.file_id,
+                FileChange.changed_at,
+                UploadedFile.id,
+                UploadedFile.filename,
+                UploadedFile.created_at,
+                UploadedFile.filetype,
+                UploadedFile.tags,
+            )
+            .outerjoin(
+                UploadedFile,
+                (UploadedFile.id == FileChange.file_id) & (FileChange.op == INSERT),
+            )
+            .where(FileChange.seq > since)
+            .order_by(FileChange.seq)
+            .limit(limit)
+        ).all()
+    finally:
+        db.rollback()
+
+
+def oldest_available_seq(db: Session) -> int | None:
+    """
+    Primo seq ancora presente dopo la pulizia del registro (None se vuoto)
+    """
+    try:
+        return db.execute(select(func.min(FileChange.seq))).scalar()
+    finally:
+        db.rollback()
+
+
+def prune_changes(db: Session, before: datetime) -> int:
+    """
+    Cancella le modifiche registrate prima di `before`, tenendo sempre
+    l'ultima: i client fermi a un seq cancellato devono risincronizzarsi
+    """
+    last = db.execute(select(func.max(FileChange.seq))).scalar()
+    if last is None:
+        return 0
+    deleted = db.execute(
+        delete(FileChange).where(FileChange.changed_at < before, FileChange.seq < last)
+    ).rowcount
+    db.commit()
+    return deleted
+
+
+class ChangeNotifier:
+    """
+    Risveglia i long-poll e gli stream SSE in attesa nello stesso processo
+    quando una transazione con modifiche registrate fa commit
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._waiters: set[tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+
+    def notify(self) -> None:
+        # Chiamata dai thread del database: gli eventi vanno impostati
+        # nell'event loop a cui appartengono
+        with self._lock:
+            waiters = list(self._waiters)
+        for loop, changed in waiters:
+            try:
+                loop.call_soon_threadsafe(changed.set)
+            except RuntimeError:
+                # Event loop gia' chiuso
+                pass
+
+    @contextmanager
+    def listen(self) -> Iterator[asyncio.Event]:
+        """
+        Registra un evento prima di leggere il database: un commit che
+        avviene tra la lettura e l'attesa non viene perso
+        """
+        waiter = (asyncio.get_running_loop(), asyncio.Event())
+        with self._lock:
+            self._waiters.add(waiter)
+        try:
+            yield waiter[1]
+        finally:
+            with self._lock:
+                self._waiters.discard(waiter)
+
+
+change_notifier = ChangeNotifier()
+
+
+@event.listens_for(Session, "after_commit")
+def notify_changes(session: Session) -> None:
+    if session.info.pop("changes_recorded", False):
+        change_notifier.notify()
+
+
+@event.listens_for(Session, "after_rollback")
+def forget_changes(session: Session) -> None:
+    session.info.pop("changes_recorded", None)
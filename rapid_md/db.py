@@ -1,12 +1,213 @@
 import os
+import threading
+import time
 from sqlalchemy.orm import Session, sessionmaker
-from sqlalchemy import create_engine
-from typing import Generator
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.asyncio import (
+    AsyncEngine,
+    AsyncSession,
+    async_sessionmaker,
+    create_async_engine,
+)
+from sqlalchemy.pool import AsyncAdaptedQueuePool, QueuePool
+from starlette.concurrency import run_in_threadpool
+from typing import Any, AsyncGenerator, Callable, Generator
+from rapid_md.metrics import instrument_engine
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./test.db")
-engine = create_engine(DATABASE_URL)
+
+# Configurazione del pool di connessioni
+POOL_SIZE_ENV = "RAPID_MD_DB_POOL_SIZE"
+MAX_OVERFLOW_ENV = "RAPID_MD_DB_MAX_OVERFLOW"
+POOL_TIMEOUT_ENV = "RAPID_MD_DB_POOL_TIMEOUT"
+POOL_RECYCLE_ENV = "RAPID_MD_DB_POOL_RECYCLE"
+POOL_PRE_PING_ENV = "RAPID_MD_DB_POOL_PRE_PING"
+
+# Pragma applicati a ogni nuova connessione SQLite
+SQLITE_MMAP_SIZE_ENV = "RAPID_MD_SQLITE_MMAP_SIZE"
+SQLITE_BUSY_TIMEOUT_ENV = "RAPID_MD_SQLITE_BUSY_TIMEOUT"
+
+
+class PoolStats:
+    """
+    Contatori del pool: checkout, attese per ottenere una connessione, timeout
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self) -> None:
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def record_checkout(self, wait: float) -> None:
+        with self._lock:
+            self.checkouts += 1
+            self.wait_seconds_total += wait
+            self.wait_seconds_max = max(self.wait_seconds_max, wait)
+
+    def record_timeout(self) -> None:
+        with self._lock:
+            self.timeouts += 1
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": self.wait_seconds_total,
+                "wait_seconds_max": self.wait_seconds_max,
+                "wait_seconds_avg": self.wait_seconds_total / self.checkouts
+                if self.checkouts
+                else 0.0,
+            }
+
+
+pool_stats = PoolStats()
+
+
+class InstrumentedQueuePool(QueuePool):
+    """
+    QueuePool che misura il tempo di attesa di ogni checkout
+    """
+
+    def connect(self):
+        start = time.perf_counter()
+        try:
+            connection = super().connect()
+        except PoolTimeoutError:
+            pool_stats.record_timeout()
+            raise
+        pool_stats.record_checkout(time.perf_counter() - start)
+        return connection
+
+
+class InstrumentedAsyncQueuePool(AsyncAdaptedQueuePool, InstrumentedQueuePool):
+    """
+    Stesso conteggio dei checkout per l'engine asincrono
+    """
+
+
+def pool_options(poolclass: type[QueuePool] = InstrumentedQueuePool) -> dict:
+    return {
+        "poolclass": poolclass,
+        "pool_size": int(os.getenv(POOL_SIZE_ENV, "5")),
+        "max_overflow": int(os.getenv(MAX_OVERFLOW_ENV, "10")),
+        "pool_timeout": float(os.getenv(POOL_TIMEOUT_ENV, "30")),
+        "pool_recycle": int(os.getenv(POOL_RECYCLE_ENV, "1800")),
+        "pool_pre_ping": os.getenv(POOL_PRE_PING_ENV, "1").lower()
+        in {"1", "true", "yes"},
+    }
+
+
+def is_sqlite_memory(url: str) -> bool:
+    database = make_url(url).database
+    return not database or database == ":memory:" or "mode=memory" in url
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    """
+    WAL permette letture concorrenti durante le scritture; synchronous=NORMAL
+    e' sicuro in WAL e riduce le fsync; mmap e busy_timeout evitano copie e
+    errori "database is locked" sotto carico
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(
+        f"PRAGMA mmap_size={int(os.getenv(SQLITE_MMAP_SIZE_ENV, str(256 * 1024 * 1024)))}"
+    )
+    cursor.execute(
+        f"PRAGMA busy_timeout={int(os.getenv(SQLITE_BUSY_TIMEOUT_ENV, '5000'))}"
+    )
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+def create_db_engine(url: str) -> Engine:
+    if url.startswith("sqlite") and is_sqlite_memory(url):
+        # Database in memoria: un'unica connessione, niente pool da configurare
+        return create_engine(url)
+    db_engine = create_engine(url, **pool_options())
+    if db_engine.dialect.name == "sqlite":
+        event.listen(db_engine, "connect", set_sqlite_pragmas)
+    return db_engine
+
+
+def pool_status() -> dict:
+    """
+    Statistiche del pool del motore principale, per dimensionarlo sotto carico
+    """
+    status = pool_stats.as_dict()
+    pool = engine.pool
+    if isinstance(pool, QueuePool):
+        status.update(
+            {
+                "size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "overflow": pool.overflow(),
+                "checked_in": pool.checkedin(),
+            }
+        )
+    return status
+
+
+engine = create_db_engine(DATABASE_URL)
+instrument_engine(engine)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Engine asincrono opzionale (aiosqlite in locale, asyncpg in produzione)
+ASYNC_DB_ENV = "RAPID_MD_ASYNC_DB"
+
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+
+def async_database_url(url: str) -> str:
+    """
+    Converte un URL sincrono nell'equivalente con driver asincrono,
+    es. postgresql+psycopg2://... -> postgresql+asyncpg://...
+    """
+    scheme, sep, rest = url.partition("://")
+    backend = scheme.split("+")[0]
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No async driver configured for '{backend}'")
+    return ASYNC_DRIVERS[backend] + sep + rest
+
+
+def create_async_db_engine(url: str) -> AsyncEngine:
+    """
+    Engine asincrono per l'URL sincrono `url`, con lo stesso pool di
+    create_db_engine; per SQLite restano il pool di aiosqlite e i pragma
+    """
+    async_url = async_database_url(url)
+    if url.startswith("sqlite"):
+        db_engine = create_async_engine(async_url)
+        event.listen(db_engine.sync_engine, "connect", set_sqlite_pragmas)
+        return db_engine
+    return create_async_engine(async_url, **pool_options(InstrumentedAsyncQueuePool))
+
+
+def async_db_enabled() -> bool:
+    return os.getenv(ASYNC_DB_ENV, "").lower() in {"1", "true", "yes"}
+
+
+async_engine = None
+AsyncSessionLocal = None
+if async_db_enabled():
+    async_engine = create_async_db_engine(DATABASE_URL)
+    instrument_engine(async_engine.sync_engine)
+    AsyncSessionLocal = async_sessionmaker(
+        async_engine, autoflush=False, expire_on_commit=False
+    )
+
 
 def get_db() -> Generator[Session, None, None]:
     db = SessionLocal()
@@ -14,3 +215,28 @@ def get_db() -> Generator[Session, None, None]:
         yield db
     finally:
         db.close()
+
+
+def get_session_factory() -> sessionmaker:
+    """
+    Factory delle sessioni per il lavoro che prosegue dopo la risposta,
+    come i job di estrazione in background
+    """
+    return SessionLocal
+
+
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    if AsyncSessionLocal is None:
+        raise RuntimeError(f"Async database disabled, set {ASYNC_DB_ENV}=1")
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+async def run_db(db: Session | AsyncSession, fn: Callable[..., Any], *args: Any) -> Any:
+    """
+    Esegue fn(session, *args) senza bloccare l'event loop: con una sessione
+    asincrona tramite run_sync, con una sincrona in un thread del pool
+    """
+    if isinstance(db, AsyncSession):
+        return await db.run_sync(fn, *args)
+    return await run_in_threadpool(fn, db, *args)
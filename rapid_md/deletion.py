@@ -0,0 +1,90 @@
+import uuid
+from collections import Counter
+from datetime import datetime
+from typing import Iterable
+from sqlalchemy import and_, delete, func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import ColumnElement
+from rapid_md.changes import DELETE, record_changes
+from rapid_md.models import FileChange, FileTag, UploadedFile
+from rapid_md.search import delete_documents
+from rapid_md.storage import release_blobs
+from rapid_md.tags import delete_file_tags
+from rapid_md.versioning import bump_data_version
+
+
+# Id accettati da una singola cancellazione per elenco: restano sotto il
+# limite di parametri di SQLite
+BULK_DELETE_MAX_IDS = 10000
+
+
+def files_condition(
+    ids: Iterable[uuid.UUID] | None = None,
+    upload_session: uuid.UUID | None = None,
+    tag: str | None = None,
+    created_after: datetime | None = None,
+    created_before: datetime | None = None,
+) -> ColumnElement[bool] | None:
+    """
+    Condizione sui file che soddisfano tutti i filtri indicati
+    (created_after incluso, created_before escluso); None se non ne e'
+    indicato nessuno
+    """
+    conditions = []
+    if ids is not None:
+        conditions.append(UploadedFile.id.in_(set(ids)))
+    if upload_session is not None:
+        conditions.append(UploadedFile.upload_session == upload_session)
+    if tag is not None:
+        conditions.append(
+            UploadedFile.id.in_(select(FileTag.file_id).where(FileTag.tag == tag))
+        )
+    if created_after is not None:
+        conditions.append(UploadedFile.created_at >= created_after)
+    if created_before is not None:
+        conditions.append(UploadedFile.created_at < created_before)
+    return and_(*conditions) if conditions else None
+
+
+def count_files(db: Session, condition: ColumnElement[bool]) -> int:
+    return db.execute(
+        select(func.count()).select_from(UploadedFile).where(condition)
+    ).scalar()
+
+
+def delete_files(db: Session, condition: ColumnElement[bool]) -> int:
+    """
+    Cancella i file che soddisfano `condition` con poche istruzioni
+    DELETE ... WHERE, insieme a tag, documenti di ricerca e riferimenti ai
+    blob, nella transazione corrente. Restituisce il numero di file cancellati.
+
+    I file vengono individuati una volta sola, dalle righe che
+    record_changes aggiunge al registro: la condizione puo' dipendere da
+    tabelle cancellate nel frattempo (file_tags per i filtri sui tag).
+    """
+    bump_data_version(db)
+    # Il lock su data_version serializza le scritture: i seq successivi a
+    # questo sono tutti di questa cancellazione
+    last_seq = db.execute(select(func.max(FileChange.seq))).scalar() or 0
+    record_changes(db, DELETE, condition)
+    deleted = select(FileChange.file_id).where(
+        FileChange.seq > last_seq, FileChange.op == DELETE
+    )
+    content_hashes = Counter(
+        dict(
+            db.execute(
+                select(UploadedFile.content_hash, func.count())
+                .where(UploadedFile.id.in_(deleted))
+                .group_by(UploadedFile.content_hash)
+            ).all()
+        )
+    )
+    if not content_hashes:
+        return 0
+    delete_file_tags(db, deleted)
+    delete_documents(db, deleted)
+    count = db.execute(
+        delete(UploadedFile).where(UploadedFile.id.in_(deleted))
+    ).rowcount
+    release_blobs(db, content_hashes.elements())
+    return count
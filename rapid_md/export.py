@@ -0,0 +1,112 @@
+import io
+import os
+import zipfile
+from typing import Iterator
+from sqlalchemy.orm import Query, Session
+from rapid_md.models import UploadedFile
+from rapid_md.pagination import encode_cursor, keyset_page
+from rapid_md.storage import iter_blob, should_compress
+
+# Righe lette per query e byte letti dallo storage per ogni scrittura
+EXPORT_BATCH_SIZE = 500
+EXPORT_CHUNK_SIZE = 256 * 1024
+
+# Il formato ZIP non rappresenta date precedenti al 1980
+ZIP_MIN_DATE = (1980, 1, 1, 0, 0, 0)
+
+
+class ZipStream(io.RawIOBase):
+    """
+    Destinazione non seekable per ZipFile: accumula i byte scritti finche'
+    il generatore non li preleva. ZipFile scrive allora dimensioni e CRC in
+    un data descriptor dopo ogni membro, senza tornare indietro nel file.
+    """
+
+    def __init__(self):
+        self.chunks = []
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, b) -> int:
+        self.chunks.append(bytes(b))
+        return len(b)
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+def export_query(db: Session) -> Query:
+    # Solo i metadati: il contenuto viene letto un file alla volta
+    return db.query(
+        UploadedFile.id,
+        UploadedFile.filename,
+        UploadedFile.created_at,
+        UploadedFile.filetype,
+        UploadedFile.content_hash,
+        UploadedFile.size,
+    )
+
+
+def iter_export_rows(query: Query, batch_size: int = EXPORT_BATCH_SIZE) -> Iterator:
+    """
+    Righe della query in ordine (created_at, id), `batch_size` per volta
+    con paginazione keyset: nessun cursore resta aperto mentre si leggono
+    i contenuti
+    """
+    cursor = None
+    while True:
+        rows = keyset_page(query, cursor).limit(batch_size).all()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        cursor = encode_cursor(rows[-1].created_at, rows[-1].id)
+
+
+def unique_name(filename: str, used: set[str]) -> str:
+    """
+    Nome del membro nell'archivio: file con lo stesso nome ricevono un
+    suffisso numerico (doc.md, doc-1.md, ...)
+    """
+    name = filename
+    stem, ext = os.path.splitext(filename)
+    n = 0
+    while name in used:
+        n += 1
+        name = f"{stem}-{n}{ext}"
+    used.add(name)
+    return name
+
+
+def iter_zip_archive(
+    db: Session, rows: Iterator, chunk_size: int = EXPORT_CHUNK_SIZE
+) -> Iterator[bytes]:
+    """
+    Costruisce l'archivio ZIP dei file un blocco alla volta: in memoria
+    restano solo il blocco corrente e l'indice centrale dei membri
+    """
+    stream = ZipStream()
+    used = set()
+    with zipfile.ZipFile(stream, "w") as z:
+        for row in rows:
+            zinfo = zipfile.ZipInfo(
+                unique_name(row.filename, used),
+                date_time=max(row.created_at.timetuple()[:6], ZIP_MIN_DATE),
+            )
+            # Dimensione nota in anticipo: ZipFile decide se serve ZIP64
+            zinfo.file_size = row.size
+            zinfo.compress_type = (
+                zipfile.ZIP_DEFLATED
+                if should_compress(row.filename, row.filetype)
+                else zipfile.ZIP_STORED
+            )
+            with z.open(zinfo, "w") as member:
+                for chunk in iter_blob(db, row.content_hash, chunk_size):
+                    member.write(chunk)
+                    if data := stream.take():
+                        yield data
+            if data := stream.take():
+                yield data
+    yield stream.take()
@@ -0,0 +1,176 @@
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from urllib.parse import quote
+from fastapi import Request, Response
+
+
+def make_etag(*parts: str) -> str:
+    """
+    ETag forte costruito a partire da valori gia' memorizzati (hash, versioni)
+    """
+    return '"' + "-".join(parts) + '"'
+
+
+def http_date(value: datetime) -> str:
+    # Le date nel database sono naive in UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return format_datetime(value, usegmt=True)
+
+
+def attachment(filename: str) -> str:
+    """
+    Content-Disposition per un download; il nome puo' contenere caratteri
+    non ASCII (RFC 6266)
+    """
+    return f"attachment; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    # If-None-Match usa il confronto debole: W/"x" e "x" sono equivalenti
+    candidates = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag.removeprefix("W/") in candidates
+
+
+def is_not_modified(
+    request: Request, etag: str, last_modified: datetime | None = None
+) -> bool:
+    """
+    Valuta If-None-Match e If-Modified-Since (RFC 9110, sezione 13.2.2):
+    se e' presente If-None-Match, If-Modified-Since viene ignorato.
+    """
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since is None or last_modified is None:
+        return False
+    try:
+        since = parsedate_to_datetime(if_modified_since)
+    except (TypeError, ValueError):
+        return False
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    if last_modified.tzinfo is None:
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    # Le date HTTP hanno la risoluzione del secondo
+    return last_modified.replace(microsecond=0) <= since
+
+
+def validator_headers(
+    etag: str, last_modified: datetime | None, cache_control: str
+) -> dict:
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def not_modified(headers: dict) -> Response:
+    return Response(status_code=304, headers=headers)
+
+
+def accepts_encoding(request: Request, encoding: str) -> bool:
+    """
+    True se Accept-Encoding ammette `encoding` con q > 0; una voce
+    esplicita prevale sul carattere jolly `*`
+    """
+    wildcard = False
+    for item in request.headers.get("accept-encoding", "").split(","):
+        name, _, params = item.partition(";")
+        name = name.strip().lower()
+        if name not in (encoding, "*"):
+            continue
+        quality = 1.0
+        key, _, value = params.strip().partition("=")
+        if key.strip().lower() == "q":
+            try:
+                quality = float(value)
+            except ValueError:
+                quality = 0.0
+        if name == encoding:
+            return quality > 0
+        wildcard = quality > 0
+    return wildcard
+
+
+# Oltre questo numero di intervalli la richiesta Range viene ignorata
+MAX_RANGES = 16
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def parse_range(header: str, size: int) -> list[tuple[int, int]] | None:
+    """
+    Interpreta un header Range "bytes=..." per una risorsa di `size` byte.
+
+    Restituisce la lista ordinata degli intervalli (start, end) inclusivi,
+    con gli intervalli sovrapposti o adiacenti uniti, oppure None se l'header
+    non e' valido e va ignorato. Solleva RangeNotSatisfiable se nessun
+    intervallo cade dentro la risorsa.
+    """
+    unit, _, spec = header.partition("=")
+    if unit.strip().lower() != "bytes" or not spec.strip():
+        return None
+    ranges = []
+    for part in spec.split(","):
+        first, sep, last = part.strip().partition("-")
+        if not sep:
+            return None
+        try:
+            if first == "":
+                # Suffisso: gli ultimi N byte
+                suffix = int(last)
+                if suffix <= 0:
+                    continue
+                start, end = max(size - suffix, 0), size - 1
+            else:
+                start = int(first)
+                end = int(last) if last else size - 1
+                if start > end and last:
+                    return None
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        if start < 0 or start >= size:
+            continue
+        ranges.append((start, end))
+    if len(ranges) > MAX_RANGES:
+        return None
+    if not ranges:
+        raise RangeNotSatisfiable(header)
+
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def if_range_matches(request: Request, etag: str, last_modified: datetime) -> bool:
+    """
+    Un Range va servito solo se l'eventuale If-Range corrisponde
+    alla rappresentazione corrente (confronto forte per gli ETag)
+    """
+    if_range = request.headers.get("if-range")
+    if if_range is None:
+        return True
+    if_range = if_range.strip()
+    if if_range.startswith('"') or if_range.startswith("W/"):
+        return if_range == etag
+    try:
+        since = parsedate_to_datetime(if_range)
+    except (TypeError, ValueError):
+        return False
+    return http_date(last_modified) == format_datetime(
+        since.astimezone(timezone.utc), usegmt=True
+    )
@@ -0,0 +1,197 @@
+import os
+import time
+import uuid
+import zipfile
+from datetime import datetime
+from typing import BinaryIO, Iterator
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+from rapid_md.metrics import observe_phase, zip_extraction_duration
+from rapid_md.models import FileTypeEnum, UploadedFile
+from rapid_md.search import document_rows, index_documents, is_searchable
+from rapid_md.storage import prepare_file_blob, save_blob_contents, store_blobs
+from rapid_md.uploads import SpoolWriter, SpooledUpload, get_upload_chunk_size
+
+
+ZIP_BATCH_SIZE_ENV = "RAPID_MD_ZIP_BATCH_SIZE"
+ZIP_BATCH_BYTES_ENV = "RAPID_MD_ZIP_BATCH_BYTES"
+
+
+def guess_filetype(filename: str) -> FileTypeEnum:
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in {".md", ".markdown"}:
+        return FileTypeEnum.markdown
+    elif ext in {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".svg"}:
+        return FileTypeEnum.image
+    else:
+        return FileTypeEnum.document
+
+
+def get_zip_batch_size() -> int:
+    return int(os.getenv(ZIP_BATCH_SIZE_ENV, "500"))
+
+
+def get_zip_batch_bytes() -> int:
+    # Dimensione originale dei contenuti oltre la quale un blocco viene salvato
+    # anche se ha meno di RAPID_MD_ZIP_BATCH_SIZE righe
+    return int(os.getenv(ZIP_BATCH_BYTES_ENV, str(64 * 1024 * 1024)))
+
+
+def zip_members(z: zipfile.ZipFile) -> list[zipfile.ZipInfo]:
+    """
+    Membri da salvare, nell'ordine dell'archivio (le cartelle sono escluse)
+    """
+    return [zipinfo for zipinfo in z.infolist() if not zipinfo.is_dir()]
+
+
+def spool_member(
+    z: zipfile.ZipFile, zipinfo: zipfile.ZipInfo, chunk_size: int
+) -> SpooledUpload:
+    """
+    Decomprime un membro a blocchi su file temporaneo, calcolandone hash e
+    dimensione durante la copia
+    """
+    writer = SpoolWriter(chunk_size)
+    try:
+        with z.open(zipinfo) as f:
+            while chunk := f.read(chunk_size):
+                writer.write(chunk)
+    except BaseException:
+        writer.file.close()
+        raise
+    return writer.finish()
+
+
+def iter_zip_batches(
+    archive: BinaryIO,
+    upload_session: uuid.UUID,
+    created_at: datetime,
+    batch_size: int,
+    skip: int = 0,
+    errors: list[dict] | None = None,
+    batch_bytes: int | None = None,
+) -> Iterator[list[dict]]:
+    """
+    Decomprime l'archivio e produce le righe da inserire, `batch_size` alla
+    volta o appena i contenuti del blocco superano `batch_bytes` byte.
+    I primi `skip` membri vengono saltati (gia' salvati da un job interrotto).
+    Se `errors` e' una lista, i membri illeggibili vi vengono aggiunti invece
+    di interrompere l'estrazione.
+
+    Ogni membro passa a blocchi da un file temporaneo: in memoria restano solo
+    il testo dei file markdown, che serve all'indice di ricerca, e i file
+    temporanei piu' piccoli di RAPID_MD_UPLOAD_CHUNK_SIZE. I file di un blocco
+    vengono chiusi quando il chiamante chiede il blocco successivo.
+    """
+    batch_bytes = batch_bytes or get_zip_batch_bytes()
+    chunk_size = get_upload_chunk_size()
+    batch = []
+    files = []
+    size = 0
+    # Tempo di estrazione, esclusi i periodi in cui il chiamante salva i blocchi
+    start = time.perf_counter()
+    paused = 0.0
+    yielded = None
+    try:
+        try:
+            with zipfile.ZipFile(archive) as z:
+                for zipinfo in zip_members(z)[skip:]:
+                    inner_filename = os.path.basename(zipinfo.filename)
+                    filetype = guess_filetype(inner_filename)
+                    try:
+                        spooled = spool_member(z, zipinfo, chunk_size)
+                        files.append(spooled.file)
+                        blob = prepare_file_blob(
+                            inner_filename,
+                            filetype,
+                            spooled.file,
+                            spooled.content_hash,
+                            spooled.size,
+                            chunk_size,
+                        )
+                        if blob.data is not spooled.file:
+                            files.append(blob.data)
+                        content = spooled.read() if is_searchable(filetype) else None
+                    except Exception as e:
+                        if errors is None:
+                            raise
+                        errors.append({"member": zipinfo.filename, "error": str(e)})
+                        continue
+                    # Per i file in un archivio ZIP, non passiamo i tag
+                    batch.append(
+                        {
+                            "id": uuid.uuid4(),
+                            "filename": inner_filename,
+                            "content": content,
+                            "blob": blob,
+                            "content_hash": blob.content_hash,
+                            "size": blob.size,
+                            "created_at": created_at,
+                            "filetype": filetype,
+                            "tags": None,
+                            "upload_session": upload_session,
+                        }
+                    )
+                    size += blob.size
+                    if len(batch) >= batch_size or size >= batch_bytes:
+                        yielded = time.perf_counter()
+                        yield batch
+                        paused += time.perf_counter() - yielded
+                        yielded = None
+                        close_files(files)
+                        batch = []
+                        size = 0
+        finally:
+            end = time.perf_counter()
+            if yielded is not None:
+                # Generatore chiuso mentre il chiamante aveva il blocco
+                paused += end - yielded
+            observe_phase(zip_extraction_duration, "zip", end - start - paused)
+        if batch:
+            yield batch
+    finally:
+        close_files(files)
+
+
+def close_files(files: list[BinaryIO]) -> None:
+    for f in files:
+        f.close()
+    files.clear()
+
+
+def prepare_file_rows(rows: list[dict]) -> list[dict]:
+    """
+    Lavoro di insert_file_rows che non riguarda il database: scrive i
+    contenuti nel backend (i blob delle righe diventano StoredBlob) e
+    restituisce i documenti da indicizzare. Va eseguita nei thread degli
+    upload prima di insert_file_rows su una sessione asincrona.
+    """
+    stored = {
+        blob.content_hash: blob
+        for blob in save_blob_contents(row["blob"] for row in rows)
+    }
+    for row in rows:
+        row["blob"] = stored[row["content_hash"]]
+    return document_rows(rows)
+
+
+def insert_file_rows(
+    db: Session, rows: list[dict], documents: list[dict] | None = None
+) -> int:
+    """
+    Inserisce un blocco di file, con i contenuti deduplicati nella tabella
+    blobs; restituisce i byte risparmiati. `documents` sono quelli restituiti
+    da prepare_file_rows, se gia' chiamata sulle righe.
+    """
+    if documents is None:
+        documents = document_rows(rows)
+    bytes_saved = store_blobs(db, (row["blob"] for row in rows))
+    db.execute(
+        insert(UploadedFile),
+        [
+            {key: value for key, value in row.items() if key not in ("content", "blob")}
+            for row in rows
+        ],
+    )
+    index_documents(db, documents)
+    return bytes_saved
@@ -0,0 +1,238 @@
+import os
+import shutil
+import threading
+import uuid
+import zipfile
+from datetime import datetime, timedelta
+from typing import BinaryIO
+import anyio
+from sqlalchemy import or_, select, update
+from sqlalchemy.orm import Session, sessionmaker
+from rapid_md.changes import INSERT, record_changes
+from rapid_md.ingest import (
+    get_zip_batch_size,
+    insert_file_rows,
+    iter_zip_batches,
+    zip_members,
+)
+from rapid_md.metrics import current_timing
+from rapid_md.models import IngestJob, JobStatusEnum, UploadedFile
+from rapid_md.versioning import bump_data_version
+
+JOBS_PATH_ENV = "RAPID_MD_JOBS_PATH"
+INGEST_WORKERS_ENV = "RAPID_MD_INGEST_WORKERS"
+
+# Errori dei singoli membri conservati nel job; gli altri sono solo contati
+MAX_JOB_ERRORS = 100
+
+# Un job "running" non aggiornato da questo tempo viene considerato abbandonato
+JOB_STALE_SECONDS = 600
+
+# Thread che eseguono i job: ogni job ne occupa uno (e una connessione al
+# database) per tutta la durata, gli altri restano in coda. Sono separati
+# dal threadpool degli endpoint sincroni, che quindi non restano senza thread.
+ingest_limiter = anyio.CapacityLimiter(int(os.getenv(INGEST_WORKERS_ENV, "1")))
+
+# Impostato allo spegnimento: i job si fermano dopo il blocco in corso
+# e tornano in coda, per essere ripresi al prossimo avvio
+stop_jobs = threading.Event()
+
+
+def get_jobs_path() -> str:
+    return os.getenv(JOBS_PATH_ENV, "./jobs")
+
+
+def spool_path(job_id: uuid.UUID) -> str:
+    return os.path.join(get_jobs_path(), f"{job_id}.zip")
+
+
+def spool_archive(job_id: uuid.UUID, archive: BinaryIO) -> None:
+    """
+    Copia l'archivio nello spool a blocchi, con scrittura atomica
+    """
+    path = spool_path(job_id)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    archive.seek(0)
+    with open(tmp_path, "wb") as f:
+        shutil.copyfileobj(archive, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def create_ingest_job(db: Session, filename: str, archive: BinaryIO) -> IngestJob:
+    """
+    Salva l'archivio nello spool e registra il job in coda
+    """
+    job = IngestJob(id=uuid.uuid4(), filename=filename, status=JobStatusEnum.queued)
+    spool_archive(job.id, archive)
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    return job
+
+
+def claim_job(db: Session, job_id: uuid.UUID) -> bool:
+    """
+    Segna il job come in esecuzione se e' in coda o abbandonato: con piu'
+    processi un job viene eseguito da uno solo
+    """
+    now = datetime.utcnow()
+    claimed = db.execute(
+        update(IngestJob)
+        .where(
+            IngestJob.id == job_id,
+            or_(
+                IngestJob.status == JobStatusEnum.queued,
+                (IngestJob.status == JobStatusEnum.running)
+                & (IngestJob.updated_at < now - timedelta(seconds=JOB_STALE_SECONDS)),
+            ),
+        )
+        .values(status=JobStatusEnum.running, updated_at=now)
+    ).rowcount
+    db.commit()
+    return claimed == 1
+
+
+def record_errors(job: IngestJob, errors: list[dict]) -> None:
+    if not errors:
+        return
+    job.error_count += len(errors)
+    kept = list(job.errors or [])
+    job.errors = (kept + errors)[:MAX_JOB_ERRORS]
+
+
+def save_job_batch(
+    db: Session, job: IngestJob, rows: list[dict], errors: list[dict]
+) -> None:
+    """
+    Salva un blocco di file e aggiorna l'avanzamento del job nella stessa
+    transazione: dopo un'interruzione si riparte dal primo membro non salvato
+    """
+    if rows:
+        job.bytes_saved += insert_file_rows(db, rows)
+        job.bytes_done += sum(row["size"] for row in rows)
+        bump_data_version(db)
+        record_changes(db, INSERT, UploadedFile.id.in_([row["id"] for row in rows]))
+    record_errors(job, errors)
+    job.members_done += len(rows) + len(errors)
+    job.updated_at = datetime.utcnow()
+    db.commit()
+
+
+def requeue_job(db: Session, job: IngestJob) -> None:
+    job.status = JobStatusEnum.queued
+    db.commit()
+
+
+def finish_job(
+    db: Session, job: IngestJob, status: JobStatusEnum, error: str | None = None
+) -> None:
+    """
+    Chiude il job e cancella l'archivio dallo spool
+    """
+    job.status = status
+    job.error = error
+    job.updated_at = job.finished_at = datetime.utcnow()
+    db.commit()
+    try:
+        os.unlink(spool_path(job.id))
+    except FileNotFoundError:
+        pass
+
+
+def process_ingest_job(session_factory: sessionmaker, job_id: uuid.UUID) -> None:
+    """
+    Estrae l'archivio del job a blocchi, con un commit per blocco. I membri
+    illeggibili vengono registrati tra gli errori senza fermare il job.
+    """
+    with session_factory() as db:
+        if not claim_job(db, job_id):
+            return
+        job = db.get(IngestJob, job_id)
+        errors = []
+        try:
+            with open(spool_path(job.id), "rb") as archive:
+                with zipfile.ZipFile(archive) as z:
+                    members = zip_members(z)
+                job.members_total = len(members)
+                job.bytes_total = sum(zipinfo.file_size for zipinfo in members)
+                db.commit()
+                batches = iter_zip_batches(
+                    archive,
+                    job.upload_session,
+                    job.created_at,
+                    get_zip_batch_size(),
+                    skip=job.members_done,
+                    errors=errors,
+                )
+                try:
+                    for rows in batches:
+                        save_job_batch(db, job, rows, errors[:])
+                        errors.clear()
+                        if stop_jobs.is_set():
+                            requeue_job(db, job)
+                            return
+                finally:
+                    batches.close()
+            save_job_batch(db, job, [], errors)
+        except Exception as e:
+            db.rollback()
+            finish_job(db, job, JobStatusEnum.failed, str(e))
+            return
+        finish_job(db, job, JobStatusEnum.done)
+
+
+async def run_ingest_job(session_factory: sessionmaker, job_id: uuid.UUID) -> None:
+    # Come BackgroundTask il job gira dopo la risposta, nel contesto della
+    # richiesta: le sue query vanno sotto la route "background"
+    token = current_timing.set(None)
+    try:
+        await anyio.to_thread.run_sync(
+            process_ingest_job, session_factory, job_id, limiter=ingest_limiter
+        )
+    finally:
+        current_timing.reset(token)
+
+
+def pending_jobs(db: Session) -> list[tuple[uuid.UUID, float]]:
+    """
+    Job rimasti in coda o interrotti, con i secondi da attendere prima di
+    poterli riprendere: un job "running" puo' essere ancora in esecuzione
+    in un altro processo finche' non diventa abbandonato
+    """
+    now = datetime.utcnow()
+    stale = timedelta(seconds=JOB_STALE_SECONDS)
+    rows = db.execute(
+        select(IngestJob.id, IngestJob.status, IngestJob.updated_at)
+        .where(IngestJob.status.in_([JobStatusEnum.queued, JobStatusEnum.running]))
+        .order_by(IngestJob.created_at)
+    ).all()
+    return [
+        (
+            job_id,
+            0.0
+            if status == JobStatusEnum.queued
+            else max(0.0, (updated_at + stale - now).total_seconds() + 1),
+        )
+        for job_id, status, updated_at in rows
+    ]
+
+
+async def resume_ingest_jobs(session_factory: sessionmaker) -> None:
+    """
+    Riprende i job pendenti all'avvio dell'applicazione
+    """
+
+    def load() -> list[tuple[uuid.UUID, float]]:
+        with session_factory() as db:
+            return pending_jobs(db)
+
+    async def resume(job_id: uuid.UUID, delay: float) -> None:
+        await anyio.sleep(delay)
+        await run_ingest_job(session_factory, job_id)
+
+    async with anyio.create_task_group() as tg:
+        for job_id, delay in await anyio.to_thread.run_sync(load):
+            tg.start_soon(resume, job_id, delay)
@@ -0,0 +1,164 @@
+"""
+Comandi di manutenzione:
+
+    python -m rapid_md.manage migrate-storage --to fs
+    python -m rapid_md.manage gc-storage --grace-seconds 3600
+    python -m rapid_md.manage prune-changes --older-than-days 30
+    python -m rapid_md.manage delete-files --tag old-import --dry-run
+    python -m rapid_md.manage prerender --session <uuid>
+"""
+
+import argparse
+import os
+import sys
+import uuid
+from contextlib import closing
+from datetime import datetime, timedelta
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+from rapid_md.backends import COPY_CHUNK_SIZE, FilesystemBackend, get_backend
+from rapid_md.changes import prune_changes
+from rapid_md.deletion import count_files, delete_files, files_condition
+from rapid_md.models import Blob, UploadedFile
+from rapid_md.render_pool import render_pool
+from rapid_md.rendering import prerender_markdown
+from rapid_md.storage import iter_stored_blob
+
+
+def migrate_storage(
+    db: Session,
+    target: str,
+    batch_size: int = 100,
+    chunk_size: int = COPY_CHUNK_SIZE,
+) -> int:
+    """
+    Sposta i blob nel backend `target`, `batch_size` alla volta con un commit
+    per blocco; il contenuto nel backend di origine viene rimosso solo dopo
+    il commit. I byte salvati (compressi compresi) vengono copiati a blocchi
+    di `chunk_size`. Restituisce il numero di blob spostati.
+    """
+    destination = get_backend(target)
+    moved = 0
+    while True:
+        rows = db.execute(
+            select(Blob.content_hash, Blob.backend, Blob.encoding)
+            .where(Blob.backend != destination.name)
+            .order_by(Blob.content_hash)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return moved
+        for content_hash, backend, encoding in rows:
+            with closing(iter_stored_blob(db, content_hash, chunk_size)) as chunks:
+                content = destination.save(content_hash, encoding, chunks)
+            db.execute(
+                update(Blob)
+                .where(Blob.content_hash == content_hash, Blob.backend == backend)
+                .values(content=content, backend=destination.name)
+            )
+        db.commit()
+        for content_hash, backend, encoding in rows:
+            get_backend(backend).remove(content_hash, encoding)
+        moved += len(rows)
+
+
+def gc_storage(db: Session, grace_seconds: float, dry_run: bool = False) -> list[str]:
+    """
+    Cancella dal filesystem i file che nessun blob usa piu': quelli dei blob
+    eliminati con l'ultimo file che li riferiva e le scritture interrotte
+    """
+    backend = get_backend(FilesystemBackend.name)
+    orphans = list(backend.orphan_files(db, grace_seconds))
+    if not dry_run:
+        for path in orphans:
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+    return orphans
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m rapid_md.manage")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    migrate = commands.add_parser(
+        "migrate-storage", help="Move every blob to another storage backend"
+    )
+    migrate.add_argument("--to", required=True, choices=["db", "fs"])
+    migrate.add_argument("--batch-size", type=int, default=100)
+
+    gc = commands.add_parser(
+        "gc-storage", help="Delete files no longer referenced by any blob"
+    )
+    gc.add_argument("--grace-seconds", type=float, default=3600)
+    gc.add_argument("--dry-run", action="store_true")
+
+    prune = commands.add_parser(
+        "prune-changes", help="Delete old entries of the change log"
+    )
+    prune.add_argument("--older-than-days", type=float, default=30)
+
+    remove = commands.add_parser(
+        "delete-files", help="Delete the files matching every given filter"
+    )
+    remove.add_argument("--id", action="append", type=uuid.UUID, dest="ids")
+    remove.add_argument("--session", type=uuid.UUID)
+    remove.add_argument("--tag")
+    remove.add_argument("--created-after", type=datetime.fromisoformat)
+    remove.add_argument("--created-before", type=datetime.fromisoformat)
+    remove.add_argument("--dry-run", action="store_true")
+
+    prerender = commands.add_parser(
+        "prerender", help="Render the markdown files of an upload session"
+    )
+    prerender.add_argument("--session", type=uuid.UUID, required=True)
+
+    args = parser.parse_args(argv)
+    if args.command == "delete-files":
+        condition = files_condition(
+            ids=args.ids,
+            upload_session=args.session,
+            tag=args.tag,
+            created_after=args.created_after,
+            created_before=args.created_before,
+        )
+        if condition is None:
+            parser.error("delete-files requires at least one filter")
+
+    from rapid_md.db import SessionLocal
+
+    with SessionLocal() as db:
+        if args.command == "migrate-storage":
+            moved = migrate_storage(db, args.to, args.batch_size)
+            print(f"Moved {moved} blobs to '{args.to}'")
+        elif args.command == "prune-changes":
+            before = datetime.utcnow() - timedelta(days=args.older_than_days)
+            print(f"Deleted {prune_changes(db, before)} changes")
+        elif args.command == "prerender":
+            condition = UploadedFile.upload_session == args.session
+            try:
+                print(
+                    f"Rendered {prerender_markdown(db, condition)} markdown documents"
+                )
+            finally:
+                render_pool.shutdown()
+        elif args.command == "delete-files":
+            if args.dry_run:
+                print(f"Found {count_files(db, condition)} matching files")
+            else:
+                deleted = delete_files(db, condition)
+                if deleted:
+                    db.commit()
+                print(f"Deleted {deleted} files")
+        else:
+            orphans = gc_storage(db, args.grace_seconds, args.dry_run)
+            for path in orphans:
+                print(path)
+            action = "Found" if args.dry_run else "Deleted"
+            print(f"{action} {len(orphans)} unreferenced files")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,407 @@
+"""
+Metriche in formato testo Prometheus e tempi per richiesta (Server-Timing)
+"""
+
+import os
+import threading
+from abc import ABC, abstractmethod
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.routing import Match
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+SERVER_TIMING_ENV = "RAPID_MD_SERVER_TIMING"
+
+# Limiti superiori dei bucket in secondi (quelli predefiniti dei client Prometheus)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100, 250, 1000)
+
+# Etichetta delle query eseguite fuori da una richiesta, come i job in background
+BACKGROUND_ROUTE = "background"
+# Percorsi che non corrispondono a nessuna route: un'unica etichetta, non una
+# per URL
+UNMATCHED_ROUTE = "unmatched"
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(names: tuple[str, ...], values: tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(
+        f'{name}="{escape_label(str(value))}"' for name, value in zip(names, values)
+    )
+    return "{" + pairs + "}"
+
+
+class Metric(ABC):
+    """
+    Metrica con etichette: un valore per ogni combinazione di etichette.
+    Le sottoclassi definiscono il tipo e le righe della esposizione.
+    """
+
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def clear(self) -> None:
+        with self._lock:
+            self._values.clear()
+
+    @abstractmethod
+    def samples(self) -> Iterator[str]:
+        """
+        Righe di testo dei valori, senza HELP e TYPE
+        """
+
+    def render(self) -> str:
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = list(self._values.items())
+        for labels, value in values:
+            yield f"{self.name}{format_labels(self.labels, labels)} {value}"
+
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *labels: str, amount: float = 1) -> None:
+        self.inc(*labels, amount=-amount)
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labels: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+    ):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels: str) -> None:
+        with self._lock:
+            counts = self._values.get(labels)
+            if counts is None:
+                # Conteggi per bucket (non cumulativi), piu' somma e totale
+                counts = self._values[labels] = [0] * len(self.buckets) + [0, 0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-2] += 1
+            counts[-1] += value
+
+    def count(self, *labels: str) -> int:
+        counts = self._values.get(labels)
+        return counts[-2] if counts else 0
+
+    def samples(self) -> Iterator[str]:
+        with self._lock:
+            values = [(labels, counts[:]) for labels, counts in self._values.items()]
+        names = self.labels + ("le",)
+        for labels, counts in values:
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                yield (
+                    f"{self.name}_bucket{format_labels(names, labels + (bound,))} "
+                    f"{cumulative}"
+                )
+            total, total_sum = counts[-2], counts[-1]
+            yield f"{self.name}_bucket{format_labels(names, labels + ('+Inf',))} {total}"
+            yield f"{self.name}_sum{format_labels(self.labels, labels)} {total_sum}"
+            yield f"{self.name}_count{format_labels(self.labels, labels)} {total}"
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def clear(self) -> None:
+        for metric in self.metrics:
+            metric.clear()
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self.metrics) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.register(
+    Counter(
+        "rapid_md_http_requests_total",
+        "HTTP requests by route and status code",
+        ("method", "route", "status"),
+    )
+)
+http_request_duration = registry.register(
+    Histogram(
+        "rapid_md_http_request_duration_seconds",
+        "HTTP request latency, until the response is complete",
+        ("method", "route"),
+    )
+)
+http_in_flight = registry.register(
+    Gauge(
+        "rapid_md_http_requests_in_flight",
+        "HTTP requests being served",
+        ("method", "route"),
+    )
+)
+db_query_duration = registry.register(
+    Histogram(
+        "rapid_md_db_query_duration_seconds",
+        "Duration of each SQL statement",
+        ("route",),
+    )
+)
+db_queries_per_request = registry.register(
+    Histogram(
+        "rapid_md_db_queries_per_request",
+        "SQL statements executed by each request",
+        ("route",),
+        QUERY_COUNT_BUCKETS,
+    )
+)
+db_time_per_request = registry.register(
+    Histogram(
+        "rapid_md_db_time_per_request_seconds",
+        "Total SQL time of each request",
+        ("route",),
+    )
+)
+upload_bytes = registry.register(
+    Counter(
+        "rapid_md_upload_bytes_total",
+        "Bytes received by the upload endpoints",
+        ("endpoint",),
+    )
+)
+upload_bytes_saved = registry.register(
+    Counter(
+        "rapid_md_upload_bytes_saved_total",
+        "Uploaded bytes not stored again thanks to deduplication",
+        ("endpoint",),
+    )
+)
+base64_decode_duration = registry.register(
+    Histogram(
+        "rapid_md_base64_decode_seconds",
+        "Base64 decoding time of /upload-file bodies",
+    )
+)
+markdown_render_duration = registry.register(
+    Histogram(
+        "rapid_md_markdown_render_seconds",
+        "Markdown to HTML conversion time (cache misses only)",
+    )
+)
+zip_extraction_duration = registry.register(
+    Histogram(
+        "rapid_md_zip_extraction_seconds",
+        "Time spent decompressing and preparing the members of a zip archive",
+    )
+)
+
+
+class RequestTiming:
+    """
+    Tempi della richiesta in corso per fase (db, markdown, base64, zip),
+    condivisi con i thread in cui la richiesta esegue il lavoro sincrono
+    """
+
+    def __init__(self, route: str):
+        self.route = route
+        self.queries = 0
+        self.phases: dict[str, float] = {}
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def server_timing(self, total: float) -> str:
+        parts = [
+            f"{phase};dur={seconds * 1000:.2f}"
+            + (f';desc="{self.queries} queries"' if phase == "db" else "")
+            for phase, seconds in self.phases.items()
+        ]
+        parts.append(f"total;dur={total * 1000:.2f}")
+        return ", ".join(parts)
+
+
+# anyio copia il contesto nei thread: le query e le fasi eseguite con
+# run_in_threadpool o run_cpu vengono attribuite alla richiesta
+current_timing: ContextVar[RequestTiming | None] = ContextVar(
+    "current_timing", default=None
+)
+
+
+def observe_phase(histogram: Histogram, phase: str, seconds: float) -> None:
+    """
+    Registra la durata nell'istogramma e nella fase della richiesta corrente
+    """
+    histogram.observe(seconds)
+    timing = current_timing.get()
+    if timing is not None:
+        timing.add(phase, seconds)
+
+
+@contextmanager
+def timed(histogram: Histogram, phase: str) -> Iterator[None]:
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_phase(histogram, phase, time.perf_counter() - start)
+
+
+def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    timing = current_timing.get()
+    if timing is None:
+        db_query_duration.observe(elapsed, BACKGROUND_ROUTE)
+        return
+    db_query_duration.observe(elapsed, timing.route)
+    timing.queries += 1
+    timing.add("db", elapsed)
+
+
+def handle_error(exception_context) -> None:
+    # Le query fallite non arrivano ad after_cursor_execute
+    connection = exception_context.connection
+    if connection is not None and connection.info.get("query_start"):
+        connection.info["query_start"].pop()
+
+
+def instrument_engine(engine: Engine) -> None:
+    """
+    Conta e misura le query del motore, per route e per richiesta
+    """
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", after_cursor_execute)
+    event.listen(engine, "handle_error", handle_error)
+
+
+def server_timing_enabled() -> bool:
+    return os.getenv(SERVER_TIMING_ENV, "").lower() in {"1", "true", "yes"}
+
+
+def route_label(app: ASGIApp, scope: Scope) -> str:
+    """
+    Template della route (es. /render/{filename:path}), come la risolve il router
+    """
+    router = getattr(app, "router", None)
+    for route in getattr(router, "routes", ()):
+        match, _ = route.matches(scope)
+        if match == Match.FULL:
+            return getattr(route, "path", UNMATCHED_ROUTE)
+    return UNMATCHED_ROUTE
+
+
+class MetricsMiddleware:
+    """
+    Middleware ASGI: latenza, richieste in corso e query SQL per route, e
+    header Server-Timing se RAPID_MD_SERVER_TIMING e' attivo
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.server_timing = server_timing_enabled()
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        # Starlette mette in scope l'applicazione, di cui si usano le route
+        route = route_label(scope.get("app"), scope)
+        timing = RequestTiming(route)
+        token = current_timing.set(timing)
+        status = "500"
+        start = time.perf_counter()
+        finished = False
+
+        def finish() -> None:
+            # Una sola volta per richiesta: all'invio dell'ultimo blocco del
+            # body, prima degli eventuali BackgroundTasks, oppure all'uscita
+            # se la risposta non e' stata completata
+            nonlocal finished
+            if finished:
+                return
+            finished = True
+            http_in_flight.dec(method, route)
+            http_requests.inc(method, route, status)
+            http_request_duration.observe(time.perf_counter() - start, method, route)
+            db_queries_per_request.observe(timing.queries, route)
+            db_time_per_request.observe(timing.phases.get("db", 0.0), route)
+
+        async def send_with_metrics(message: Message) -> None:
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = str(message["status"])
+                if self.server_timing:
+                    # Per le risposte in streaming vale solo fino all'invio
+                    # degli header
+                    headers = list(message.get("headers", []))
+                    headers.append(
+                        (
+                            b"server-timing",
+                            timing.server_timing(time.perf_counter() - start).encode(
+                                "latin-1"
+                            ),
+                        )
+                    )
+                    message = {**message, "headers": headers}
+            await send(message)
+            if message["type"] == "http.response.body" and not message.get(
+                "more_body", False
+            ):
+                finish()
+
+        http_in_flight.inc(method, route)
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            finish()
+            current_timing.reset(token)
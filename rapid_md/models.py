@@ -1,9 +1,24 @@
 import uuid
-from sqlalchemy import Column, String, DateTime, Enum, JSON
+from sqlalchemy import (
+    DDL,
+    BigInteger,
+    Column,
+    ForeignKey,
+    DateTime,
+    Enum,
+    Index,
+    Integer,
+    JSON,
+    LargeBinary,
+    String,
+    Text,
+    event,
+)
 from sqlalchemy.dialects.postgresql import UUID
 from sqlalchemy.ext.declarative import declarative_base
 from datetime import datetime
 import enum
+import hashlib
 
 Base = declarative_base()
 
@@ -14,8 +29,48 @@ class FileTypeEnum(str, enum.Enum):
     document = "document"
 
 
+class JobStatusEnum(str, enum.Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
+def content_sha256(context) -> str:
+    return hashlib.sha256(context.get_current_parameters()["content"]).hexdigest()
+
+
+def content_length(context) -> int:
+    return len(context.get_current_parameters()["content"])
+
+
+class Blob(Base):
+    """
+    Contenuto dei file indirizzato per sha256: file identici condividono
+    lo stesso blob, che viene cancellato quando refcount arriva a zero
+    """
+
+    __tablename__ = "blobs"
+
+    content_hash = Column(String(64), primary_key=True, default=content_sha256)
+    # byte del blob se salvati nel database, NULL se stanno in un altro backend
+    content = Column(LargeBinary, nullable=True)
+    backend = Column(String(16), nullable=False, default="db", server_default="db")
+    # codifica di `content` (es. "gzip"), None se salvato non compresso
+    encoding = Column(String(16), nullable=True)
+    size = Column(BigInteger, default=content_length, nullable=False)  # byte originali
+    refcount = Column(Integer, nullable=False, default=1)  # file che lo usano
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
 class UploadedFile(Base):
     __tablename__ = "uploaded_files"
+    __table_args__ = (
+        # lookup per nome file usato da /render: a parita' di nome vince il piu' recente
+        Index("ix_uploaded_files_filename_created_at", "filename", "created_at"),
+        # paginazione keyset di /files
+        Index("ix_uploaded_files_created_at_id", "created_at", "id"),
+    )
 
     id = Column(
         UUID(as_uuid=True),
@@ -25,7 +80,14 @@ class UploadedFile(Base):
         nullable=False,
     )
     filename = Column(String, nullable=False)
-    content = Column(String, nullable=False)  # base64 o testo
+    # sha256 esadecimale del contenuto, salvato una sola volta nella tabella blobs
+    content_hash = Column(
+        String(64),
+        ForeignKey("blobs.content_hash", name="fk_uploaded_files_content_hash_blobs"),
+        nullable=False,
+        index=True,
+    )
+    size = Column(BigInteger, nullable=False)  # byte
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     filetype = Column(Enum(FileTypeEnum), nullable=False)
     tags = Column(JSON, nullable=True)  # campo JSON opzionale per i tag
@@ -35,3 +97,160 @@ class UploadedFile(Base):
         nullable=False,
         index=True,
     )  # identificativo della sessione di upload, condiviso tra file caricati insieme
+
+
+class FileTag(Base):
+    """
+    Indice normalizzato dei tag: una riga per coppia (file, tag), tenuta
+    allineata alla colonna JSON `tags` su upload e cancellazione
+    """
+
+    __tablename__ = "file_tags"
+    __table_args__ = (Index("ix_file_tags_tag_file_id", "tag", "file_id"),)
+
+    file_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("uploaded_files.id", ondelete="CASCADE"),
+        primary_key=True,
+    )
+    tag = Column(String, primary_key=True)
+
+
+class SearchDocument(Base):
+    """
+    Testo dei documenti markdown indicizzato per la ricerca full-text:
+    su SQLite da una tabella FTS5 a contenuto esterno, su PostgreSQL da un
+    indice GIN su tsvector (vedi i DDL qui sotto)
+    """
+
+    __tablename__ = "search_documents"
+
+    # rowid della tabella FTS5, che richiede una chiave intera
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    file_id = Column(
+        UUID(as_uuid=True),
+        ForeignKey("uploaded_files.id", ondelete="CASCADE"),
+        unique=True,
+        nullable=False,
+    )
+    filename = Column(String, nullable=False)
+    body = Column(Text, nullable=False)
+
+
+# FTS5 con contenuto esterno: i trigger tengono l'indice allineato alla tabella
+SQLITE_SEARCH_DDL = [
+    "CREATE VIRTUAL TABLE search_documents_fts USING fts5("
+    "filename, body, content='search_documents', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER search_documents_ai AFTER INSERT ON search_documents BEGIN "
+    "INSERT INTO search_documents_fts(rowid, filename, body) "
+    "VALUES (new.id, new.filename, new.body); END",
+    "CREATE TRIGGER search_documents_ad AFTER DELETE ON search_documents BEGIN "
+    "INSERT INTO search_documents_fts(search_documents_fts, rowid, filename, body) "
+    "VALUES ('delete', old.id, old.filename, old.body); END",
+]
+POSTGRES_SEARCH_DDL = [
+    "CREATE INDEX ix_search_documents_tsv ON search_documents "
+    "USING gin (to_tsvector('simple', filename || ' ' || body))",
+]
+
+for statement in SQLITE_SEARCH_DDL:
+    event.listen(
+        SearchDocument.__table__,
+        "after_create",
+        DDL(statement).execute_if(dialect="sqlite"),
+    )
+for statement in POSTGRES_SEARCH_DDL:
+    event.listen(
+        SearchDocument.__table__,
+        "after_create",
+        DDL(statement).execute_if(dialect="postgresql"),
+    )
+event.listen(
+    SearchDocument.__table__,
+    "before_drop",
+    DDL("DROP TABLE IF EXISTS search_documents_fts").execute_if(dialect="sqlite"),
+)
+
+
+class RenderedMarkdown(Base):
+    __tablename__ = "rendered_markdown"
+
+    # sha256 del sorgente markdown: lo stesso contenuto viene renderizzato una volta sola
+    content_hash = Column(String(64), primary_key=True)
+    html = Column(Text, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+class DataVersion(Base):
+    """
+    Riga singola con la versione globale dei dati, incrementata a ogni
+    upload e cancellazione: permette di sapere se la lista dei file e' cambiata
+    """
+
+    __tablename__ = "data_version"
+
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+event.listen(
+    DataVersion.__table__,
+    "after_create",
+    DDL(
+        "INSERT INTO data_version (id, version, updated_at) "
+        "VALUES (1, 0, CURRENT_TIMESTAMP)"
+    ),
+)
+
+
+class IngestJob(Base):
+    """
+    Estrazione in background di un archivio ZIP salvato nello spool.
+    I contatori sono aggiornati nella stessa transazione dei file salvati:
+    `members_done` indica da dove riprendere dopo un riavvio.
+    """
+
+    __tablename__ = "ingest_jobs"
+
+    id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4)
+    filename = Column(String, nullable=False)
+    status = Column(
+        Enum(JobStatusEnum), nullable=False, default=JobStatusEnum.queued, index=True
+    )
+    upload_session = Column(UUID(as_uuid=True), default=uuid.uuid4, nullable=False)
+    members_total = Column(Integer, nullable=True)  # noto dopo aver letto l'indice
+    members_done = Column(Integer, nullable=False, default=0)  # salvati o falliti
+    bytes_total = Column(BigInteger, nullable=True)  # byte decompressi
+    bytes_done = Column(BigInteger, nullable=False, default=0)
+    bytes_saved = Column(BigInteger, nullable=False, default=0)  # deduplicati
+    error_count = Column(Integer, nullable=False, default=0)
+    errors = Column(JSON, nullable=True)  # primi errori: [{"member", "error"}]
+    error = Column(Text, nullable=True)  # motivo del fallimento dell'intero job
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # aggiornato a ogni blocco salvato: un job "running" fermo da troppo
+    # tempo appartiene a un processo terminato e puo' essere ripreso
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class FileChange(Base):
+    """
+    Registro delle modifiche per i client di sincronizzazione: una riga per
+    ogni file aggiunto o cancellato, in ordine di `seq`. Le righe di
+    cancellazione restano dopo che il file e' stato eliminato.
+    """
+
+    __tablename__ = "file_changes"
+    # AUTOINCREMENT: su SQLite i seq non vengono riusati dopo una pulizia
+    __table_args__ = {"sqlite_autoincrement": True}
+
+    seq = Column(
+        BigInteger().with_variant(Integer, "sqlite"),
+        primary_key=True,
+        autoincrement=True,
+    )
+    file_id = Column(UUID(as_uuid=True), nullable=False)
+    op = Column(String(8), nullable=False)  # "insert" o "delete"
+    changed_at = Column(DateTime, default=datetime.utcnow, nullable=False)
@@ -0,0 +1,58 @@
+import base64
+import uuid
+from datetime import datetime
+from sqlalchemy import and_, or_
+from sqlalchemy.orm import Query
+from rapid_md.models import UploadedFile
+
+
+def encode_cursor(created_at: datetime, file_id: uuid.UUID) -> str:
+    """
+    Codifica la posizione (created_at, id) di una riga in un cursore opaco
+    """
+    raw = f"{created_at.isoformat()}|{file_id.hex}"
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    """
+    Inverso di encode_cursor; solleva ValueError se il cursore non e' valido
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        created_at, file_id = raw.split("|")
+        return datetime.fromisoformat(created_at), uuid.UUID(file_id)
+    except (ValueError, UnicodeError) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def keyset_page(query: Query, cursor: str | None, descending: bool = False) -> Query:
+    """
+    Ordina la query per (created_at, id) e, se presente un cursore,
+    restituisce solo le righe successive ad esso (paginazione keyset)
+    """
+    if cursor:
+        created_at, file_id = decode_cursor(cursor)
+        if descending:
+            query = query.filter(
+                or_(
+                    UploadedFile.created_at < created_at,
+                    and_(
+                        UploadedFile.created_at == created_at,
+                        UploadedFile.id < file_id,
+                    ),
+                )
+            )
+        else:
+            query = query.filter(
+                or_(
+                    UploadedFile.created_at > created_at,
+                    and_(
+                        UploadedFile.created_at == created_at,
+                        UploadedFile.id > file_id,
+                    ),
+                )
+            )
+    if descending:
+        return query.order_by(UploadedFile.created_at.desc(), UploadedFile.id.desc())
+    return query.order_by(UploadedFile.created_at, UploadedFile.id)
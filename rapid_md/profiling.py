@@ -0,0 +1,346 @@
+"""
+Profilazione su richiesta di singole richieste HTTP (pstats o stack collassati)
+e campionamento di 1 richiesta su N di render_file e upload_file
+"""
+
+import io
+import itertools
+import marshal
+import os
+import pstats
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from typing import Iterator
+from urllib.parse import parse_qs
+import anyio
+from fastapi import Response
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+from rapid_md.auth import is_valid_api_key
+from rapid_md.http_utils import attachment
+from rapid_md.metrics import route_label
+
+PROFILING_ENV = "RAPID_MD_PROFILING"
+PROFILE_SAMPLE_RATE_ENV = "RAPID_MD_PROFILE_SAMPLE_RATE"
+PROFILE_PATH_ENV = "RAPID_MD_PROFILE_PATH"
+
+PROFILE_PARAM = "profile"
+PROFILE_HEADER = b"x-profile"
+
+TEXT = "text"
+PSTATS = "pstats"
+COLLAPSED = "collapsed"
+FORMATS = {TEXT, PSTATS, COLLAPSED}
+
+# Route profilate dal campionamento continuo
+SAMPLED_ROUTES = {"/render/{filename:path}", "/upload-file"}
+
+# Funzioni mostrate nel riepilogo testuale, per tempo cumulativo
+TEXT_LIMIT = 60
+
+RETURN_EVENTS = {"return", "c_return", "c_exception"}
+
+
+def function_key(code) -> tuple[str, int, str]:
+    # Stesse chiavi di cProfile: pstats e gli strumenti che lo leggono
+    # (snakeviz, ecc.) le riconoscono
+    return code.co_filename, code.co_firstlineno, code.co_name
+
+
+def builtin_key(function) -> tuple[str, int, str]:
+    module = getattr(function, "__module__", None)
+    name = getattr(function, "__qualname__", repr(function))
+    return "~", 0, f"<built-in method {module + '.' if module else ''}{name}>"
+
+
+def function_label(key: tuple[str, int, str]) -> str:
+    filename, line, name = key
+    if filename == "~":
+        return name
+    return f"{name} ({os.path.basename(filename)}:{line})"
+
+
+class ThreadProfile:
+    """
+    Stack delle chiamate e tempi raccolti in un singolo thread
+    """
+
+    def __init__(self):
+        # [chiave, frame, e' una funzione C, inizio, tempo dei figli]
+        self.stack: list[list] = []
+        # chiave -> [chiamate primitive, chiamate, tempo proprio, cumulativo, chiamanti]
+        self.stats: dict[tuple, list] = {}
+        # stack collassato -> tempo proprio
+        self.stacks: dict[str, float] = {}
+
+    def push(self, key: tuple, frame, builtin: bool, now: float) -> None:
+        self.stack.append([key, frame, builtin, now, 0.0])
+
+    def pop(self, now: float) -> None:
+        key, _, _, start, children = self.stack.pop()
+        total = now - start
+        own = total - children
+        parent = self.stack[-1] if self.stack else None
+        if parent is not None:
+            parent[4] += total
+        # Nelle chiamate ricorsive il tempo cumulativo conta una volta sola
+        recursive = any(entry[0] == key for entry in self.stack)
+        entry = self.stats.get(key)
+        if entry is None:
+            entry = self.stats[key] = [0, 0, 0.0, 0.0, {}]
+        entry[0] += not recursive
+        entry[1] += 1
+        entry[2] += own
+        entry[3] += 0.0 if recursive else total
+        if parent is not None:
+            callers = entry[4]
+            nc, cc, tt, ct = callers.get(parent[0], (0, 0, 0.0, 0.0))
+            callers[parent[0]] = (
+                nc + 1,
+                cc + (not recursive),
+                tt + own,
+                ct + (0.0 if recursive else total),
+            )
+        path = ";".join(function_label(e[0]) for e in self.stack + [[key]])
+        self.stacks[path] = self.stacks.get(path, 0.0) + own
+
+
+class RequestProfiler:
+    """
+    Profiler deterministico di una richiesta: riceve gli eventi di tutti i
+    thread in cui gira il suo contesto (event loop e threadpool), ciascuno
+    con il proprio stack
+    """
+
+    def __init__(self):
+        self.threads: dict[int, ThreadProfile] = {}
+        self.stats = {}
+
+    def event(self, frame, event: str, arg) -> None:
+        now = time.perf_counter()
+        thread = self.threads.get(threading.get_ident())
+        if thread is None:
+            thread = self.threads[threading.get_ident()] = ThreadProfile()
+        if event == "call":
+            thread.push(function_key(frame.f_code), frame, False, now)
+        elif event == "c_call":
+            thread.push(builtin_key(arg), frame, True, now)
+        elif event in RETURN_EVENTS and thread.stack:
+            # Ritorni di frame entrati prima dell'inizio della profilazione
+            # non hanno una chiamata corrispondente e vengono ignorati
+            top = thread.stack[-1]
+            if top[1] is frame and top[2] == (event != "return"):
+                thread.pop(now)
+
+    def finish(self) -> None:
+        """
+        Chiude le chiamate ancora aperte e unisce i thread nel formato di
+        pstats: {funzione: (cc, nc, tt, ct, {chiamante: (nc, cc, tt, ct)})}
+        """
+        now = time.perf_counter()
+        merged = {}
+        for thread in self.threads.values():
+            while thread.stack:
+                thread.pop(now)
+            for key, (cc, nc, tt, ct, callers) in thread.stats.items():
+                old = merged.get(key)
+                if old is None:
+                    merged[key] = (cc, nc, tt, ct, dict(callers))
+                    continue
+                merged_callers = old[4]
+                for caller, value in callers.items():
+                    previous = merged_callers.get(caller, (0, 0, 0.0, 0.0))
+                    merged_callers[caller] = tuple(
+                        a + b for a, b in zip(previous, value)
+                    )
+                merged[key] = (
+                    old[0] + cc,
+                    old[1] + nc,
+                    old[2] + tt,
+                    old[3] + ct,
+                    merged_callers,
+                )
+        self.stats = merged
+
+    def collapsed(self) -> str:
+        """
+        Stack collassati (flamegraph.pl, speedscope), pesati in microsecondi
+        """
+        totals = {}
+        for thread in self.threads.values():
+            for path, seconds in thread.stacks.items():
+                totals[path] = totals.get(path, 0.0) + seconds
+        return "".join(
+            f"{path} {max(1, round(seconds * 1_000_000))}\n"
+            for path, seconds in sorted(totals.items())
+        )
+
+    def pstats_dump(self) -> bytes:
+        # Lo stesso formato di pstats.Stats.dump_stats
+        return marshal.dumps(self.stats)
+
+    def text(self) -> str:
+        output = io.StringIO()
+        stats = pstats.Stats(stream=output)
+        stats.stats = self.stats
+        stats.get_top_level_stats()
+        stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TEXT_LIMIT)
+        return output.getvalue()
+
+
+current_profiler: ContextVar[RequestProfiler | None] = ContextVar(
+    "current_profiler", default=None
+)
+
+_active_lock = threading.Lock()
+_active_profiles = 0
+
+
+def dispatch(frame, event: str, arg) -> None:
+    # Installata su tutti i thread solo mentre una richiesta e' profilata;
+    # gli eventi delle altre richieste vengono scartati
+    profiler = current_profiler.get()
+    if profiler is not None:
+        profiler.event(frame, event, arg)
+
+
+@contextmanager
+def profiling(profiler: RequestProfiler) -> Iterator[RequestProfiler]:
+    """
+    Profila il codice eseguito nel contesto corrente, anche nei thread in cui
+    viene copiato (run_in_threadpool, run_cpu)
+    """
+    global _active_profiles
+    with _active_lock:
+        if _active_profiles == 0:
+            threading.setprofile_all_threads(dispatch)
+        _active_profiles += 1
+    token = current_profiler.set(profiler)
+    try:
+        yield profiler
+    finally:
+        current_profiler.reset(token)
+        with _active_lock:
+            _active_profiles -= 1
+            if _active_profiles == 0:
+                threading.setprofile_all_threads(None)
+        profiler.finish()
+
+
+def on_demand_enabled() -> bool:
+    return os.getenv(PROFILING_ENV, "").lower() in {"1", "true", "yes"}
+
+
+def get_sample_rate() -> int:
+    # 0 disattiva il campionamento
+    return int(os.getenv(PROFILE_SAMPLE_RATE_ENV, "0"))
+
+
+def profiling_enabled() -> bool:
+    return on_demand_enabled() or get_sample_rate() > 0
+
+
+def get_profile_path() -> str:
+    return os.getenv(PROFILE_PATH_ENV, "./profiles")
+
+
+def requested_format(scope: Scope) -> str | None:
+    """
+    Formato chiesto con ?profile= o con l'header X-Profile, solo se la
+    richiesta ha l'API key
+    """
+    headers = dict(scope["headers"])
+    if PROFILE_HEADER in headers:
+        value = headers[PROFILE_HEADER].decode("latin-1")
+    else:
+        query = parse_qs(
+            scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True
+        )
+        if PROFILE_PARAM not in query:
+            return None
+        value = query[PROFILE_PARAM][0]
+    if not is_valid_api_key(headers.get(b"x-api-key", b"").decode("latin-1")):
+        return None
+    return value if value in FORMATS else TEXT
+
+
+def store_profile(profiler: RequestProfiler, route: str) -> str:
+    """
+    Salva il profilo in RAPID_MD_PROFILE_PATH come .pstats e .collapsed;
+    restituisce il percorso senza estensione
+    """
+    path = get_profile_path()
+    os.makedirs(path, exist_ok=True)
+    slug = re.sub(r"[^A-Za-z0-9]+", "-", route).strip("-") or "root"
+    name = f"{datetime.utcnow():%Y%m%dT%H%M%S}-{slug}-{uuid.uuid4().hex[:8]}"
+    base = os.path.join(path, name)
+    with open(base + ".pstats", "wb") as f:
+        f.write(profiler.pstats_dump())
+    with open(base + ".collapsed", "w") as f:
+        f.write(profiler.collapsed())
+    return base
+
+
+def profile_response(profiler: RequestProfiler, fmt: str, status: int) -> Response:
+    headers = {"X-Profiled-Status": str(status)}
+    if fmt == PSTATS:
+        headers["Content-Disposition"] = attachment("profile.pstats")
+        return Response(
+            profiler.pstats_dump(),
+            media_type="application/octet-stream",
+            headers=headers,
+        )
+    body = profiler.collapsed() if fmt == COLLAPSED else profiler.text()
+    return Response(body, media_type="text/plain", headers=headers)
+
+
+class ProfilingMiddleware:
+    """
+    Con RAPID_MD_PROFILING attivo, le richieste con API key e ?profile=
+    (o X-Profile) ricevono il profilo al posto della risposta. Con
+    RAPID_MD_PROFILE_SAMPLE_RATE=N una richiesta su N a render_file e
+    upload_file viene profilata e salvata su disco.
+    Va aggiunto all'app solo se profiling_enabled(): spento non costa nulla.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.on_demand = on_demand_enabled()
+        self.sample_rate = get_sample_rate()
+        self._requests = itertools.count(1)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        fmt = requested_format(scope) if self.on_demand else None
+        if fmt is not None:
+            status = 500
+
+            async def discard(message: Message) -> None:
+                # La risposta originale viene sostituita dal profilo
+                nonlocal status
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+
+            with profiling(RequestProfiler()) as profiler:
+                await self.app(scope, receive, discard)
+            await profile_response(profiler, fmt, status)(scope, receive, send)
+            return
+
+        if self.sample_rate > 0:
+            route = route_label(scope.get("app"), scope)
+            if route in SAMPLED_ROUTES and next(self._requests) % self.sample_rate == 0:
+                try:
+                    with profiling(RequestProfiler()) as profiler:
+                        await self.app(scope, receive, send)
+                finally:
+                    await anyio.to_thread.run_sync(store_profile, profiler, route)
+                return
+
+        await self.app(scope, receive, send)
@@ -0,0 +1,114 @@
+"""
+Pool di processi per la conversione del markdown: i documenti grandi non
+tengono occupato il GIL del processo che serve le richieste
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from typing import Callable
+import markdown as mdlib
+
+RENDER_PROCESSES_ENV = "RAPID_MD_RENDER_PROCESSES"
+RENDER_POOL_THRESHOLD_ENV = "RAPID_MD_RENDER_POOL_THRESHOLD"
+RENDER_TIMEOUT_ENV = "RAPID_MD_RENDER_TIMEOUT"
+
+
+def get_render_processes() -> int:
+    # 0 disattiva il pool: tutto viene convertito nel thread della richiesta
+    return int(os.getenv(RENDER_PROCESSES_ENV, str(os.cpu_count() or 1)))
+
+
+def get_pool_threshold() -> int:
+    # Sotto questa dimensione in byte il costo di inviare il testo a un altro
+    # processo supera quello della conversione
+    return int(os.getenv(RENDER_POOL_THRESHOLD_ENV, str(128 * 1024)))
+
+
+def get_render_timeout() -> float:
+    return float(os.getenv(RENDER_TIMEOUT_ENV, "30"))
+
+
+class RenderPool:
+    """
+    ProcessPoolExecutor creato al primo utilizzo, con una sola conversione in
+    corso per hash del contenuto: le richieste concorrenti per lo stesso
+    documento attendono lo stesso risultato
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor: ProcessPoolExecutor | None = None
+        self._processes = 0
+        self._pending: dict[str, Future] = {}
+
+    def executor(self) -> ProcessPoolExecutor | None:
+        processes = get_render_processes()
+        if processes <= 0:
+            return None
+        with self._lock:
+            if self._executor is None:
+                # spawn: fork di un processo con piu' thread (event loop,
+                # threadpool, connessioni) non e' sicuro
+                self._executor = ProcessPoolExecutor(
+                    max_workers=processes,
+                    mp_context=multiprocessing.get_context("spawn"),
+                )
+                self._processes = processes
+            return self._executor
+
+    def submit(
+        self, key: str, text: str, on_done: Callable[[Future], None] | None = None
+    ) -> Future | None:
+        """
+        Avvia la conversione di `text` (o restituisce quella gia' in corso per
+        `key`); None se il pool e' disattivato. `on_done` viene chiamata una
+        volta, al termine della conversione, anche se nessuno la attende piu'.
+        """
+        executor = self.executor()
+        if executor is None:
+            return None
+        with self._lock:
+            future = self._pending.get(key)
+            if future is not None:
+                return future
+            future = executor.submit(mdlib.markdown, text)
+            self._pending[key] = future
+
+        def done(finished: Future) -> None:
+            with self._lock:
+                if self._pending.get(key) is finished:
+                    del self._pending[key]
+            if on_done is not None:
+                on_done(finished)
+
+        future.add_done_callback(done)
+        return future
+
+    def reset(self) -> None:
+        """
+        Scarta il pool (es. dopo un BrokenProcessPool): il prossimo utilizzo
+        ne crea uno nuovo
+        """
+        with self._lock:
+            executor, self._executor = self._executor, None
+            self._pending.clear()
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "processes": self._processes if self._executor else 0,
+                "pending": len(self._pending),
+            }
+
+
+render_pool = RenderPool()
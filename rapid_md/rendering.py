@@ -0,0 +1,194 @@
+import collections
+import html as htmllib
+import os
+from concurrent.futures import Future, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Hashable, NamedTuple
+import markdown as mdlib
+from sqlalchemy import exists, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.sql import ColumnElement
+from rapid_md.cache import LRUCache
+from rapid_md.metrics import markdown_render_duration, timed
+from rapid_md.models import FileTypeEnum, RenderedMarkdown, UploadedFile
+from rapid_md.render_pool import (
+    get_pool_threshold,
+    get_render_processes,
+    get_render_timeout,
+    render_pool,
+)
+from rapid_md.storage import compress, read_blob, upsert
+
+
+RENDER_CACHE_SIZE_ENV = "RAPID_MD_RENDER_CACHE_SIZE"
+
+PAGE_CACHE_SIZE_ENV = "RAPID_MD_PAGE_CACHE_SIZE"
+
+HOME_CACHE_SIZE_ENV = "RAPID_MD_HOME_CACHE_SIZE"
+
+# HTML renderizzato indicizzato per hash del contenuto markdown
+render_cache = LRUCache(int(os.getenv(RENDER_CACHE_SIZE_ENV, "256")))
+
+# Pagine complete gia' compresse con gzip, servite cosi' come sono ai client
+# che accettano gzip; la chiave include l'id del file (nome e tag) e il template
+page_cache = LRUCache(int(os.getenv(PAGE_CACHE_SIZE_ENV, "256")))
+
+# Pagine della home (non compresse e gzip) indicizzate per versione dei dati:
+# ogni upload o cancellazione incrementa la versione nel database, quindi
+# tutti i processi smettono di usare le pagine precedenti, che escono dall'LRU
+home_cache = LRUCache(int(os.getenv(HOME_CACHE_SIZE_ENV, "64")))
+
+
+class HomePage(NamedTuple):
+    body: bytes
+    gzip_body: bytes
+
+
+def cached_home_page(key: Hashable, render_page: Callable[[], str]) -> HomePage:
+    page = home_cache.get(key)
+    if page is None:
+        body = render_page().encode("utf-8")
+        page = HomePage(body, compress(body))
+        home_cache.put(key, page)
+    return page
+
+
+def gzip_page(key: Hashable, render_page: Callable[[], str]) -> bytes:
+    body = page_cache.get(key)
+    if body is None:
+        body = compress(render_page().encode("utf-8"))
+        page_cache.put(key, body)
+    return body
+
+
+class RenderTimeout(Exception):
+    """
+    La conversione non e' finita entro RAPID_MD_RENDER_TIMEOUT. Prosegue nel
+    pool e il risultato finisce in render_cache; nel frattempo `fallback`
+    mostra il sorgente come testo preformattato.
+    """
+
+    def __init__(self, text: str):
+        super().__init__("Markdown rendering timed out")
+        self.fallback = f"<pre>{htmllib.escape(text)}</pre>"
+
+
+def cache_rendered(content_hash: str) -> Callable[[Future], None]:
+    def put(future: Future) -> None:
+        if not future.cancelled() and future.exception() is None:
+            render_cache.put(content_hash, future.result())
+
+    return put
+
+
+def markdown_to_html(content_hash: str, content: bytes) -> str:
+    """
+    Converte il markdown in HTML: nel thread corrente sotto
+    RAPID_MD_RENDER_POOL_THRESHOLD byte, altrimenti nel pool di processi.
+    Se il pool non e' disponibile la conversione avviene nel thread corrente.
+    """
+    text = content.decode("utf-8")
+    with timed(markdown_render_duration, "markdown"):
+        if len(content) < get_pool_threshold():
+            return mdlib.markdown(text)
+        try:
+            future = render_pool.submit(
+                content_hash, text, cache_rendered(content_hash)
+            )
+            if future is not None:
+                return future.result(timeout=get_render_timeout())
+        except TimeoutError:
+            raise RenderTimeout(text) from None
+        except BrokenProcessPool:
+            # Un processo del pool e' terminato: il prossimo documento grande
+            # usera' un pool nuovo
+            render_pool.reset()
+        return mdlib.markdown(text)
+
+
+def render_markdown(db: Session, file: UploadedFile) -> str:
+    """
+    Restituisce l'HTML del file markdown, renderizzandolo solo la prima volta.
+
+    L'ordine di lookup e': cache LRU in memoria, tabella rendered_markdown,
+    e infine il parsing del contenuto (che viene caricato solo in quel caso).
+    """
+    html = render_cache.get(file.content_hash)
+    if html is not None:
+        return html
+
+    rendered = db.get(RenderedMarkdown, file.content_hash)
+    if rendered is None:
+        content_hash = file.content_hash
+        html = markdown_to_html(content_hash, read_blob(db, content_hash))
+        db.add(RenderedMarkdown(content_hash=content_hash, html=html))
+        try:
+            db.commit()
+        except IntegrityError:
+            # Un'altra richiesta ha salvato lo stesso contenuto nel frattempo
+            db.rollback()
+    else:
+        content_hash = rendered.content_hash
+        html = rendered.html
+
+    render_cache.put(content_hash, html)
+    return html
+
+
+def prerender_markdown(db: Session, condition: ColumnElement[bool]) -> int:
+    """
+    Converte in parallelo nel pool di processi i file markdown che
+    soddisfano `condition` e non sono ancora in rendered_markdown, qualunque
+    sia la loro dimensione. Restituisce il numero di contenuti convertiti;
+    quelli oltre il timeout vengono saltati.
+    """
+    content_hashes = (
+        db.execute(
+            select(UploadedFile.content_hash)
+            .distinct()
+            .where(
+                condition,
+                UploadedFile.filetype == FileTypeEnum.markdown,
+                ~exists().where(
+                    RenderedMarkdown.content_hash == UploadedFile.content_hash
+                ),
+            )
+        )
+        .scalars()
+        .all()
+    )
+    # Contenuti inviati al pool e non ancora raccolti: limita la memoria
+    window = max(1, 2 * get_render_processes())
+    in_flight: collections.deque[tuple[str, Future | None, str]] = collections.deque()
+    rendered = 0
+
+    def collect() -> None:
+        nonlocal rendered
+        content_hash, future, text = in_flight.popleft()
+        try:
+            html = future.result(timeout=get_render_timeout()) if future else None
+        except TimeoutError:
+            return
+        except BrokenProcessPool:
+            render_pool.reset()
+            html = None
+        if html is None:
+            html = mdlib.markdown(text)
+        db.execute(
+            upsert(db, RenderedMarkdown.__table__)
+            .values(content_hash=content_hash, html=html)
+            .on_conflict_do_nothing()
+        )
+        rendered += 1
+
+    for content_hash in content_hashes:
+        text = read_blob(db, content_hash).decode("utf-8")
+        future = render_pool.submit(content_hash, text, cache_rendered(content_hash))
+        in_flight.append((content_hash, future, text))
+        if len(in_flight) >= window:
+            collect()
+    while in_flight:
+        collect()
+    db.commit()
+    return rendered
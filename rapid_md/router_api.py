@@ -1,159 +1,878 @@
-from fastapi import APIRouter, HTTPException, Header, Request, Depends
+from fastapi import (
+    APIRouter,
+    BackgroundTasks,
+    HTTPException,
+    Header,
+    Request,
+    Response,
+    Depends,
+    Query,
+)
+from fastapi.responses import StreamingResponse
+import anyio
 import base64
 import os
 import io
-import zipfile
+import itertools
+import uuid
+from typing import (
+    Any,
+    AsyncIterator,
+    BinaryIO,
+    Callable,
+    Iterator,
+    Literal,
+    NamedTuple,
+)
 from rapid_md.schema import (
     FileResponse,
     FilesListResponse,
     FileDeleteResponse,
+    FilesDeleteRequest,
+    FilesDeleteResponse,
     FileUploadRequest,
+    ChangeEntry,
+    ChangesResponse,
+    IngestJobResponse,
+    PrerenderResponse,
+    SearchResponse,
+    SearchResult,
     SingleFileUploadResponse,
+    TagCount,
+    TagsResponse,
     ZipFileUploadResponse,
 )
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, sessionmaker
 from datetime import datetime
-from rapid_md.models import UploadedFile, FileTypeEnum
-from rapid_md.db import get_db
+from rapid_md.models import IngestJob, UploadedFile, FileTypeEnum
+from rapid_md.auth import get_api_key_from_env
+from rapid_md.changes import (
+    CHANGES_KEEPALIVE,
+    CHANGES_MAX_PAGE_SIZE,
+    CHANGES_MAX_WAIT,
+    CHANGES_PAGE_SIZE,
+    CHANGES_POLL_INTERVAL,
+    INSERT,
+    change_notifier,
+    fetch_changes,
+    oldest_available_seq,
+    record_changes,
+)
+from rapid_md.db import (
+    AsyncSessionLocal,
+    get_db,
+    get_session_factory,
+    pool_status,
+    run_db,
+)
+from rapid_md.deletion import (
+    BULK_DELETE_MAX_IDS,
+    count_files,
+    delete_files,
+    files_condition,
+)
+from rapid_md.export import export_query, iter_export_rows, iter_zip_archive
+from rapid_md.http_utils import attachment
+from rapid_md.ingest import (
+    get_zip_batch_size,
+    guess_filetype,
+    insert_file_rows,
+    iter_zip_batches,
+    prepare_file_rows,
+)
+from rapid_md.jobs import create_ingest_job, run_ingest_job
+from rapid_md.metrics import (
+    base64_decode_duration,
+    registry,
+    timed,
+    upload_bytes,
+    upload_bytes_saved,
+)
+from rapid_md.pagination import encode_cursor, keyset_page
+from rapid_md.render_pool import render_pool
+from rapid_md.rendering import (
+    home_cache,
+    page_cache,
+    prerender_markdown,
+    render_cache,
+)
+from rapid_md.search import (
+    SEARCH_MAX_PAGE_SIZE,
+    SEARCH_PAGE_SIZE,
+    document_rows,
+    index_documents,
+    is_searchable,
+    search_documents,
+)
+from rapid_md.storage import (
+    BlobData,
+    StoredBlob,
+    prepare_blob,
+    prepare_file_blob,
+    save_blob_contents,
+    store_blobs,
+)
+from rapid_md.tags import (
+    TagMode,
+    add_file_tags,
+    filter_by_tags,
+    tag_counts,
+)
+from rapid_md.uploads import SpooledUpload, spool_multipart, spool_stream
+from rapid_md.versioning import bump_data_version
 
 
 router = APIRouter()
 
 
+FILES_PAGE_SIZE = 100
+FILES_MAX_PAGE_SIZE = 1000
+FILES_STREAM_BATCH_SIZE = 500
+
+
+def file_response(f: UploadedFile) -> FileResponse:
+    return FileResponse(
+        id=f.id,
+        filename=f.filename,
+        created_at=f.created_at,
+        filetype=f.filetype.value,
+        tags=f.tags,
+    )
+
+
 @router.get("/files", response_model=FilesListResponse)
 def list_files(
-    db: Session = Depends(get_db), x_api_key: str = Header(None)
-) -> FilesListResponse:
+    db: Session = Depends(get_db),
+    x_api_key: str = Header(None),
+    limit: int = Query(FILES_PAGE_SIZE, ge=1, le=FILES_MAX_PAGE_SIZE),
+    cursor: str | None = Query(None, description="next_cursor of the previous page"),
+    format: Literal["json", "ndjson"] = Query("json"),
+    tag: list[str] | None = Query(None, description="Only files with these tags"),
+    tag_mode: TagMode = Query("all", description="Match all tags or any of them"),
+) -> FilesListResponse | StreamingResponse:
     api_key = get_api_key_from_env()
     if x_api_key != api_key:
         raise HTTPException(status_code=401, detail="Invalid or missing API key")
-    files = db.query(UploadedFile).all()
+    query = db.query(UploadedFile)
+    if tag:
+        query = filter_by_tags(query, tag, tag_mode)
+    try:
+        query = keyset_page(query, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if format == "ndjson":
+        # Esporta tutte le righe successive al cursore, una per riga,
+        # leggendole a blocchi da un cursore lato server
+        def stream_files() -> Iterator[str]:
+            for f in query.yield_per(FILES_STREAM_BATCH_SIZE):
+                yield file_response(f).model_dump_json() + "\n"
+
+        return StreamingResponse(stream_files(), media_type="application/x-ndjson")
+
+    files = query.limit(limit + 1).all()
+    next_cursor = None
+    if len(files) > limit:
+        files = files[:limit]
+        next_cursor = encode_cursor(files[-1].created_at, files[-1].id)
     return FilesListResponse(
-        files=[
-            FileResponse(
-                id=f.id,
-                filename=f.filename,
-                created_at=f.created_at,
-                filetype=f.filetype.value,
-                tags=f.tags,
+        files=[file_response(f) for f in files], next_cursor=next_cursor
+    )
+
+
+@router.get("/tags", response_model=TagsResponse)
+def list_tags(
+    db: Session = Depends(get_db), x_api_key: str = Header(None)
+) -> TagsResponse:
+    api_key = get_api_key_from_env()
+    if x_api_key != api_key:
+        raise HTTPException(status_code=401, detail="Invalid or missing API key")
+    counts = tag_counts(db)
+    return TagsResponse(
+        tags=[
+            TagCount(tag=tag, count=count)
+            for tag, count in sorted(
+                counts.items(), key=lambda item: (-item[1], item[0])
             )
-            for f in files
+        ]
+    )
+
+
+def archive_response(
+    db: Session, query, filename: str, detail: str
+) -> StreamingResponse:
+    """
+    Archivio ZIP dei file della query, generato in streaming mentre viene inviato
+    """
+    rows = iter_export_rows(query)
+    first = next(rows, None)
+    if first is None:
+        raise HTTPException(status_code=404, detail=detail)
+    return StreamingResponse(
+        iter_zip_archive(db, itertools.chain([first], rows)),
+        media_type="application/zip",
+        headers={"Content-Disposition": attachment(filename)},
+    )
+
+
+@router.get("/sessions/{upload_session}/archive")
+def export_session(
+    upload_session: uuid.UUID,
+    db: Session = Depends(get_db),
+    x_api_key: str = Header(None),
+) -> StreamingResponse:
+    api_key = get_api_key_from_env()
+    if x_api_key != api_key:
+        raise HTTPException(status_code=401, detail="Invalid or missing API key")
+    query = export_query(db).filter(UploadedFile.upload_session == upload_session)
+    return archive_response(
+        db, query, f"session-{upload_session}.zip", "Upload session not found"
+    )
+
+
+@router.post("/sessions/{upload_session}/prerender", response_model=PrerenderResponse)
+def prerender_session(
+    upload_session: uuid.UUID,
+    db: Session = Depends(get_db),
+    x_api_key: str = Header(None),
+) -> PrerenderResponse:
+    """
+    Converte in HTML tutti i file markdown della sessione, in parallelo nel
+    pool di processi, prima che vengano richiesti
+    """
+    api_key = get_api_key_from_env()
+    if x_api_key != api_key:
+        raise HTTPException(status_code=401, detail="Invalid or missing API key")
+    return PrerenderResponse(
+        rendered=prerender_markdown(db, UploadedFile.upload_session == upload_session)
+    )
+
+
+@router.get("/tags/{tag}/archive")
+def export_tag(
+    tag: str, db: Session = Depends(get_db), x_api_key: str = Header(None)
+) -> StreamingResponse:
+    api_key = get_api_key_from_env()
+    if x_api_key != api_key:
+        raise HTTPException(status_code=401, detail="Invalid or missing API key")
+    query = filter_by_tags(export_query(db), [tag])
+    return archive_response(db, query, f"tag-{tag}.zip", "No files with this tag")
+
+
+@router.get("/search", response_model=SearchResponse)
+def search(
+    q: str = Query(..., min_length=1, description="Words to search for"),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=SEARCH_MAX_PAGE_SIZE),
+    db: Session = Depends(get_db),
+    x_api_key: str = Header(None),
+) -> SearchResponse:
+    """
+    Ricerca full-text nei file markdown, risultati ordinati per rilevanza
+    """
+    api_key = get_api_key_from_env()
+    if x_api_key != api_key:
+        raise HTTPException(status_code=401, detail="Invalid or missing API key")
+    return SearchResponse(
+        results=[
+            SearchResult(
+                id=row["file_id"],
+                filename=row["filename"],
+                snippet=row["snippet"],
+                rank=row["rank"],
+            )
+            for row in search_documents(db, q, limit)
         ]
     )
 
 
 @router.delete("/files/{file_id}")
 def delete_file(
-    file_id: str, db: Session = Depends(get_db), x_api_key: str = Header(None)
+    file_id: uuid.UUID, db: Session = Depends(get_db), x_api_key: str = Header(None)
 ) -> FileDeleteResponse:
     api_key = get_api_key_from_env()
     if x_api_key != api_key:
         raise HTTPException(status_code=401, detail="Invalid or missing API key")
-    file = db.query(UploadedFile).filter(UploadedFile.id == file_id).first()
-    if not file:
+    if not delete_files(db, UploadedFile.id == file_id):
+        db.rollback()
         raise HTTPException(status_code=404, detail="File not found")
-    db.delete(file)
     db.commit()
-    return FileDeleteResponse(message="File deleted", id=file_id)
+    return FileDeleteResponse(message="File deleted", id=str(file_id))
+
+
+@router.post("/files/delete", response_model=FilesDeleteResponse)
+def bulk_delete_files(
+    request: FilesDeleteRequest,
+    db: Session = Depends(get_db),
+    x_api_key: str = Header(None),
+) -> FilesDeleteResponse:
+    """
+    Cancella con un'unica transazione i file che soddisfano tutti i filtri
+    indicati; con dry_run restituisce solo quanti sono
+    """
+    api_key = get_api_key_from_env()
+    if x_api_key != api_key:
+        raise HTTPException(status_code=401, detail="Invalid or missing API key")
+    if request.ids is not None and len(request.ids) > BULK_DELETE_MAX_IDS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {BULK_DELETE_MAX_IDS} ids can be deleted at once",
+        )
+    condition = files_condition(
+        ids=request.ids,
+        upload_session=request.upload_session,
+        tag=request.tag,
+        created_after=request.created_after,
+        created_before=request.created_before,
+    )
+    if condition is None:
+        raise HTTPException(status_code=400, detail="At least one filter is required")
+    if request.dry_run:
+        return FilesDeleteResponse(deleted=count_files(db, condition), dry_run=True)
+    deleted = delete_files(db, condition)
+    if deleted:
+        db.commit()
+    else:
+        # Nessun file: la versione dei dati resta invariata
+        db.rollback()
+    return FilesDeleteResponse(deleted=deleted, dry_run=False)
 
 
-API_KEY_ENV = "RAPID_MD_API_KEY"
+def changes_page(db: Session, since: int, limit: int) -> ChangesResponse:
+    """
+    Pagina del registro delle modifiche successive a `since`; 410 se parte
+    delle modifiche richieste e' stata cancellata dalla pulizia del registro
+    """
+    oldest = oldest_available_seq(db)
+    if oldest is not None and since < oldest - 1:
+        raise HTTPException(
+            status_code=410,
+            detail="Changes before this sequence were pruned, resync from /files",
+        )
+    rows = fetch_changes(db, since, limit + 1)
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    return ChangesResponse(
+        changes=[
+            ChangeEntry(
+                seq=row.seq,
+                op=row.op,
+                id=row.file_id,
+                changed_at=row.changed_at,
+                file=FileResponse(
+                    id=row.id,
+                    filename=row.filename,
+                    created_at=row.created_at,
+                    filetype=row.filetype.value,
+                    tags=row.tags,
+                )
+                if row.id is not None
+                else None,
+            )
+            for row in rows
+        ],
+        next_since=rows[-1].seq if rows else since,
+        has_more=has_more,
+    )
 
 
-def get_api_key_from_env() -> str:
-    api_key = os.getenv(API_KEY_ENV)
-    if not api_key:
-        raise RuntimeError(f"Environment variable {API_KEY_ENV} not set")
-    return api_key
+@router.get("/changes", response_model=ChangesResponse)
+async def list_changes(
+    since: int = Query(0, ge=0, description="next_since of the previous response"),
+    limit: int = Query(CHANGES_PAGE_SIZE, ge=1, le=CHANGES_MAX_PAGE_SIZE),
+    wait: float = Query(
+        0, ge=0, le=CHANGES_MAX_WAIT, description="Seconds to wait for new changes"
+    ),
+    db: Session = Depends(get_db),
+    x_api_key: str = Header(None),
+) -> ChangesResponse:
+    """
+    Modifiche (file aggiunti e cancellati) successive a `since`. Con `wait`
+    la richiesta resta aperta finche' non arriva una modifica (long-poll).
+    """
+    api_key = get_api_key_from_env()
+    if x_api_key != api_key:
+        raise HTTPException(status_code=401, detail="Invalid or missing API key")
+    deadline = anyio.current_time() + wait
+    while True:
+        with change_notifier.listen() as changed:
+            page = await run_db(db, changes_page, since, limit)
+            remaining = deadline - anyio.current_time()
+            if page.changes or remaining <= 0:
+                return page
+            with anyio.move_on_after(min(remaining, CHANGES_POLL_INTERVAL)):
+                await changed.wait()
+
 
+async def change_events(
+    db: Session, since: int, page: ChangesResponse | None = None
+) -> AsyncIterator[str]:
+    """
+    Eventi SSE delle modifiche successive a `since`, senza fine: dopo
+    l'ultima modifica attende la successiva
+    """
+    last_sent = anyio.current_time()
+    while True:
+        with change_notifier.listen() as changed:
+            if page is None:
+                page = await run_db(db, changes_page, since, CHANGES_PAGE_SIZE)
+            for change in page.changes:
+                yield (
+                    f"id: {change.seq}\nevent: {change.op}\n"
+                    f"data: {change.model_dump_json()}\n\n"
+                )
+                last_sent = anyio.current_time()
+            since = page.next_since
+            if not page.has_more:
+                if anyio.current_time() - last_sent >= CHANGES_KEEPALIVE:
+                    yield ": keepalive\n\n"
+                    last_sent = anyio.current_time()
+                with anyio.move_on_after(CHANGES_POLL_INTERVAL):
+                    await changed.wait()
+        page = None
 
-def guess_filetype(filename: str) -> FileTypeEnum:
-    ext = os.path.splitext(filename)[1].lower()
-    if ext in {".md", ".markdown"}:
-        return FileTypeEnum.markdown
-    elif ext in {".jpg", ".jpeg", ".png", ".gif", ".bmp", ".svg"}:
-        return FileTypeEnum.image
-    else:
-        return FileTypeEnum.document
 
+@router.get("/changes/stream")
+async def stream_changes(
+    since: int = Query(0, ge=0, description="Sequence to start after"),
+    last_event_id: int | None = Header(None),
+    db: Session = Depends(get_db),
+    x_api_key: str = Header(None),
+) -> StreamingResponse:
+    """
+    Le stesse modifiche di /changes come Server-Sent Events, inviate appena
+    avvengono. Alla riconnessione il client riparte da Last-Event-ID.
+    """
+    api_key = get_api_key_from_env()
+    if x_api_key != api_key:
+        raise HTTPException(status_code=401, detail="Invalid or missing API key")
+    if last_event_id is not None:
+        since = last_event_id
+    # Un 410 va restituito prima di iniziare lo stream
+    first_page = await run_db(db, changes_page, since, CHANGES_PAGE_SIZE)
 
-def save_uploaded_file(
+    return StreamingResponse(
+        change_events(db, since, first_page),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/jobs/{job_id}", response_model=IngestJobResponse)
+def get_job(
+    job_id: uuid.UUID, db: Session = Depends(get_db), x_api_key: str = Header(None)
+) -> IngestJobResponse:
+    """
+    Stato e avanzamento di un'estrazione in background
+    """
+    api_key = get_api_key_from_env()
+    if x_api_key != api_key:
+        raise HTTPException(status_code=401, detail="Invalid or missing API key")
+    job = db.get(IngestJob, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job_response(job)
+
+
+@router.get("/metrics")
+def metrics() -> Response:
+    """
+    Metriche in formato testo Prometheus, del solo processo che risponde
+    """
+    return Response(content=registry.render(), media_type="text/plain; version=0.0.4")
+
+
+@router.get("/stats")
+def stats(x_api_key: str = Header(None)) -> dict:
+    api_key = get_api_key_from_env()
+    if x_api_key != api_key:
+        raise HTTPException(status_code=401, detail="Invalid or missing API key")
+    return {
+        "render_cache": render_cache.stats(),
+        "page_cache": page_cache.stats(),
+        "home_cache": home_cache.stats(),
+        "render_pool": render_pool.stats(),
+        "db_pool": pool_status(),
+    }
+
+
+class PreparedUpload(NamedTuple):
+    """
+    Upload gia' scritto nel backend da prepare_upload, pronto per
+    save_prepared_upload
+    """
+
+    id: uuid.UUID
+    blob: StoredBlob
+    documents: list[dict]
+
+
+def prepare_upload(
+    filename: str,
+    content: bytes | None,
+    filetype: FileTypeEnum,
+    blob: BlobData | None = None,
+) -> PreparedUpload:
+    """
+    Comprime il contenuto, lo scrive nel backend e decodifica il testo da
+    indicizzare: con una sessione asincrona save_prepared_upload gira
+    sull'event loop e deve eseguire solo istruzioni SQL. Va eseguita nei
+    thread degli upload. Con `blob` gia' preparato, `content` serve solo ai
+    file indicizzati dalla ricerca e negli altri casi puo' essere None.
+    """
+    if blob is None:
+        blob = prepare_blob(filename, filetype, content)
+    file_id = uuid.uuid4()
+    (stored,) = save_blob_contents([blob])
+    documents = document_rows(
+        [
+            {
+                "id": file_id,
+                "filename": filename,
+                "content": content,
+                "filetype": filetype,
+            }
+        ]
+    )
+    return PreparedUpload(file_id, stored, documents)
+
+
+def save_prepared_upload(
     db: Session,
     filename: str,
-    content_b64: str,
     filetype: FileTypeEnum,
-    tags: dict = None,
-) -> UploadedFile:
+    tags: dict | None,
+    prepared: PreparedUpload,
+) -> tuple[UploadedFile, int]:
+    """
+    Salva il file e restituisce la riga creata con i byte risparmiati
+    se il contenuto era gia' presente
+    """
+    bytes_saved = store_blobs(db, [prepared.blob])
     uploaded = UploadedFile(
+        id=prepared.id,
         filename=filename,
-        content=content_b64,
+        content_hash=prepared.blob.content_hash,
+        size=prepared.blob.size,
         created_at=datetime.utcnow(),
         filetype=filetype,
         tags=tags,
     )
     db.add(uploaded)
+    db.flush()
+    add_file_tags(db, uploaded.id, tags)
+    index_documents(db, prepared.documents)
+    bump_data_version(db)
+    record_changes(db, INSERT, UploadedFile.id == uploaded.id)
     db.commit()
     db.refresh(uploaded)
-    return uploaded
+    return uploaded, bytes_saved
+
+
+def save_uploaded_file(
+    db: Session,
+    filename: str,
+    content: bytes,
+    filetype: FileTypeEnum,
+    tags: dict = None,
+) -> tuple[UploadedFile, int]:
+    """
+    prepare_upload e save_prepared_upload insieme, per le sessioni sincrone
+    """
+    prepared = prepare_upload(filename, content, filetype)
+    return save_prepared_upload(db, filename, filetype, tags, prepared)
+
+
+def prepare_spooled_upload(
+    filename: str, filetype: FileTypeEnum, spooled: SpooledUpload
+) -> PreparedUpload:
+    """
+    prepare_upload per un upload su file temporaneo, con l'hash gia'
+    calcolato durante lo streaming: il contenuto passa al backend a blocchi
+    """
+    blob = prepare_file_blob(
+        filename, filetype, spooled.file, spooled.content_hash, spooled.size
+    )
+    try:
+        # In memoria solo il testo da indicizzare per la ricerca
+        content = spooled.read() if is_searchable(filetype) else None
+        return prepare_upload(filename, content, filetype, blob)
+    finally:
+        if blob.data is not spooled.file:
+            blob.data.close()
+
+
+UPLOAD_WORKERS_ENV = "RAPID_MD_UPLOAD_WORKERS"
+
+# Thread dedicati al lavoro CPU degli upload (base64, zip, hash), separati
+# da quelli usati dagli endpoint sincroni come /render
+upload_limiter = anyio.CapacityLimiter(int(os.getenv(UPLOAD_WORKERS_ENV, "4")))
+
+
+async def run_cpu(fn: Callable[..., Any], *args: Any) -> Any:
+    return await anyio.to_thread.run_sync(fn, *args, limiter=upload_limiter)
+
+
+def decode_base64(content_base64: str) -> bytes:
+    with timed(base64_decode_duration, "base64"):
+        return base64.b64decode(content_base64)
+
+
+async def get_upload_db(
+    db: Session = Depends(get_db),
+) -> AsyncIterator[Session | AsyncSession]:
+    """
+    Sessione usata dagli upload: asincrona se RAPID_MD_ASYNC_DB e' attivo
+    """
+    if AsyncSessionLocal is None:
+        yield db
+        return
+    async with AsyncSessionLocal() as async_db:
+        yield async_db
+
+
+def job_response(job: IngestJob) -> IngestJobResponse:
+    return IngestJobResponse(
+        id=job.id,
+        status=job.status.value,
+        filename=job.filename,
+        upload_session=job.upload_session,
+        members_total=job.members_total,
+        members_done=job.members_done,
+        bytes_total=job.bytes_total,
+        bytes_done=job.bytes_done,
+        bytes_saved=job.bytes_saved,
+        error_count=job.error_count,
+        errors=job.errors or [],
+        error=job.error,
+        created_at=job.created_at,
+        finished_at=job.finished_at,
+    )
+
+
+async def queue_zip_archive(
+    session_factory: sessionmaker,
+    filename: str,
+    archive: BinaryIO,
+    background_tasks: BackgroundTasks,
+    response: Response,
+) -> IngestJobResponse:
+    """
+    Salva l'archivio nello spool e ne pianifica l'estrazione dopo la risposta,
+    che e' un 202 con lo stato del job
+    """
+
+    def create_job() -> IngestJobResponse:
+        with session_factory() as db:
+            return job_response(create_ingest_job(db, filename, archive))
+
+    job = await run_cpu(create_job)
+    background_tasks.add_task(run_ingest_job, session_factory, job.id)
+    response.status_code = 202
+    response.headers["Location"] = f"/jobs/{job.id}"
+    return job
+
+
+def commit_upload(db: Session, upload_session: uuid.UUID) -> None:
+    bump_data_version(db)
+    record_changes(db, INSERT, UploadedFile.upload_session == upload_session)
+    db.commit()
+
+
+def rollback_upload(db: Session) -> None:
+    db.rollback()
+
+
+async def save_zip_archive(
+    db: Session | AsyncSession, archive: BinaryIO, batch_size: int | None = None
+) -> tuple[uuid.UUID, list[FileResponse], int]:
+    """
+    Salva tutti i file dell'archivio ZIP in un'unica transazione, con
+    insert a blocchi di `batch_size` righe e una sola upload_session.
+    Se un membro fallisce non viene salvato nessun file.
+
+    La decompressione gira nei thread degli upload, gli insert sulla sessione
+    tramite run_db: l'event loop non resta mai bloccato.
+    """
+    batch_size = batch_size or get_zip_batch_size()
+    upload_session = uuid.uuid4()
+    created_at = datetime.utcnow()
+    batches = iter_zip_batches(archive, upload_session, created_at, batch_size)
+    results = []
+    bytes_saved = 0
+    try:
+        while (batch := await run_cpu(next, batches, None)) is not None:
+            # Scritture nel backend e testo per la ricerca nei thread degli
+            # upload: sulla sessione restano solo le istruzioni SQL
+            documents = await run_cpu(prepare_file_rows, batch)
+            bytes_saved += await run_db(db, insert_file_rows, batch, documents)
+            results.extend(
+                FileResponse(
+                    id=row["id"],
+                    filename=row["filename"],
+                    created_at=created_at,
+                    filetype=row["filetype"].value,
+                    tags=None,
+                )
+                for row in batch
+            )
+        await run_db(db, commit_upload, upload_session)
+    except Exception:
+        await run_db(db, rollback_upload)
+        raise
+    finally:
+        batches.close()
+    return upload_session, results, bytes_saved
 
 
 @router.post("/upload-file")
 async def upload_file(
     request: Request,
+    response: Response,
     body: FileUploadRequest,
+    background_tasks: BackgroundTasks,
+    background: bool = Query(
+        False, description="Extract zip archives in a background job"
+    ),
     x_api_key: str = Header(None),
-    db: Session = Depends(get_db),
-) -> SingleFileUploadResponse | ZipFileUploadResponse:
+    db: Session | AsyncSession = Depends(get_upload_db),
+    session_factory: sessionmaker = Depends(get_session_factory),
+) -> SingleFileUploadResponse | ZipFileUploadResponse | IngestJobResponse:
     api_key = get_api_key_from_env()
     if x_api_key != api_key:
         raise HTTPException(status_code=401, detail="Invalid or missing API key")
     try:
         filename = os.path.basename(body.filepath)
         filetype = guess_filetype(filename)
-        results = []
+        file_bytes = await run_cpu(decode_base64, body.content_base64)
+        upload_bytes.inc("/upload-file", amount=len(file_bytes))
+        if filename.lower().endswith(".zip") and background:
+            return await queue_zip_archive(
+                session_factory,
+                filename,
+                io.BytesIO(file_bytes),
+                background_tasks,
+                response,
+            )
         if filename.lower().endswith(".zip"):
-            # Decode the zip content and process each file
-            file_bytes = base64.b64decode(body.content_base64)
-            with zipfile.ZipFile(io.BytesIO(file_bytes)) as z:
-                for zipinfo in z.infolist():
-                    if zipinfo.is_dir():
-                        continue
-                    inner_filename = os.path.basename(zipinfo.filename)
-                    inner_filetype = guess_filetype(inner_filename)
-                    with z.open(zipinfo) as f:
-                        inner_content = f.read()
-                        inner_content_b64 = base64.b64encode(inner_content).decode(
-                            "utf-8"
-                        )
-                        # Per i file in un archivio ZIP, non passiamo i tag
-                        uploaded = save_uploaded_file(
-                            db, inner_filename, inner_content_b64, inner_filetype
-                        )
-                        results.append(
-                            FileResponse(
-                                id=uploaded.id,
-                                filename=inner_filename,
-                                created_at=uploaded.created_at,
-                                filetype=inner_filetype.value,
-                                tags=uploaded.tags,
-                            )
-                        )
+            # Process each file of the zip archive
+            upload_session, results, bytes_saved = await save_zip_archive(
+                db, io.BytesIO(file_bytes)
+            )
+            upload_bytes_saved.inc("/upload-file", amount=bytes_saved)
             return ZipFileUploadResponse(
-                message="Zip file extracted and files saved to database", files=results
+                message="Zip file extracted and files saved to database",
+                upload_session=upload_session,
+                files=results,
+                bytes_saved=bytes_saved,
             )
         else:
-            uploaded = save_uploaded_file(
-                db, filename, body.content_base64, filetype, body.tags
+            prepared = await run_cpu(prepare_upload, filename, file_bytes, filetype)
+            uploaded, bytes_saved = await run_db(
+                db, save_prepared_upload, filename, filetype, body.tags, prepared
             )
+            upload_bytes_saved.inc("/upload-file", amount=bytes_saved)
             return SingleFileUploadResponse(
                 message="File saved to database",
                 id=str(uploaded.id),
                 filename=filename,
                 filetype=filetype.value,
                 tags=uploaded.tags,
+                bytes_saved=bytes_saved,
+            )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+
+async def save_spooled_upload(
+    db: Session | AsyncSession,
+    filepath: str,
+    spooled: SpooledUpload,
+    tags: list[str] | None,
+) -> SingleFileUploadResponse | ZipFileUploadResponse:
+    filename = os.path.basename(filepath)
+    filetype = guess_filetype(filename)
+    if filename.lower().endswith(".zip"):
+        # L'archivio viene letto direttamente dal file temporaneo
+        upload_session, results, bytes_saved = await save_zip_archive(db, spooled.file)
+        upload_bytes_saved.inc("/upload-stream", amount=bytes_saved)
+        return ZipFileUploadResponse(
+            message="Zip file extracted and files saved to database",
+            upload_session=upload_session,
+            files=results,
+            bytes_saved=bytes_saved,
+        )
+    prepared = await run_cpu(prepare_spooled_upload, filename, filetype, spooled)
+    uploaded, bytes_saved = await run_db(
+        db, save_prepared_upload, filename, filetype, tags, prepared
+    )
+    upload_bytes_saved.inc("/upload-stream", amount=bytes_saved)
+    return SingleFileUploadResponse(
+        message="File saved to database",
+        id=str(uploaded.id),
+        filename=filename,
+        filetype=filetype.value,
+        tags=uploaded.tags,
+        bytes_saved=bytes_saved,
+    )
+
+
+@router.post("/upload-stream")
+async def upload_stream(
+    request: Request,
+    response: Response,
+    background_tasks: BackgroundTasks,
+    filepath: str | None = Query(None, description="Relative path of the file"),
+    tag: list[str] | None = Query(None, description="Optional tags for the file"),
+    background: bool = Query(
+        False, description="Extract zip archives in a background job"
+    ),
+    x_api_key: str = Header(None),
+    db: Session | AsyncSession = Depends(get_upload_db),
+    session_factory: sessionmaker = Depends(get_session_factory),
+) -> SingleFileUploadResponse | ZipFileUploadResponse | IngestJobResponse:
+    """
+    Upload senza base64: accetta un form multipart (campo `file`, e opzionali
+    `filepath` e `tags`) oppure il contenuto grezzo nel body, con `filepath`
+    e `tag` in query string. Il body viene copiato a blocchi su file temporaneo.
+    """
+    api_key = get_api_key_from_env()
+    if x_api_key != api_key:
+        raise HTTPException(status_code=401, detail="Invalid or missing API key")
+
+    content_type = request.headers.get("content-type", "")
+    if content_type.startswith("multipart/form-data"):
+        try:
+            form = await spool_multipart(content_type, request.stream())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if form.upload is None:
+            raise HTTPException(status_code=400, detail="Missing 'file' form field")
+        filepath = form.value("filepath") or filepath or form.filename
+        tags = form.fields.get("tags") or tag
+        spooled = form.upload
+    else:
+        tags = tag
+        spooled = await spool_stream(request.stream())
+    upload_bytes.inc("/upload-stream", amount=spooled.size)
+    if not filepath:
+        spooled.close()
+        raise HTTPException(status_code=400, detail="Missing filepath")
+
+    try:
+        if background and filepath.lower().endswith(".zip"):
+            return await queue_zip_archive(
+                session_factory,
+                os.path.basename(filepath),
+                spooled.file,
+                background_tasks,
+                response,
             )
+        return await save_spooled_upload(db, filepath, spooled, tags)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
+    finally:
+        spooled.close()
 
 
 # End of file
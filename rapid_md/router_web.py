@@ -1,208 +1,388 @@
-from fastapi import APIRouter, HTTPException, Depends, Response
+import html as htmllib
+import uuid
+from typing import Iterator
+from urllib.parse import quote, urlencode
+from fastapi import APIRouter, HTTPException, Depends, Request, Response, Query
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.orm import Session
-import base64
-import markdown as mdlib
-from rapid_md.models import UploadedFile, FileTypeEnum
+from rapid_md.models import Blob, UploadedFile, FileTypeEnum
 from rapid_md.db import get_db
-from pathlib import Path
+from rapid_md.http_utils import (
+    RangeNotSatisfiable,
+    accepts_encoding,
+    if_range_matches,
+    is_not_modified,
+    make_etag,
+    not_modified,
+    parse_range,
+    validator_headers,
+)
+from rapid_md.pagination import encode_cursor, keyset_page
+from rapid_md.rendering import (
+    RenderTimeout,
+    cached_home_page,
+    gzip_page,
+    render_markdown,
+)
+from rapid_md.storage import (
+    GZIP,
+    blob_path,
+    compress,
+    read_blob,
+    read_range,
+    read_ranges,
+    read_stored_blob,
+)
+from rapid_md.tags import filter_by_tags, tag_counts
+from rapid_md.template import PageTemplate, TEMPLATE_PATH
+from rapid_md.versioning import get_data_version
 
 
 render_router = APIRouter()
 
+# Il template viene letto e precompilato una sola volta all'avvio
+page_template = PageTemplate.from_path(TEMPLATE_PATH)
+
+HOME_PAGE_SIZE = 100
+
+TABLE_HEAD = """
+<table>
+    <thead>
+        <tr>
+            <th>Filename</th>
+            <th>Type</th>
+            <th>Created At</th>
+            <th>Tags</th>
+        </tr>
+    </thead>
+    <tbody>
+"""
+
+TABLE_FOOT = """
+    </tbody>
+</table>
+"""
+
+# La stessa URL /render/{filename} puo' puntare a un nuovo upload: le pagine
+# markdown vengono sempre rivalidate, i file binari restano in cache piu' a lungo
+CACHE_CONTROL = {
+    FileTypeEnum.markdown: "public, no-cache",
+    FileTypeEnum.image: "public, max-age=3600",
+    FileTypeEnum.document: "public, max-age=600",
+}
+HOME_CACHE_CONTROL = "public, no-cache"
+
+MIMETYPES = {
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "gif": "image/gif",
+    "svg": "image/svg+xml",
+    "pdf": "application/pdf",
+    "txt": "text/plain",
+    "md": "text/markdown",
+    "html": "text/html",
+    "stl": "text/stl",
+}
+
+
+def file_row(file: UploadedFile) -> str:
+    """
+    Riga della tabella dei file, generata una sola volta per file
+    """
+    # Nome e tag arrivano dagli upload: vanno sempre escapati
+    filename = htmllib.escape(file.filename)
+    href = htmllib.escape(f"/render/{quote(file.filename)}")
+
+    # Formatta la data
+    created_at = file.created_at.strftime("%Y-%m-%d %H:%M")
+
+    # Genera l'HTML dei tag
+    if file.tags:
+        tags_html = "".join(
+            f'<span class="tag">{htmllib.escape(tag)}</span>' for tag in file.tags
+        )
+    else:
+        tags_html = '<span style="color: #6a737d;">No tags</span>'
+
+    # Determina l'icona in base al tipo di file
+    filetype_class = f"filetype-{file.filetype.value}"
+
+    return f"""
+    <tr>
+        <td><a href="{href}" class="{filetype_class}">{filename}</a></td>
+        <td>{file.filetype.value}</td>
+        <td>{created_at}</td>
+        <td><div class="tags">{tags_html}</div></td>
+    </tr>
+    """
+
+
+def partial_response(
+    db: Session,
+    file: UploadedFile,
+    ranges: list[tuple[int, int]],
+    mimetype: str,
+    headers: dict,
+) -> Response:
+    """
+    Risposta 206 che legge dallo storage solo gli intervalli richiesti
+    """
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        return Response(
+            content=read_range(db, file.content_hash, start, end - start + 1),
+            status_code=206,
+            media_type=mimetype,
+            headers={**headers, "Content-Range": f"bytes {start}-{end}/{file.size}"},
+        )
+
+    # Piu' intervalli: multipart/byteranges, una parte alla volta
+    boundary = uuid.uuid4().hex
+
+    def iter_parts() -> Iterator[bytes]:
+        # Il blob viene aperto una volta per tutte le parti
+        contents = read_ranges(
+            db, file.content_hash, ((start, end - start + 1) for start, end in ranges)
+        )
+        for content, (start, end) in zip(contents, ranges):
+            yield (
+                f"--{boundary}\r\n"
+                f"Content-Type: {mimetype}\r\n"
+                f"Content-Range: bytes {start}-{end}/{file.size}\r\n\r\n"
+            ).encode("ascii")
+            yield content
+            yield b"\r\n"
+        yield f"--{boundary}--\r\n".encode("ascii")
+
+    return StreamingResponse(
+        iter_parts(),
+        status_code=206,
+        media_type=f"multipart/byteranges; boundary={boundary}",
+        headers=headers,
+    )
+
 
 @render_router.get("/")
-def home(db: Session = Depends(get_db)) -> Response:
+def home(
+    request: Request,
+    db: Session = Depends(get_db),
+    cursor: str | None = Query(None, description="Show files older than this cursor"),
+    tag: str | None = Query(None, description="Show only files with this tag"),
+) -> Response:
     """
-    Homepage endpoint che mostra la lista di tutti i file caricati, raggruppati per tags e upload_session
+    Homepage endpoint che mostra la lista dei file caricati, raggruppati per tags,
+    a pagine di HOME_PAGE_SIZE file dal piu' recente
     """
-    files = db.query(UploadedFile).order_by(UploadedFile.created_at.desc()).all()
-
-    # Read the template HTML
-    template_path = Path(__file__).parent.parent / "template.html"
-    with open(template_path, "r") as template_file:
-        template_html = template_file.read()
-
-    # Set page title and heading
-    template_html = template_html.replace("__page_title__", "Home")
-    template_html = template_html.replace("__title__", "Files Repository")
-    template_html = template_html.replace(
-        "__navigation__", "<!-- No navigation on home page -->"
+    # La pagina cambia solo quando cambia la versione globale dei dati: con la
+    # versione invariata viene servita dalla cache, senza altre query
+    version, updated_at = get_data_version(db)
+    use_gzip = accepts_encoding(request, GZIP)
+    parts = [f"home{version}", page_template.digest]
+    if use_gzip:
+        parts.append(GZIP)
+    etag = make_etag(*parts)
+    headers = validator_headers(etag, updated_at, HOME_CACHE_CONTROL)
+    headers["Vary"] = "Accept-Encoding"
+    if is_not_modified(request, etag, updated_at):
+        return not_modified(headers)
+    # Solo sulla risposta con il body: un 304 non ha contenuto da decodificare
+    if use_gzip:
+        headers["Content-Encoding"] = GZIP
+
+    page = cached_home_page(
+        (version, page_template.digest, cursor, tag),
+        lambda: render_home(db, cursor, tag),
     )
-    template_html = template_html.replace("__tags__", "<!-- No tags on home page -->")
+    body = page.gzip_body if use_gzip else page.body
+    return Response(content=body, media_type="text/html", headers=headers)
+
+
+def render_home(db: Session, cursor: str | None, tag: str | None) -> str:
+    """
+    HTML completo di una pagina della home
+    """
+    query = db.query(UploadedFile)
+    if tag:
+        query = filter_by_tags(query, [tag])
+    try:
+        query = keyset_page(query, cursor, descending=True)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    files = query.limit(HOME_PAGE_SIZE + 1).all()
+    next_cursor = None
+    if len(files) > HOME_PAGE_SIZE:
+        files = files[:HOME_PAGE_SIZE]
+        next_cursor = encode_cursor(files[-1].created_at, files[-1].id)
 
     if not files:
         content_html = '<div class="empty-message">No files uploaded yet.</div>'
     else:
+        rows = {file.id: file_row(file) for file in files}
+
         # Organizza i file per tag
         files_by_tag = {}
         for file in files:
             if file.tags:
-                for tag in file.tags:
-                    if tag not in files_by_tag:
-                        files_by_tag[tag] = []
-                    files_by_tag[tag].append(file)
-
-        content_html = ""
-
-        content_html += "<h2>Files by Tag</h2>"
-        if files_by_tag:
-            for tag_identifier, tag_files in files_by_tag.items():
-                content_html += '<div class="tag-group">'
-                content_html += f'<h3>Tag: <span class="tag">{tag_identifier}</span> ({len(tag_files)} files)</h3>'
-
-                # Tabella dei file con questo tag
-                content_html += """
-                <table>
-                    <thead>
-                        <tr>
-                            <th>Filename</th>
-                            <th>Type</th>
-                            <th>Created At</th>
-                            <th>Tags</th>
-                        </tr>
-                    </thead>
-                    <tbody>
-                """
-
-                for file in tag_files:
-                    # Formatta la data
-                    created_at = file.created_at.strftime("%Y-%m-%d %H:%M")
-
-                    # Genera l'HTML dei tag
-                    tags_html = '<div class="tags">'
-                    if file.tags:
-                        for tag in file.tags:
-                            tags_html += f'<span class="tag">{tag}</span>'
-                    else:
-                        tags_html += '<span style="color: #6a737d;">No tags</span>'
-                    tags_html += "</div>"
-
-                    # Determina l'icona in base al tipo di file
-                    filetype_class = f"filetype-{file.filetype.value}"
-
-                    # Aggiungi la riga alla tabella
-                    content_html += f"""
-                    <tr>
-                        <td><a href="/render/{file.filename}" class="{filetype_class}">{file.filename}</a></td>
-                        <td>{file.filetype.value}</td>
-                        <td>{created_at}</td>
-                        <td>{tags_html}</td>
-                    </tr>
-                    """
-
-                content_html += """
-                    </tbody>
-                </table>
-                """
-                content_html += "</div>"
-                content_html += "<hr>"
+                for file_tag in file.tags:
+                    files_by_tag.setdefault(file_tag, []).append(file)
+
+        # Totale dei file per ogni tag della pagina, calcolato in SQL
+        counts = tag_counts(db, files_by_tag)
+
+        chunks = ["<h2>Files by Tag</h2>"]
+        for tag_identifier, tag_files in files_by_tag.items():
+            chunks.append('<div class="tag-group">')
+            href = htmllib.escape(f"/?{urlencode({'tag': tag_identifier})}")
+            chunks.append(
+                f'<h3>Tag: <a href="{href}" class="tag">'
+                f"{htmllib.escape(tag_identifier)}</a> "
+                f"({counts.get(tag_identifier, 0)} files)</h3>"
+            )
+            # Tabella dei file con questo tag
+            chunks.append(TABLE_HEAD)
+            chunks.extend(rows[file.id] for file in tag_files)
+            chunks.append(TABLE_FOOT)
+            chunks.append("</div>")
+            chunks.append("<hr>")
 
         # Aggiunta di una sezione con tutti i file per riferimento
-        content_html += "<h2>All Files</h2>"
-        table_html = """
-        <table>
-            <thead>
-                <tr>
-                    <th>Filename</th>
-                    <th>Type</th>
-                    <th>Created At</th>
-                    <th>Tags</th>
-                </tr>
-            </thead>
-            <tbody>
-        """
-
-        for file in files:
-            # Formatta la data
-            created_at = file.created_at.strftime("%Y-%m-%d %H:%M")
-
-            # Genera l'HTML dei tag
-            tags_html = '<div class="tags">'
-            if file.tags:
-                for tag in file.tags:
-                    tags_html += f'<span class="tag">{tag}</span>'
-            else:
-                tags_html += '<span style="color: #6a737d;">No tags</span>'
-            tags_html += "</div>"
-
-            # Determina l'icona in base al tipo di file
-            filetype_class = f"filetype-{file.filetype.value}"
-
-            # Aggiungi la riga alla tabella
-            table_html += f"""
-            <tr>
-                <td><a href="/render/{file.filename}" class="{filetype_class}">{file.filename}</a></td>
-                <td>{file.filetype.value}</td>
-                <td>{created_at}</td>
-                <td>{tags_html}</td>
-            </tr>
-            """
-
-        table_html += """
-            </tbody>
-        </table>
-        """
-
-        content_html += table_html
-
-    # Replace __content__ with the generated HTML
-    rendered_html = template_html.replace("__content__", content_html)
-
-    return Response(content=rendered_html, media_type="text/html")
+        chunks.append("<h2>All Files</h2>")
+        chunks.append(TABLE_HEAD)
+        chunks.extend(rows.values())
+        chunks.append(TABLE_FOOT)
+
+        if next_cursor:
+            params = {"cursor": next_cursor, **({"tag": tag} if tag else {})}
+            href = htmllib.escape(f"/?{urlencode(params)}")
+            chunks.append(f'<a href="{href}">Older files</a>')
+        content_html = "".join(chunks)
+
+    if cursor or tag:
+        navigation_html = '<a href="/" class="back-link">Back to latest files</a>'
+    else:
+        navigation_html = "<!-- No navigation on home page -->"
+
+    return page_template.render(
+        page_title="Home",
+        # Il tag arriva dalla query string e la pagina finisce in home_cache
+        title=f"Files tagged {htmllib.escape(tag)}" if tag else "Files Repository",
+        navigation=navigation_html,
+        tags="<!-- No tags on home page -->",
+        content=content_html,
+    )
 
 
 @render_router.get("/render/{filename:path}")
-def render_file(filename: str, db: Session = Depends(get_db)) -> Response:
-    file = db.query(UploadedFile).filter(UploadedFile.filename == filename).first()
-    if not file:
+def render_file(
+    filename: str, request: Request, db: Session = Depends(get_db)
+) -> Response:
+    # Se piu' file hanno lo stesso nome, viene mostrato l'ultimo caricato
+    row = (
+        db.query(UploadedFile, Blob.backend, Blob.encoding)
+        .join(Blob, Blob.content_hash == UploadedFile.content_hash)
+        .filter(UploadedFile.filename == filename)
+        .order_by(UploadedFile.created_at.desc(), UploadedFile.id.desc())
+        .first()
+    )
+    if not row:
         raise HTTPException(status_code=404, detail="File not found")
-    file_bytes = base64.b64decode(file.content)
-    if file.filetype == FileTypeEnum.markdown:
-        # Convert markdown to HTML
-        html_content = mdlib.markdown(file_bytes.decode("utf-8"))
-
-        # Read the template HTML
-        template_path = Path(__file__).parent.parent / "template.html"
-        with open(template_path, "r") as template_file:
-            template_html = template_file.read()
-
-        # Set page title and heading
-        template_html = template_html.replace("__page_title__", f"Viewing {filename}")
-        template_html = template_html.replace("__title__", filename)
-
-        # Add navigation link back to home
-        template_html = template_html.replace(
-            "__navigation__", '<a href="/" class="back-link">Back to file list</a>'
-        )
-
-        # Generate HTML for tags if they exist
-        tags_html = ""
-        if file.tags:
-            tags_html = "<h3>Tags:</h3>"
-            for tag in file.tags:
-                tags_html += f'<span class="tag">{tag}</span>'
-        else:
-            tags_html = "<!-- No tags -->"
-
-        # Replace __tags__ with the tags HTML
-        template_html = template_html.replace("__tags__", tags_html)
-
-        # Replace __content__ with the rendered HTML
-        rendered_html = template_html.replace("__content__", html_content)
-
-        return Response(content=rendered_html, media_type="text/html")
+    file, backend, stored_encoding = row
+
+    # Rappresentazione gzip: pagine markdown dalla cache delle pagine compresse,
+    # altri file direttamente dai byte salvati compressi. Ogni rappresentazione
+    # ha il suo ETag. Le richieste Range ricevono sempre il contenuto originale.
+    markdown = file.filetype == FileTypeEnum.markdown
+    compressible = markdown or (
+        stored_encoding == GZIP and "range" not in request.headers
+    )
+    use_gzip = compressible and accepts_encoding(request, GZIP)
+
+    # Validatori calcolati dai soli metadati, senza leggere il contenuto
+    parts = [file.content_hash]
+    if markdown:
+        # La pagina mostra anche nome e tag del file: un nuovo upload con lo
+        # stesso contenuto e' una pagina diversa
+        parts.extend([file.id.hex, page_template.digest])
+    if use_gzip:
+        parts.append(GZIP)
+    etag = make_etag(*parts)
+    headers = validator_headers(etag, file.created_at, CACHE_CONTROL[file.filetype])
+    if markdown or stored_encoding == GZIP:
+        headers["Vary"] = "Accept-Encoding"
+    if is_not_modified(request, etag, file.created_at):
+        return not_modified(headers)
+    if use_gzip:
+        headers["Content-Encoding"] = GZIP
+
+    if markdown:
+
+        def markdown_page(html_content: str | None = None) -> str:
+            # Convert markdown to HTML (cached by content hash)
+            if html_content is None:
+                html_content = render_markdown(db, file)
+
+            # Generate HTML for tags if they exist
+            if file.tags:
+                tags_html = "<h3>Tags:</h3>" + "".join(
+                    f'<span class="tag">{htmllib.escape(tag)}</span>'
+                    for tag in file.tags
+                )
+            else:
+                tags_html = "<!-- No tags -->"
+
+            return page_template.render(
+                page_title=f"Viewing {htmllib.escape(filename)}",
+                title=htmllib.escape(filename),
+                # Add navigation link back to home
+                navigation='<a href="/" class="back-link">Back to file list</a>',
+                tags=tags_html,
+                content=html_content,
+            )
+
+        try:
+            if use_gzip:
+                body = gzip_page((file.id, page_template.digest), markdown_page)
+            else:
+                body = markdown_page()
+        except RenderTimeout as exc:
+            # Pagina provvisoria con il sorgente: non va in cache, ne' qui
+            # ne' nel client, che alla prossima richiesta trova l'HTML
+            body = markdown_page(exc.fallback)
+            if use_gzip:
+                body = compress(body.encode("utf-8"))
+            for name in ("ETag", "Last-Modified"):
+                headers.pop(name, None)
+            headers["Cache-Control"] = "no-store"
+        return Response(content=body, media_type="text/html", headers=headers)
     ext = filename.split(".")[-1].lower()
-    mimetypes = {
-        "png": "image/png",
-        "jpg": "image/jpeg",
-        "jpeg": "image/jpeg",
-        "gif": "image/gif",
-        "svg": "image/svg+xml",
-        "pdf": "application/pdf",
-        "txt": "text/plain",
-        "md": "text/markdown",
-        "html": "text/html",
-        "stl": "text/stl",
-    }
-    mimetype = mimetypes.get(ext, "application/octet-stream")
-    return Response(content=file_bytes, media_type=mimetype)
+    mimetype = MIMETYPES.get(ext, "application/octet-stream")
+
+    headers["Accept-Ranges"] = "bytes"
+    range_header = request.headers.get("range")
+    if use_gzip or stored_encoding is None:
+        # Byte inviati cosi' come sono salvati; dal filesystem con FileResponse,
+        # che li copia a blocchi (o con sendfile se il server lo supporta).
+        # Con un header Range FileResponse applicherebbe la sua logica, quindi
+        # in quel caso si passa dal codice qui sotto
+        path = blob_path(backend, file.content_hash, stored_encoding)
+        if path is not None and not range_header:
+            return FileResponse(path, media_type=mimetype, headers=headers)
+    if use_gzip:
+        # Byte compressi inviati cosi' come sono salvati
+        data, _ = read_stored_blob(db, file.content_hash)
+        return Response(content=data, media_type=mimetype, headers=headers)
+
+    if range_header and if_range_matches(request, etag, file.created_at):
+        try:
+            ranges = parse_range(range_header, file.size)
+        except RangeNotSatisfiable:
+            return Response(
+                status_code=416,
+                headers={**headers, "Content-Range": f"bytes */{file.size}"},
+            )
+        if ranges is not None:
+            return partial_response(db, file, ranges, mimetype, headers)
+    return Response(
+        content=read_blob(db, file.content_hash), media_type=mimetype, headers=headers
+    )
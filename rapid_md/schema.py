@@ -9,11 +9,14 @@ class FileResponse(BaseModel):
     filename: str
     created_at: datetime
     filetype: str
-    tags: Optional[dict] = None
+    tags: Optional[List[str]] = None
 
 
 class FilesListResponse(BaseModel):
     files: List[FileResponse]
+    next_cursor: Optional[str] = Field(
+        None, description="Cursor of the next page, null on the last page"
+    )
 
 
 class FileDeleteResponse(BaseModel):
@@ -21,6 +24,30 @@ class FileDeleteResponse(BaseModel):
     id: str
 
 
+class FilesDeleteRequest(BaseModel):
+    ids: Optional[List[UUID]] = Field(None, description="Ids of the files to delete")
+    upload_session: Optional[UUID] = Field(
+        None, description="Delete the files of this upload session"
+    )
+    tag: Optional[str] = Field(None, description="Delete the files with this tag")
+    created_after: Optional[datetime] = Field(
+        None, description="Delete the files created at or after this time"
+    )
+    created_before: Optional[datetime] = Field(
+        None, description="Delete the files created before this time"
+    )
+    dry_run: bool = Field(
+        False, description="Only count the matching files, without deleting them"
+    )
+
+
+class FilesDeleteResponse(BaseModel):
+    deleted: int = Field(
+        ..., description="Files deleted, or that would be deleted in a dry run"
+    )
+    dry_run: bool
+
+
 class FileUploadRequest(BaseModel):
     filepath: str = Field(..., description="Relative path of the file to save")
     content_base64: str = Field(..., description="File content encoded in base64")
@@ -32,9 +59,88 @@ class SingleFileUploadResponse(BaseModel):
     id: str
     filename: str
     filetype: str
-    tags: List[str] = Field(None, description="Optional tags for the file")
+    tags: Optional[List[str]] = Field(None, description="Optional tags for the file")
+    bytes_saved: int = Field(
+        0, description="Bytes not stored because the content was already present"
+    )
 
 
 class ZipFileUploadResponse(BaseModel):
     message: str
+    upload_session: UUID
     files: List[FileResponse]
+    bytes_saved: int = Field(
+        0, description="Bytes not stored because the content was already present"
+    )
+
+
+class PrerenderResponse(BaseModel):
+    rendered: int = Field(
+        ..., description="Markdown contents converted and stored by this request"
+    )
+
+
+class TagCount(BaseModel):
+    tag: str
+    count: int
+
+
+class TagsResponse(BaseModel):
+    tags: List[TagCount]
+
+
+class SearchResult(BaseModel):
+    id: UUID
+    filename: str
+    snippet: str = Field(
+        ..., description="Matching excerpt, HTML-escaped, terms wrapped in <mark>"
+    )
+    rank: float
+
+
+class SearchResponse(BaseModel):
+    results: List[SearchResult]
+
+
+class IngestJobError(BaseModel):
+    member: str
+    error: str
+
+
+class IngestJobResponse(BaseModel):
+    id: UUID
+    status: str = Field(..., description="queued, running, done or failed")
+    filename: str
+    upload_session: UUID
+    members_total: Optional[int] = Field(
+        None, description="Files in the archive, null until extraction starts"
+    )
+    members_done: int = Field(..., description="Files saved or failed so far")
+    bytes_total: Optional[int] = None
+    bytes_done: int
+    bytes_saved: int = Field(
+        0, description="Bytes not stored because the content was already present"
+    )
+    error_count: int
+    errors: List[IngestJobError] = Field(
+        default_factory=list, description="First errors of single archive members"
+    )
+    error: Optional[str] = Field(None, description="Why the whole job failed")
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+
+
+class ChangeEntry(BaseModel):
+    seq: int
+    op: str = Field(..., description="insert or delete")
+    id: UUID
+    changed_at: datetime
+    file: Optional[FileResponse] = Field(
+        None, description="Metadata of an inserted file, null if since deleted"
+    )
+
+
+class ChangesResponse(BaseModel):
+    changes: List[ChangeEntry]
+    next_since: int = Field(..., description="Value of `since` for the next request")
+    has_more: bool = Field(..., description="More changes are available right away")
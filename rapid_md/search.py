@@ -0,0 +1,146 @@
+import html
+import uuid
+from typing import Iterable
+from sqlalchemy import Float, Select, String, delete, insert, text
+from sqlalchemy.orm import Session
+from rapid_md.models import FileTypeEnum, SearchDocument
+
+
+SEARCH_PAGE_SIZE = 20
+SEARCH_MAX_PAGE_SIZE = 100
+
+# Prefissi piu' corti espandono a troppi termini e vanno ordinati quasi tutti
+# i documenti: vengono cercati come parole intere
+MIN_PREFIX_LENGTH = 3
+
+# Il database evidenzia i termini con dei caratteri di controllo, tolti dal
+# testo indicizzato: l'estratto viene escapato e solo dopo i marcatori
+# diventano tag, cosi' l'HTML dei documenti non arriva mai al client
+SNIPPET_START = "\x02"
+SNIPPET_END = "\x03"
+HIGHLIGHT_START = "<mark>"
+HIGHLIGHT_END = "</mark>"
+
+RESULT_COLUMNS = {
+    "file_id": SearchDocument.file_id.type,
+    "filename": String,
+    "snippet": String,
+    "rank": Float,
+}
+
+# I match sul nome del file pesano piu' di quelli nel testo
+SQLITE_SEARCH = text(
+    "SELECT d.file_id, d.filename, "
+    "snippet(search_documents_fts, 1, :start, :end, '…', 12) AS snippet, "
+    "-bm25(search_documents_fts, 10.0, 1.0) AS rank "
+    "FROM search_documents_fts "
+    "JOIN search_documents d ON d.id = search_documents_fts.rowid "
+    "WHERE search_documents_fts MATCH :query "
+    "ORDER BY rank DESC LIMIT :limit"
+).columns(**RESULT_COLUMNS)
+
+# ts_headline e' costoso: viene calcolato solo sui risultati della pagina
+POSTGRES_SEARCH = text(
+    "WITH matches AS ("
+    "SELECT d.file_id, d.filename, d.body, q.query, "
+    "ts_rank(to_tsvector('simple', d.filename || ' ' || d.body), q.query) AS rank "
+    "FROM search_documents d, websearch_to_tsquery('simple', :query) AS q(query) "
+    "WHERE to_tsvector('simple', d.filename || ' ' || d.body) @@ q.query "
+    "ORDER BY rank DESC LIMIT :limit) "
+    "SELECT file_id, filename, "
+    "ts_headline('simple', body, query, "
+    "'StartSel=' || :start || ', StopSel=' || :end || ', MaxWords=24, MinWords=8') "
+    "AS snippet, rank FROM matches ORDER BY rank DESC"
+).columns(**RESULT_COLUMNS)
+
+
+def is_searchable(filetype: FileTypeEnum) -> bool:
+    return filetype == FileTypeEnum.markdown
+
+
+def search_row(file_id: uuid.UUID, filename: str, content: bytes) -> dict:
+    return {
+        "file_id": file_id,
+        "filename": filename,
+        "body": content.decode("utf-8", errors="replace")
+        .replace(SNIPPET_START, "")
+        .replace(SNIPPET_END, ""),
+    }
+
+
+def highlight_snippet(snippet: str) -> str:
+    """
+    Estratto restituito dal database come HTML sicuro, con i termini
+    trovati tra <mark>
+    """
+    return (
+        html.escape(snippet)
+        .replace(SNIPPET_START, HIGHLIGHT_START)
+        .replace(SNIPPET_END, HIGHLIGHT_END)
+    )
+
+
+def document_rows(rows: Iterable[dict]) -> list[dict]:
+    """
+    Righe di search_documents per i file markdown tra le righe di
+    uploaded_files indicate. La decodifica del testo va fatta fuori
+    dall'event loop, prima di aprire la sessione asincrona.
+    """
+    return [
+        search_row(row["id"], row["filename"], row["content"])
+        for row in rows
+        if is_searchable(row["filetype"])
+    ]
+
+
+def index_documents(db: Session, documents: list[dict]) -> None:
+    """
+    Aggiunge all'indice le righe preparate da document_rows, nella
+    transazione corrente
+    """
+    if documents:
+        db.execute(insert(SearchDocument), documents)
+
+
+def delete_documents(db: Session, file_ids: Select) -> None:
+    """
+    Rimuove dall'indice i file restituiti dalla select `file_ids`
+    """
+    db.execute(delete(SearchDocument).where(SearchDocument.file_id.in_(file_ids)))
+
+
+def fts5_query(q: str) -> str:
+    """
+    Converte il testo dell'utente in una query FTS5 sicura: ogni parola
+    diventa una frase tra virgolette (in AND), un `*` finale fa da prefisso
+    (di almeno MIN_PREFIX_LENGTH caratteri)
+    """
+    terms = []
+    for word in q.split():
+        prefix = word.endswith("*")
+        word = word.rstrip("*")
+        prefix = prefix and len(word) >= MIN_PREFIX_LENGTH
+        if word:
+            terms.append('"' + word.replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+def search_documents(db: Session, q: str, limit: int = SEARCH_PAGE_SIZE) -> list[dict]:
+    """
+    Documenti che contengono tutte le parole di `q`, dal piu' rilevante,
+    con un estratto del testo (escapato) in cui i termini trovati sono
+    evidenziati
+    """
+    params = {"limit": limit, "start": SNIPPET_START, "end": SNIPPET_END}
+    if db.get_bind().dialect.name == "postgresql":
+        statement = POSTGRES_SEARCH
+        params["query"] = q
+    else:
+        statement = SQLITE_SEARCH
+        params["query"] = fts5_query(q)
+        if not params["query"]:
+            return []
+    return [
+        {**row._mapping, "snippet": highlight_snippet(row.snippet)}
+        for row in db.execute(statement, params)
+    ]
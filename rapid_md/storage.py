@@ -0,0 +1,359 @@
+import gzip
+import hashlib
+import io
+import os
+import shutil
+from collections import Counter
+from tempfile import SpooledTemporaryFile
+from typing import BinaryIO, Iterable, Iterator, NamedTuple
+from sqlalchemy import Table, bindparam, delete, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+from rapid_md.backends import COPY_CHUNK_SIZE, default_backend_name, get_backend
+from rapid_md.models import Blob, FileTypeEnum
+
+# Tabella Core: gli update con executemany non passano dal bulk update ORM
+blobs_table = Blob.__table__
+
+COMPRESSION_LEVEL_ENV = "RAPID_MD_COMPRESSION_LEVEL"
+
+GZIP = "gzip"
+
+# Formati gia' compressi: ricomprimerli costa CPU senza ridurne la dimensione
+COMPRESSED_EXTENSIONS = {
+    ".7z",
+    ".br",
+    ".bz2",
+    ".gif",
+    ".gz",
+    ".jpeg",
+    ".jpg",
+    ".mp3",
+    ".mp4",
+    ".png",
+    ".webp",
+    ".xz",
+    ".zip",
+    ".zst",
+}
+
+# Il contenuto viene salvato compresso solo se occupa almeno il 10% in meno
+MIN_COMPRESSION_RATIO = 0.9
+
+
+class BlobData(NamedTuple):
+    """
+    Contenuto pronto per la tabella blobs: `data` e' compresso secondo
+    `encoding` (None se salvato cosi' com'e'), `size` e' la dimensione originale.
+    `data` puo' essere un file, per i contenuti preparati da prepare_file_blob.
+    """
+
+    content_hash: str
+    size: int
+    data: bytes | BinaryIO
+    encoding: str | None
+
+
+class StoredBlob(NamedTuple):
+    """
+    Blob gia' scritto nel suo backend: `content` e' il valore della colonna
+    blobs.content (None se i byte sono altrove)
+    """
+
+    content_hash: str
+    size: int
+    content: bytes | None
+    encoding: str | None
+    backend: str
+
+
+def get_compression_level() -> int:
+    # 0 disattiva la compressione dei nuovi upload
+    return int(os.getenv(COMPRESSION_LEVEL_ENV, "6"))
+
+
+def should_compress(filename: str, filetype: FileTypeEnum) -> bool:
+    ext = os.path.splitext(filename)[1].lower()
+    if filetype == FileTypeEnum.image:
+        return ext == ".svg"
+    return ext not in COMPRESSED_EXTENSIONS
+
+
+def compress(data: bytes, level: int | None = None) -> bytes:
+    # mtime fisso: lo stesso contenuto produce sempre gli stessi byte
+    return gzip.compress(data, compresslevel=level or get_compression_level(), mtime=0)
+
+
+def decode(data: bytes, encoding: str | None) -> bytes:
+    if encoding == GZIP:
+        return gzip.decompress(data)
+    return data
+
+
+def prepare_blob(
+    filename: str,
+    filetype: FileTypeEnum,
+    content: bytes,
+    content_hash: str | None = None,
+) -> BlobData:
+    """
+    Calcola hash e forma compressa del contenuto; va eseguita fuori
+    dall'event loop, nei thread degli upload
+    """
+    if content_hash is None:
+        content_hash = hashlib.sha256(content).hexdigest()
+    level = get_compression_level()
+    if level > 0 and should_compress(filename, filetype):
+        compressed = compress(content, level)
+        if len(compressed) <= len(content) * MIN_COMPRESSION_RATIO:
+            return BlobData(content_hash, len(content), compressed, GZIP)
+    return BlobData(content_hash, len(content), content, None)
+
+
+def prepare_file_blob(
+    filename: str,
+    filetype: FileTypeEnum,
+    file: BinaryIO,
+    content_hash: str,
+    size: int,
+    chunk_size: int = COPY_CHUNK_SIZE,
+) -> BlobData:
+    """
+    Come prepare_blob, per un contenuto gia' su file temporaneo di cui sono
+    noti hash e dimensione: la forma compressa viene scritta a blocchi su un
+    altro file temporaneo, senza caricare il contenuto in memoria. Se `data`
+    non e' `file` va chiuso dal chiamante.
+    """
+    level = get_compression_level()
+    file.seek(0)
+    if level > 0 and should_compress(filename, filetype):
+        compressed = SpooledTemporaryFile(max_size=chunk_size)
+        # filename vuoto: l'header gzip non riporta il nome del file temporaneo
+        with gzip.GzipFile(
+            filename="", mode="wb", compresslevel=level, fileobj=compressed, mtime=0
+        ) as f:
+            shutil.copyfileobj(file, f, chunk_size)
+        if compressed.tell() <= size * MIN_COMPRESSION_RATIO:
+            compressed.seek(0)
+            return BlobData(content_hash, size, compressed, GZIP)
+        compressed.close()
+        file.seek(0)
+    return BlobData(content_hash, size, file, None)
+
+
+def upsert(db: Session, table: Table = blobs_table):
+    """
+    INSERT ... ON CONFLICT del dialetto in uso (SQLite o PostgreSQL)
+    """
+    if db.get_bind().dialect.name == "postgresql":
+        return pg_insert(table)
+    return sqlite_insert(table)
+
+
+def save_blob_contents(blobs: Iterable[BlobData]) -> list[StoredBlob]:
+    """
+    Scrive i contenuti nel backend dei nuovi blob, fuori dalla sessione:
+    con una sessione asincrona store_blobs gira sull'event loop, dove
+    scritture su disco e fsync non devono finire. Va eseguita nei thread
+    degli upload. Anche i contenuti gia' presenti vengono scritti: un file
+    rimasto senza riga di blobs viene rimosso da gc-storage.
+    """
+    backend = get_backend(default_backend_name())
+    stored = {}
+    for blob in blobs:
+        if blob.content_hash not in stored:
+            content = backend.save(blob.content_hash, blob.encoding, blob.data)
+            stored[blob.content_hash] = StoredBlob(
+                blob.content_hash, blob.size, content, blob.encoding, backend.name
+            )
+    return list(stored.values())
+
+
+def store_blobs(db: Session, blobs: Iterable[BlobData | StoredBlob]) -> int:
+    """
+    Salva i contenuti una volta sola per hash, incrementando il contatore
+    di riferimenti dei blob gia' presenti. I BlobData vengono scritti nel
+    backend qui, gli StoredBlob (vedi save_blob_contents) lo sono gia'.
+    Restituisce i byte risparmiati grazie alla deduplicazione.
+    """
+    counts = Counter()
+    contents = {}
+    for blob in blobs:
+        counts[blob.content_hash] += 1
+        contents[blob.content_hash] = blob
+    if not counts:
+        return 0
+
+    # Solo per il conteggio dei byte risparmiati: una cancellazione
+    # concorrente (release_blobs) puo' rimuovere un blob subito dopo
+    existing = set(
+        db.execute(
+            select(Blob.content_hash).where(Blob.content_hash.in_(counts))
+        ).scalars()
+    )
+    saved = sum(contents[h].size * counts[h] for h in existing)
+    saved += sum(
+        contents[h].size * (counts[h] - 1) for h in counts if h not in existing
+    )
+
+    # Il file viene scritto prima della riga: una riga di blobs punta
+    # sempre a contenuto gia' salvato. Anche i blob gia' presenti passano
+    # dall'upsert, che li reinserisce se sono stati cancellati nel frattempo.
+    stored = {
+        blob.content_hash: blob
+        for blob in save_blob_contents(
+            blob for blob in contents.values() if isinstance(blob, BlobData)
+        )
+    }
+    stored.update(
+        (h, blob) for h, blob in contents.items() if isinstance(blob, StoredBlob)
+    )
+    statement = upsert(db)
+    db.execute(
+        statement.on_conflict_do_update(
+            index_elements=[blobs_table.c.content_hash],
+            set_={"refcount": blobs_table.c.refcount + statement.excluded.refcount},
+        ),
+        [
+            {
+                "content_hash": h,
+                "content": stored[h].content,
+                "backend": stored[h].backend,
+                "encoding": stored[h].encoding,
+                "size": stored[h].size,
+                "refcount": counts[h],
+            }
+            for h in counts
+        ],
+    )
+    return saved
+
+
+def release_blobs(db: Session, content_hashes: Iterable[str]) -> None:
+    """
+    Rilascia un riferimento per ogni hash; i blob senza piu' riferimenti
+    vengono cancellati
+    """
+    counts = Counter(content_hashes)
+    if not counts:
+        return
+    db.execute(
+        update(blobs_table)
+        .where(blobs_table.c.content_hash == bindparam("hash"))
+        .values(refcount=blobs_table.c.refcount - bindparam("n")),
+        [{"hash": content_hash, "n": n} for content_hash, n in counts.items()],
+    )
+    db.execute(
+        delete(blobs_table).where(
+            blobs_table.c.content_hash.in_(counts), blobs_table.c.refcount <= 0
+        )
+    )
+
+
+def blob_location(db: Session, content_hash: str) -> tuple[str, str | None]:
+    """
+    Backend e codifica del blob, senza leggerne il contenuto
+    """
+    backend, encoding = db.execute(
+        select(Blob.backend, Blob.encoding).where(Blob.content_hash == content_hash)
+    ).one()
+    return backend, encoding
+
+
+def blob_path(backend: str, content_hash: str, encoding: str | None) -> str | None:
+    """
+    Percorso su disco del blob, se il suo backend ne ha uno: permette di
+    servirlo con FileResponse senza passare il contenuto da Python
+    """
+    return get_backend(backend).path(content_hash, encoding)
+
+
+def read_stored_blob(db: Session, content_hash: str) -> tuple[bytes, str | None]:
+    """
+    Byte cosi' come sono salvati, con la loro codifica: possono essere
+    inviati direttamente al client con Content-Encoding
+    """
+    backend, encoding = blob_location(db, content_hash)
+    return get_backend(backend).read(db, content_hash, encoding), encoding
+
+
+def read_blob(db: Session, content_hash: str) -> bytes:
+    return decode(*read_stored_blob(db, content_hash))
+
+
+def read_ranges(
+    db: Session, content_hash: str, ranges: Iterable[tuple[int, int]]
+) -> Iterator[bytes]:
+    """
+    Contenuto di ogni intervallo (start, length), aprendo il blob una volta
+    sola. Un blob compresso viene decompresso in streaming fino alla fine
+    dell'ultimo intervallo, senza tenere in memoria il contenuto decompresso.
+    """
+    backend, encoding = blob_location(db, content_hash)
+    reader = get_backend(backend)
+    if encoding is None:
+        for start, length in ranges:
+            yield reader.read_range(db, content_hash, encoding, start, length)
+        return
+    path = blob_path(backend, content_hash, encoding)
+    if path is not None:
+        source = open(path, "rb")
+    else:
+        source = io.BytesIO(reader.read(db, content_hash, encoding))
+    with source, gzip.GzipFile(fileobj=source) as f:
+        for start, length in ranges:
+            # In avanti seek decomprime scartando i byte, all'indietro
+            # riparte dall'inizio: gli intervalli in ordine costano una lettura
+            f.seek(start)
+            yield f.read(length)
+
+
+def read_range(db: Session, content_hash: str, start: int, length: int) -> bytes:
+    """
+    Legge solo `length` byte del contenuto a partire da `start`,
+    senza caricare l'intero file in memoria
+    """
+    return b"".join(read_ranges(db, content_hash, [(start, length)]))
+
+
+def iter_stored_blob(
+    db: Session, content_hash: str, chunk_size: int
+) -> Iterator[bytes]:
+    """
+    Byte cosi' come sono salvati (eventualmente compressi), a blocchi di
+    `chunk_size`: dal disco in streaming, dal database per intervalli
+    """
+    backend, encoding = blob_location(db, content_hash)
+    path = blob_path(backend, content_hash, encoding)
+    if path is not None:
+        with open(path, "rb") as f:
+            while chunk := f.read(chunk_size):
+                yield chunk
+        return
+    start = 0
+    reader = get_backend(backend)
+    while chunk := reader.read_range(db, content_hash, encoding, start, chunk_size):
+        yield chunk
+        start += len(chunk)
+
+
+def iter_blob(db: Session, content_hash: str, chunk_size: int) -> Iterator[bytes]:
+    """
+    Contenuto decodificato a blocchi di `chunk_size` byte, senza caricarlo
+    per intero: dal disco in streaming, dal database per intervalli. Un blob
+    compresso nel database viene letto in forma compressa e decompresso a blocchi.
+    """
+    backend, encoding = blob_location(db, content_hash)
+    path = blob_path(backend, content_hash, encoding)
+    if path is not None:
+        source = open(path, "rb")
+    elif encoding is not None:
+        source = io.BytesIO(get_backend(backend).read(db, content_hash, encoding))
+    else:
+        yield from iter_stored_blob(db, content_hash, chunk_size)
+        return
+    with source:
+        f = gzip.GzipFile(fileobj=source) if encoding == GZIP else source
+        while chunk := f.read(chunk_size):
+            yield chunk
@@ -0,0 +1,51 @@
+import uuid
+from typing import Iterable, Literal
+from sqlalchemy import Select, delete, func, insert, select
+from sqlalchemy.orm import Query, Session
+from rapid_md.models import FileTag, UploadedFile
+
+
+TagMode = Literal["all", "any"]
+
+
+def add_file_tags(db: Session, file_id: uuid.UUID, tags: Iterable[str] | None) -> None:
+    """
+    Registra i tag del file nella tabella file_tags (nella transazione corrente)
+    """
+    unique_tags = sorted(set(tags or []))
+    if unique_tags:
+        db.execute(
+            insert(FileTag), [{"file_id": file_id, "tag": tag} for tag in unique_tags]
+        )
+
+
+def delete_file_tags(db: Session, file_ids: Select) -> None:
+    """
+    Cancella i tag dei file restituiti dalla select `file_ids`
+    """
+    db.execute(delete(FileTag).where(FileTag.file_id.in_(file_ids)))
+
+
+def filter_by_tags(query: Query, tags: list[str], mode: TagMode = "all") -> Query:
+    """
+    Limita la query ai file con tutti (`all`) o almeno uno (`any`) dei tag,
+    usando l'indice su file_tags(tag, file_id)
+    """
+    unique_tags = sorted(set(tags))
+    matching = select(FileTag.file_id).where(FileTag.tag.in_(unique_tags))
+    if mode == "all" and len(unique_tags) > 1:
+        matching = matching.group_by(FileTag.file_id).having(
+            func.count() == len(unique_tags)
+        )
+    return query.filter(UploadedFile.id.in_(matching))
+
+
+def tag_counts(db: Session, tags: Iterable[str] | None = None) -> dict[str, int]:
+    """
+    Numero di file per tag, calcolato in SQL; se `tags` e' indicato
+    vengono contati solo quei tag
+    """
+    query = select(FileTag.tag, func.count()).group_by(FileTag.tag)
+    if tags is not None:
+        query = query.where(FileTag.tag.in_(set(tags)))
+    return {tag: count for tag, count in db.execute(query)}
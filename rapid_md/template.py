@@ -0,0 +1,60 @@
+import hashlib
+import re
+from pathlib import Path
+
+
+TEMPLATE_PATH = Path(__file__).parent.parent / "template.html"
+
+PLACEHOLDERS = (
+    "__page_title__",
+    "__title__",
+    "__navigation__",
+    "__tags__",
+    "__content__",
+)
+_PLACEHOLDER_RE = re.compile("|".join(re.escape(p) for p in PLACEHOLDERS))
+
+
+class PageTemplate:
+    """
+    Template HTML precompilato: il sorgente viene diviso una sola volta in
+    parti fisse e segnaposto, e il render e' un singolo join delle parti.
+    """
+
+    def __init__(self, source: str):
+        # Identifica il template negli ETag delle pagine generate
+        self.digest = hashlib.sha256(source.encode("utf-8")).hexdigest()[:12]
+        # Lista di (testo, segnaposto); il segnaposto e' None per l'ultima parte
+        self._parts: list[tuple[str, str | None]] = []
+        position = 0
+        for match in _PLACEHOLDER_RE.finditer(source):
+            self._parts.append((source[position : match.start()], match.group(0)))
+            position = match.end()
+        self._parts.append((source[position:], None))
+
+    @classmethod
+    def from_path(cls, path: Path) -> "PageTemplate":
+        with open(path, "r") as template_file:
+            return cls(template_file.read())
+
+    def render(
+        self,
+        page_title: str,
+        title: str,
+        navigation: str,
+        tags: str,
+        content: str,
+    ) -> str:
+        values = {
+            "__page_title__": page_title,
+            "__title__": title,
+            "__navigation__": navigation,
+            "__tags__": tags,
+            "__content__": content,
+        }
+        chunks = []
+        for text, placeholder in self._parts:
+            chunks.append(text)
+            if placeholder is not None:
+                chunks.append(values[placeholder])
+        return "".join(chunks)
@@ -0,0 +1,179 @@
+import hashlib
+import os
+from tempfile import SpooledTemporaryFile
+from typing import AsyncIterator, BinaryIO
+from python_multipart.multipart import MultipartParser, parse_options_header
+
+
+UPLOAD_CHUNK_SIZE_ENV = "RAPID_MD_UPLOAD_CHUNK_SIZE"
+
+# Campo del form multipart con il contenuto del file
+FILE_FIELD = "file"
+
+
+def get_upload_chunk_size() -> int:
+    return int(os.getenv(UPLOAD_CHUNK_SIZE_ENV, str(1024 * 1024)))
+
+
+class SpooledUpload:
+    """
+    Contenuto di un upload appoggiato su file temporaneo, con hash e
+    dimensione calcolati durante la copia
+    """
+
+    def __init__(self, file: BinaryIO, content_hash: str, size: int):
+        self.file = file
+        self.content_hash = content_hash
+        self.size = size
+
+    def read(self) -> bytes:
+        self.file.seek(0)
+        return self.file.read()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class SpoolWriter:
+    """
+    File temporaneo su cui viene copiato un upload, calcolandone hash e
+    dimensione durante la scrittura
+    """
+
+    def __init__(self, chunk_size: int):
+        self.file = SpooledTemporaryFile(max_size=chunk_size)
+        self.digest = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk: bytes) -> None:
+        self.digest.update(chunk)
+        self.size += len(chunk)
+        self.file.write(chunk)
+
+    def finish(self) -> SpooledUpload:
+        self.file.seek(0)
+        return SpooledUpload(self.file, self.digest.hexdigest(), self.size)
+
+
+async def spool_stream(
+    chunks: AsyncIterator[bytes], chunk_size: int | None = None
+) -> SpooledUpload:
+    """
+    Copia un body in streaming su un file temporaneo: in memoria resta
+    al piu' `chunk_size` byte, oltre i quali il file passa su disco
+    """
+    writer = SpoolWriter(chunk_size or get_upload_chunk_size())
+    async for chunk in chunks:
+        writer.write(chunk)
+    return writer.finish()
+
+
+class MultipartUpload:
+    """
+    Form multipart letto da spool_multipart: il campo `file` e' gia' su file
+    temporaneo con il suo hash, gli altri campi sono testo
+    """
+
+    def __init__(self):
+        self.upload: SpooledUpload | None = None
+        self.filename: str | None = None
+        self.fields: dict[str, list[str]] = {}
+
+    def value(self, name: str) -> str | None:
+        values = self.fields.get(name)
+        return values[-1] if values else None
+
+    def close(self) -> None:
+        if self.upload is not None:
+            self.upload.close()
+
+
+async def spool_multipart(
+    content_type: str,
+    chunks: AsyncIterator[bytes],
+    chunk_size: int | None = None,
+) -> MultipartUpload:
+    """
+    Legge un form multipart in streaming: la parte `file` viene copiata su
+    file temporaneo (con hash e dimensione calcolati durante la copia), i
+    campi di testo, lunghi al piu' `chunk_size` byte, restano in memoria.
+    Un form non valido solleva ValueError.
+    """
+    chunk_size = chunk_size or get_upload_chunk_size()
+    _, options = parse_options_header(content_type)
+    boundary = options.get(b"boundary")
+    if not boundary:
+        raise ValueError("Missing multipart boundary")
+
+    form = MultipartUpload()
+    headers: dict[bytes, bytes] = {}
+    header_field = bytearray()
+    header_value = bytearray()
+    part: dict = {}
+
+    def on_part_begin() -> None:
+        headers.clear()
+        part.clear()
+
+    def on_header_field(data: bytes, start: int, end: int) -> None:
+        header_field.extend(data[start:end])
+
+    def on_header_value(data: bytes, start: int, end: int) -> None:
+        header_value.extend(data[start:end])
+
+    def on_header_end() -> None:
+        headers[bytes(header_field).lower()] = bytes(header_value)
+        header_field.clear()
+        header_value.clear()
+
+    def on_headers_finished() -> None:
+        _, options = parse_options_header(headers.get(b"content-disposition"))
+        part["name"] = options.get(b"name", b"").decode()
+        if part["name"] == FILE_FIELD:
+            filename = options.get(b"filename")
+            part["filename"] = filename.decode() if filename is not None else None
+            part["writer"] = SpoolWriter(chunk_size)
+        else:
+            part["value"] = bytearray()
+
+    def on_part_data(data: bytes, start: int, end: int) -> None:
+        if "writer" in part:
+            part["writer"].write(data[start:end])
+            return
+        part["value"].extend(data[start:end])
+        if len(part["value"]) > chunk_size:
+            raise ValueError(f"Form field '{part['name']}' too large")
+
+    def on_part_end() -> None:
+        if "writer" in part:
+            # Con piu' parti `file` vale l'ultima, come per i campi di testo
+            form.close()
+            form.upload = part.pop("writer").finish()
+            form.filename = part["filename"]
+        else:
+            value = part["value"].decode("utf-8", errors="replace")
+            form.fields.setdefault(part["name"], []).append(value)
+
+    parser = MultipartParser(
+        boundary,
+        {
+            "on_part_begin": on_part_begin,
+            "on_header_field": on_header_field,
+            "on_header_value": on_header_value,
+            "on_header_end": on_header_end,
+            "on_headers_finished": on_headers_finished,
+            "on_part_data": on_part_data,
+            "on_part_end": on_part_end,
+        },
+    )
+    try:
+        async for chunk in chunks:
+            parser.write(chunk)
+        parser.finalize()
+    except BaseException:
+        # Anche gli errori di parsing di python-multipart sono ValueError
+        form.close()
+        if "writer" in part:
+            part["writer"].file.close()
+        raise
+    return form
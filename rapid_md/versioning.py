@@ -0,0 +1,30 @@
+from datetime import datetime
+from sqlalchemy import select, update
+from sqlalchemy.orm import Session
+from rapid_md.models import DataVersion
+
+
+DATA_VERSION_ID = 1
+
+
+def bump_data_version(db: Session) -> None:
+    """
+    Incrementa la versione globale dei dati nella transazione corrente.
+    Va chiamata da ogni operazione che aggiunge o rimuove file.
+    """
+    db.execute(
+        update(DataVersion)
+        .where(DataVersion.id == DATA_VERSION_ID)
+        .values(version=DataVersion.version + 1, updated_at=datetime.utcnow())
+    )
+
+
+def get_data_version(db: Session) -> tuple[int, datetime | None]:
+    row = db.execute(
+        select(DataVersion.version, DataVersion.updated_at).where(
+            DataVersion.id == DATA_VERSION_ID
+        )
+    ).first()
+    if row is None:
+        return 0, None
+    return row.version, row.updated_at
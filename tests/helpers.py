@@ -0,0 +1,96 @@
+"""
+Shared test fixtures: an in-memory database used by both the tests and the
+app under test, and helpers to store files in it
+"""
+
+import hashlib
+import unittest
+import uuid
+from datetime import datetime
+from typing import Generator
+
+from sqlalchemy import create_engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from rapid_md.db import get_db, get_session_factory
+from rapid_md.models import Base, FileTypeEnum, UploadedFile
+from rapid_md.rendering import home_cache, page_cache, render_cache
+from rapid_md.storage import BlobData, prepare_blob, store_blobs
+
+
+def stored_content(db: Session, content: bytes) -> dict:
+    """
+    Store the blob and return the UploadedFile fields that reference it
+    """
+    content_hash = hashlib.sha256(content).hexdigest()
+    store_blobs(db, [BlobData(content_hash, len(content), content, None)])
+    return {"content_hash": content_hash, "size": len(content)}
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """
+    In-memory SQLite database, shared through StaticPool by the test session
+    (self.db) and the sessions of the app (self.overrides), with the
+    rendering caches cleared
+    """
+
+    def setUp(self):
+        self.engine = create_engine(
+            "sqlite:///:memory:",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        Base.metadata.create_all(self.engine)
+        self.addCleanup(self.engine.dispose)
+        self.SessionLocal = sessionmaker(
+            autocommit=False, autoflush=False, bind=self.engine
+        )
+        self.overrides = {
+            get_db: self.override_get_db,
+            get_session_factory: lambda: self.SessionLocal,
+        }
+        render_cache.clear()
+        page_cache.clear()
+        home_cache.clear()
+
+        self.db = self.SessionLocal()
+        self.addCleanup(self.db.close)
+        # Upload session of the files added by add_file
+        self.session = uuid.uuid4()
+
+    def override_get_db(self) -> Generator[Session, None, None]:
+        db = self.SessionLocal()
+        try:
+            yield db
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def add_file(
+        self,
+        filename: str,
+        content: bytes,
+        filetype: FileTypeEnum = FileTypeEnum.markdown,
+        upload_session: uuid.UUID | None = None,
+    ) -> UploadedFile:
+        """
+        Store and commit a file, compressed as an upload would be
+        """
+        blob = prepare_blob(filename, filetype, content)
+        store_blobs(self.db, [blob])
+        file = UploadedFile(
+            id=uuid.uuid4(),
+            filename=filename,
+            content_hash=blob.content_hash,
+            size=blob.size,
+            created_at=datetime(2025, 10, 17, 12, 0),
+            filetype=filetype,
+            upload_session=upload_session or self.session,
+        )
+        self.db.add(file)
+        self.db.commit()
+        return file
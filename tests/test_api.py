@@ -0,0 +1,965 @@
+import unittest
+import asyncio
+import base64
+import gzip
+import hashlib
+import io
+import json
+import importlib.util
+import os
+import tempfile
+import threading
+import time
+import zipfile
+import uuid
+from unittest.mock import patch
+from datetime import datetime, timedelta
+from typing import Generator
+
+
+from fastapi.testclient import TestClient
+from fastapi import FastAPI
+from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+from sqlalchemy.orm import Session
+
+from rapid_md.backends import FilesystemBackend
+from rapid_md.changes import prune_changes
+from rapid_md.db import async_database_url
+from rapid_md.ingest import iter_zip_batches
+from rapid_md.jobs import create_ingest_job, process_ingest_job, spool_path
+from rapid_md.router_api import change_events, router, get_db, save_uploaded_file
+from rapid_md.models import (
+    Blob,
+    FileChange,
+    IngestJob,
+    JobStatusEnum,
+    UploadedFile,
+    FileTag,
+    FileTypeEnum,
+    Base,
+)
+from rapid_md.search import search_row
+from rapid_md.storage import read_blob
+from rapid_md.tags import add_file_tags
+from rapid_md.versioning import get_data_version
+from tests.helpers import DatabaseTestCase, stored_content
+
+
+API_KEY = "test-key"
+
+
+class TestApiRoutes(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.app = FastAPI()
+        self.app.include_router(router)
+        self.app.dependency_overrides = self.overrides
+        self.client = TestClient(self.app)
+        self.headers = {"x-api-key": API_KEY}
+
+        jobs_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(jobs_dir.cleanup)
+        env = patch.dict(
+            "os.environ",
+            {"RAPID_MD_API_KEY": API_KEY, "RAPID_MD_JOBS_PATH": jobs_dir.name},
+        )
+        env.start()
+        self.addCleanup(env.stop)
+
+        # Five files, the first three created at the same second, so that
+        # pagination has to break ties on the id. The ids are sorted in reverse
+        # order of the filenames, which keeps the expected order deterministic.
+        base = datetime(2025, 10, 15, 10, 0)
+        created = [
+            base,
+            base,
+            base,
+            base + timedelta(hours=1),
+            base + timedelta(hours=2),
+        ]
+        ids = sorted((uuid.uuid4() for _ in created), reverse=True)
+        self.files = []
+        for i, created_at in enumerate(created):
+            self.files.append(
+                UploadedFile(
+                    id=ids[i],
+                    filename=f"file{i}.md",
+                    **stored_content(self.db, f"# File {i}".encode("utf-8")),
+                    created_at=created_at,
+                    filetype=FileTypeEnum.markdown,
+                    tags=["even"] if i % 2 == 0 else ["odd"],
+                    upload_session=uuid.uuid4(),
+                )
+            )
+        self.db.add_all(self.files)
+        self.db.flush()
+        for f in self.files:
+            add_file_tags(self.db, f.id, f.tags + ["all"])
+        self.db.commit()
+        self.expected_order = [
+            f.id for f in sorted(self.files, key=lambda f: (f.created_at, f.id))
+        ]
+
+    def test_list_files_requires_api_key(self):
+        response = self.client.get("/files")
+        self.assertEqual(response.status_code, 401)
+
+    def test_list_files_keyset_pagination(self):
+        seen = []
+        cursor = None
+        pages = 0
+        while True:
+            params = {"limit": 2}
+            if cursor:
+                params["cursor"] = cursor
+            response = self.client.get("/files", params=params, headers=self.headers)
+            self.assertEqual(response.status_code, 200)
+            data = response.json()
+            seen.extend(uuid.UUID(f["id"]) for f in data["files"])
+            pages += 1
+            cursor = data["next_cursor"]
+            if cursor is None:
+                break
+
+        self.assertEqual(pages, 3)
+        self.assertEqual(seen, self.expected_order)
+
+    def test_list_files_invalid_cursor(self):
+        response = self.client.get(
+            "/files", params={"cursor": "not-a-cursor"}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_list_files_ndjson_stream(self):
+        response = self.client.get(
+            "/files", params={"format": "ndjson"}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["content-type"], "application/x-ndjson")
+        rows = [json.loads(line) for line in response.text.splitlines()]
+        self.assertEqual([uuid.UUID(r["id"]) for r in rows], self.expected_order)
+        tags = {uuid.UUID(r["id"]): r["tags"] for r in rows}
+        self.assertEqual(tags, {f.id: f.tags for f in self.files})
+
+    def list_ids(self, **params) -> set[uuid.UUID]:
+        response = self.client.get("/files", params=params, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return {uuid.UUID(f["id"]) for f in response.json()["files"]}
+
+    def test_list_files_filtered_by_tag(self):
+        even = {f.id for i, f in enumerate(self.files) if i % 2 == 0}
+        self.assertEqual(self.list_ids(tag=["even"]), even)
+        self.assertEqual(self.list_ids(tag=["even", "all"]), even)
+        self.assertEqual(self.list_ids(tag=["even", "odd"]), set())
+        self.assertEqual(
+            self.list_ids(tag=["even", "odd"], tag_mode="any"),
+            {f.id for f in self.files},
+        )
+        self.assertEqual(self.list_ids(tag=["missing"]), set())
+
+    def test_list_tags_counts(self):
+        response = self.client.get("/tags", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["tags"],
+            [
+                {"tag": "all", "count": 5},
+                {"tag": "even", "count": 3},
+                {"tag": "odd", "count": 2},
+            ],
+        )
+
+    def test_upload_and_delete_keep_tags_in_sync(self):
+        response = self.client.post(
+            "/upload-file",
+            json={
+                "filepath": "tagged.md",
+                "content_base64": base64.b64encode(b"# Tagged").decode("utf-8"),
+                "tags": ["new", "new", "even"],
+            },
+            headers=self.headers,
+        )
+        file_id = uuid.UUID(response.json()["id"])
+        tags = {row.tag for row in self.db.query(FileTag).filter_by(file_id=file_id)}
+        self.assertEqual(tags, {"new", "even"})
+        self.assertIn(file_id, self.list_ids(tag=["new"]))
+
+        response = self.client.delete(f"/files/{file_id}", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.db.query(FileTag).filter_by(file_id=file_id).count(), 0)
+
+    def bulk_delete(self, **body) -> dict:
+        response = self.client.post("/files/delete", json=body, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_bulk_delete_by_tag_with_dry_run(self):
+        even = {f.id for i, f in enumerate(self.files) if i % 2 == 0}
+        hashes = [f.content_hash for f in self.files]
+        self.assertEqual(
+            self.bulk_delete(tag="even", dry_run=True), {"deleted": 3, "dry_run": True}
+        )
+        self.assertEqual(len(self.list_ids()), 5)
+
+        self.assertEqual(self.bulk_delete(tag="even"), {"deleted": 3, "dry_run": False})
+        self.assertEqual(self.list_ids(), {f.id for f in self.files} - even)
+        self.db.expire_all()
+        self.assertEqual(
+            self.db.query(FileTag).filter(FileTag.file_id.in_(even)).count(), 0
+        )
+        self.assertEqual(
+            self.db.query(Blob).filter(Blob.content_hash.in_(hashes)).count(),
+            2,
+        )
+        # One tombstone per deleted file in the change feed
+        changes = self.client.get("/changes", headers=self.headers).json()["changes"]
+        self.assertEqual(
+            {uuid.UUID(c["id"]) for c in changes if c["op"] == "delete"}, even
+        )
+
+    def test_bulk_delete_combines_filters(self):
+        base = datetime(2025, 10, 15, 10, 0)
+        first, second, _, fourth, fifth = self.files
+        self.assertEqual(
+            self.bulk_delete(
+                ids=[str(first.id), str(fourth.id), str(fifth.id)],
+                created_before=(base + timedelta(hours=2)).isoformat(),
+            )["deleted"],
+            2,
+        )
+        self.assertEqual(
+            self.bulk_delete(
+                created_after=base.isoformat(),
+                created_before=(base + timedelta(hours=1)).isoformat(),
+                upload_session=str(second.upload_session),
+            )["deleted"],
+            1,
+        )
+        self.assertEqual(self.list_ids(), {self.files[2].id, fifth.id})
+
+    def test_bulk_delete_releases_shared_blobs(self):
+        content = b"# Shared"
+        shared = [
+            UploadedFile(
+                id=uuid.uuid4(),
+                filename=f"copy{i}.md",
+                **stored_content(self.db, content),
+                filetype=FileTypeEnum.markdown,
+                upload_session=self.files[0].upload_session,
+            )
+            for i in range(2)
+        ]
+        self.db.add_all(shared)
+        self.db.commit()
+        content_hash = shared[0].content_hash
+        self.assertEqual(self.db.get(Blob, content_hash).refcount, 2)
+
+        self.assertEqual(
+            self.bulk_delete(upload_session=str(self.files[0].upload_session))[
+                "deleted"
+            ],
+            3,
+        )
+        self.db.expire_all()
+        self.assertIsNone(self.db.get(Blob, content_hash))
+
+    def test_bulk_delete_requires_filter_and_api_key(self):
+        response = self.client.post("/files/delete", json={"tag": "even"})
+        self.assertEqual(response.status_code, 401)
+        response = self.client.post(
+            "/files/delete", json={"dry_run": True}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, 400)
+
+        # Nothing matches: the data version is left alone
+        self.assertEqual(self.bulk_delete(tag="missing")["deleted"], 0)
+        self.assertEqual(get_data_version(self.db)[0], 0)
+
+    def test_upload_stream_raw_body(self):
+        content = b"# Streamed\n" * 1000
+        with patch.dict("os.environ", {"RAPID_MD_UPLOAD_CHUNK_SIZE": "1024"}):
+            response = self.client.post(
+                "/upload-stream",
+                params={"filepath": "docs/streamed.md", "tag": ["a", "b"]},
+                content=content,
+                headers={**self.headers, "content-type": "application/octet-stream"},
+            )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["filename"], "streamed.md")
+        self.assertEqual(data["filetype"], "markdown")
+        self.assertEqual(data["tags"], ["a", "b"])
+
+        stored = self.db.get(UploadedFile, uuid.UUID(data["id"]))
+        self.assertEqual(read_blob(self.db, stored.content_hash), content)
+        self.assertEqual(stored.content_hash, hashlib.sha256(content).hexdigest())
+        self.assertEqual(stored.size, len(content))
+
+    def test_upload_stream_multipart(self):
+        response = self.client.post(
+            "/upload-stream",
+            files={"file": ("photo.png", b"png-bytes", "image/png")},
+            data={"tags": ["x"]},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["filename"], "photo.png")
+        self.assertEqual(data["filetype"], "image")
+        self.assertEqual(data["tags"], ["x"])
+        stored = self.db.get(UploadedFile, uuid.UUID(data["id"]))
+        self.assertEqual(read_blob(self.db, stored.content_hash), b"png-bytes")
+
+    def test_upload_stream_multipart_is_hashed_while_spooled(self):
+        content = b"# Large\n" + b"markdown line\n" * 500
+        with patch.dict("os.environ", {"RAPID_MD_UPLOAD_CHUNK_SIZE": "256"}):
+            response = self.client.post(
+                "/upload-stream",
+                files={"file": ("upload.bin", content, "text/markdown")},
+                data={"filepath": "docs/large.md", "tags": ["a", "b"]},
+                headers=self.headers,
+            )
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(data["filename"], "large.md")
+        self.assertEqual(data["tags"], ["a", "b"])
+        stored = self.db.get(UploadedFile, uuid.UUID(data["id"]))
+        self.assertEqual(stored.content_hash, hashlib.sha256(content).hexdigest())
+        self.assertEqual(stored.size, len(content))
+        self.assertEqual(read_blob(self.db, stored.content_hash), content)
+
+    def test_upload_stream_invalid_multipart(self):
+        # No file part
+        response = self.client.post(
+            "/upload-stream",
+            files={"other": ("a.md", b"# A")},
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 400)
+        # Text fields are bounded by the upload chunk size
+        with patch.dict("os.environ", {"RAPID_MD_UPLOAD_CHUNK_SIZE": "16"}):
+            response = self.client.post(
+                "/upload-stream",
+                files={"file": ("a.md", b"# A")},
+                data={"tags": "x" * 100},
+                headers=self.headers,
+            )
+        self.assertEqual(response.status_code, 400)
+        response = self.client.post(
+            "/upload-stream",
+            content=b"not a form",
+            headers={**self.headers, "content-type": "multipart/form-data"},
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_upload_stream_zip(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as z:
+            z.writestr("docs/one.md", "# One")
+            z.writestr("two.txt", "two")
+        response = self.client.post(
+            "/upload-stream",
+            params={"filepath": "bundle.zip"},
+            content=archive.getvalue(),
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        names = sorted(f["filename"] for f in response.json()["files"])
+        self.assertEqual(names, ["one.md", "two.txt"])
+
+    def test_zip_upload_shares_session_in_one_transaction(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as z:
+            for i in range(5):
+                z.writestr(f"doc{i}.md", f"# Doc {i}")
+        body = {
+            "filepath": "docs.zip",
+            "content_base64": base64.b64encode(archive.getvalue()).decode("utf-8"),
+        }
+        with patch.dict("os.environ", {"RAPID_MD_ZIP_BATCH_SIZE": "2"}):
+            response = self.client.post("/upload-file", json=body, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        data = response.json()
+        self.assertEqual(len(data["files"]), 5)
+
+        session_id = uuid.UUID(data["upload_session"])
+        stored = (
+            self.db.query(UploadedFile)
+            .filter(UploadedFile.upload_session == session_id)
+            .all()
+        )
+        self.assertEqual(len(stored), 5)
+        for f in stored:
+            content = read_blob(self.db, f.content_hash)
+            self.assertEqual(f.content_hash, hashlib.sha256(content).hexdigest())
+            self.assertEqual(f.size, len(content))
+
+    def test_zip_batches_are_bounded_in_bytes(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as z:
+            for i in range(4):
+                z.writestr(f"data{i}.bin", bytes([i]) * 3000)
+            z.writestr("notes.md", "# Notes")
+        env = {"RAPID_MD_ZIP_BATCH_BYTES": "5000", "RAPID_MD_UPLOAD_CHUNK_SIZE": "1024"}
+        with patch.dict("os.environ", env):
+            batches = iter_zip_batches(archive, uuid.uuid4(), datetime.utcnow(), 500)
+            sizes = []
+            for rows in batches:
+                sizes.append([row["size"] for row in rows])
+                for row in rows:
+                    # Members are streamed through temporary files, and only
+                    # markdown text is kept for the search index
+                    self.assertNotIsInstance(row["blob"].data, bytes)
+                    if row["filetype"] == FileTypeEnum.markdown:
+                        self.assertEqual(row["content"], b"# Notes")
+                    else:
+                        self.assertIsNone(row["content"])
+                        self.assertEqual(row["blob"].encoding, "gzip")
+                        self.assertEqual(
+                            len(gzip.decompress(row["blob"].data.read())), 3000
+                        )
+        self.assertEqual(sizes, [[3000, 3000], [3000, 3000], [7]])
+
+    def test_zip_upload_is_all_or_nothing(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as z:
+            z.writestr("good.md", "# Good")
+            z.writestr("bad.md", "# This member gets corrupted")
+        data = bytearray(archive.getvalue())
+        # Flip a byte inside the second member's data so its CRC check fails
+        offset = data.index(b"# This member")
+        data[offset] ^= 0xFF
+        with patch.dict("os.environ", {"RAPID_MD_ZIP_BATCH_SIZE": "1"}):
+            response = self.client.post(
+                "/upload-stream",
+                params={"filepath": "broken.zip"},
+                content=bytes(data),
+                headers=self.headers,
+            )
+        self.assertEqual(response.status_code, 400)
+        names = {f.filename for f in self.db.query(UploadedFile).all()}
+        self.assertNotIn("good.md", names)
+
+    def test_background_zip_upload_reports_progress(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as z:
+            for i in range(5):
+                z.writestr(f"doc{i}.md", f"# Doc {i}")
+        body = {
+            "filepath": "docs.zip",
+            "content_base64": base64.b64encode(archive.getvalue()).decode("utf-8"),
+        }
+        with patch.dict("os.environ", {"RAPID_MD_ZIP_BATCH_SIZE": "2"}):
+            response = self.client.post(
+                "/upload-file",
+                params={"background": "true"},
+                json=body,
+                headers=self.headers,
+            )
+        self.assertEqual(response.status_code, 202)
+        accepted = response.json()
+        self.assertEqual(accepted["status"], "queued")
+        self.assertEqual(response.headers["location"], f"/jobs/{accepted['id']}")
+
+        # The test client runs the background task before returning
+        job = self.client.get(response.headers["location"], headers=self.headers)
+        self.assertEqual(job.status_code, 200)
+        data = job.json()
+        self.assertEqual(data["status"], "done")
+        self.assertEqual(data["members_total"], 5)
+        self.assertEqual(data["members_done"], 5)
+        self.assertEqual(data["bytes_done"], data["bytes_total"])
+        self.assertEqual(data["error_count"], 0)
+        self.assertIsNotNone(data["finished_at"])
+        stored = (
+            self.db.query(UploadedFile)
+            .filter(UploadedFile.upload_session == uuid.UUID(data["upload_session"]))
+            .count()
+        )
+        self.assertEqual(stored, 5)
+        self.assertFalse(os.path.exists(spool_path(uuid.UUID(data["id"]))))
+
+    def test_background_zip_records_member_errors(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as z:
+            z.writestr("good.md", "# Good")
+            z.writestr("bad.md", "# This member gets corrupted")
+        data = bytearray(archive.getvalue())
+        data[data.index(b"# This member")] ^= 0xFF
+        response = self.client.post(
+            "/upload-stream",
+            params={"filepath": "broken.zip", "background": "true"},
+            content=bytes(data),
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 202)
+        job = self.client.get(response.headers["location"], headers=self.headers).json()
+        # Unlike the synchronous upload, the readable members are kept
+        self.assertEqual(job["status"], "done")
+        self.assertEqual(job["members_done"], 2)
+        self.assertEqual(job["error_count"], 1)
+        self.assertEqual(job["errors"][0]["member"], "bad.md")
+        names = {f.filename for f in self.db.query(UploadedFile).all()}
+        self.assertIn("good.md", names)
+        self.assertNotIn("bad.md", names)
+
+    def test_background_job_with_invalid_archive_fails(self):
+        response = self.client.post(
+            "/upload-stream",
+            params={"filepath": "junk.zip", "background": "true"},
+            content=b"not a zip archive",
+            headers=self.headers,
+        )
+        job = self.client.get(response.headers["location"], headers=self.headers).json()
+        self.assertEqual(job["status"], "failed")
+        self.assertIn("zip", job["error"].lower())
+
+    def test_interrupted_job_resumes_after_saved_members(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as z:
+            for i in range(5):
+                z.writestr(f"doc{i}.md", f"# Doc {i}")
+        job = create_ingest_job(self.db, "docs.zip", archive)
+        job.status = JobStatusEnum.running
+        job.members_done = 2
+        self.db.commit()
+
+        # A running job that is still being updated belongs to another worker
+        process_ingest_job(self.SessionLocal, job.id)
+        self.db.refresh(job)
+        self.assertEqual(job.members_done, 2)
+
+        job.updated_at = datetime.utcnow() - timedelta(hours=1)
+        self.db.commit()
+        process_ingest_job(self.SessionLocal, job.id)
+        self.db.refresh(job)
+        self.assertEqual(job.status, JobStatusEnum.done)
+        self.assertEqual(job.members_done, 5)
+        names = sorted(
+            f.filename
+            for f in self.db.query(UploadedFile).filter(
+                UploadedFile.upload_session == job.upload_session
+            )
+        )
+        self.assertEqual(names, ["doc2.md", "doc3.md", "doc4.md"])
+
+    def test_get_unknown_job(self):
+        response = self.client.get(f"/jobs/{uuid.uuid4()}", headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(self.db.query(IngestJob).count(), 0)
+
+    def test_export_session_archive(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as z:
+            z.writestr("a/doc.md", "# First")
+            z.writestr("b/doc.md", "# Second")
+            z.writestr("image.png", b"\x89PNG" + bytes(100))
+        response = self.client.post(
+            "/upload-stream",
+            params={"filepath": "bundle.zip"},
+            content=archive.getvalue(),
+            headers=self.headers,
+        )
+        upload_session = response.json()["upload_session"]
+
+        export = self.client.get(
+            f"/sessions/{upload_session}/archive", headers=self.headers
+        )
+        self.assertEqual(export.status_code, 200)
+        self.assertEqual(export.headers["content-type"], "application/zip")
+        self.assertIn("attachment", export.headers["content-disposition"])
+        with zipfile.ZipFile(io.BytesIO(export.content)) as z:
+            self.assertIsNone(z.testzip())
+            # Files sharing a name get a numeric suffix
+            self.assertEqual(sorted(z.namelist()), ["doc-1.md", "doc.md", "image.png"])
+            self.assertEqual(
+                {z.read("doc.md"), z.read("doc-1.md")}, {b"# First", b"# Second"}
+            )
+            self.assertEqual(z.read("image.png"), b"\x89PNG" + bytes(100))
+            self.assertEqual(z.getinfo("image.png").compress_type, zipfile.ZIP_STORED)
+
+    def test_export_tag_archive(self):
+        with patch("rapid_md.export.EXPORT_BATCH_SIZE", 2):
+            response = self.client.get("/tags/all/archive", headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(response.content)) as z:
+            # Same order as /files: (created_at, id)
+            self.assertEqual(
+                z.namelist(),
+                ["file2.md", "file1.md", "file0.md", "file3.md", "file4.md"],
+            )
+            self.assertEqual(z.read("file3.md"), b"# File 3")
+
+        response = self.client.get("/tags/odd/archive", headers=self.headers)
+        with zipfile.ZipFile(io.BytesIO(response.content)) as z:
+            self.assertEqual(sorted(z.namelist()), ["file1.md", "file3.md"])
+
+    def test_export_unknown_session_or_tag(self):
+        response = self.client.get(
+            f"/sessions/{uuid.uuid4()}/archive", headers=self.headers
+        )
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get("/tags/missing/archive", headers=self.headers)
+        self.assertEqual(response.status_code, 404)
+        response = self.client.get("/tags/all/archive")
+        self.assertEqual(response.status_code, 401)
+
+    def upload(self, filepath: str, content: bytes) -> dict:
+        response = self.client.post(
+            "/upload-stream",
+            params={"filepath": filepath},
+            content=content,
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_changes_feed_records_inserts_and_deletes(self):
+        first = self.upload("first.md", b"# First")
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as z:
+            z.writestr("a.md", "# A")
+            z.writestr("b.md", "# B")
+        self.upload("bundle.zip", archive.getvalue())
+        self.client.delete(f"/files/{first['id']}", headers=self.headers)
+
+        data = self.client.get("/changes", headers=self.headers).json()
+        ops = [
+            (c["op"], c["file"]["filename"] if c["file"] else None)
+            for c in data["changes"]
+        ]
+        # The insert of a deleted file has no metadata, its tombstone follows
+        self.assertEqual(ops[0], ("insert", None))
+        self.assertEqual(sorted(ops[1:3]), [("insert", "a.md"), ("insert", "b.md")])
+        self.assertEqual(ops[3], ("delete", None))
+        self.assertEqual(data["changes"][0]["id"], first["id"])
+        self.assertEqual(data["changes"][-1]["id"], first["id"])
+        seqs = [c["seq"] for c in data["changes"]]
+        self.assertEqual(seqs, sorted(seqs))
+        self.assertEqual(data["next_since"], seqs[-1])
+        self.assertFalse(data["has_more"])
+
+        page = self.client.get(
+            "/changes", params={"since": seqs[0], "limit": 2}, headers=self.headers
+        ).json()
+        self.assertEqual([c["seq"] for c in page["changes"]], seqs[1:3])
+        self.assertTrue(page["has_more"])
+
+        empty = self.client.get(
+            "/changes", params={"since": seqs[-1]}, headers=self.headers
+        ).json()
+        self.assertEqual(empty["changes"], [])
+        self.assertEqual(empty["next_since"], seqs[-1])
+
+    def test_changes_long_poll_wakes_on_commit(self):
+        def upload_later():
+            time.sleep(0.2)
+            with self.SessionLocal() as db:
+                save_uploaded_file(db, "late.md", b"# Late", FileTypeEnum.markdown)
+
+        thread = threading.Thread(target=upload_later)
+        start = time.monotonic()
+        thread.start()
+        # The poll interval is longer than the test: only the commit wakes it up
+        with patch("rapid_md.router_api.CHANGES_POLL_INTERVAL", 30):
+            response = self.client.get(
+                "/changes", params={"wait": 10}, headers=self.headers
+            )
+        thread.join()
+        self.assertLess(time.monotonic() - start, 5)
+        changes = response.json()["changes"]
+        self.assertEqual([c["file"]["filename"] for c in changes], ["late.md"])
+
+    def test_changes_long_poll_times_out(self):
+        with patch("rapid_md.router_api.CHANGES_POLL_INTERVAL", 0.05):
+            response = self.client.get(
+                "/changes", params={"wait": 0.2}, headers=self.headers
+            )
+        self.assertEqual(response.json()["changes"], [])
+
+    def test_changes_gone_after_prune(self):
+        self.upload("one.md", b"# One")
+        self.upload("two.md", b"# Two")
+        self.assertEqual(
+            prune_changes(self.db, datetime.utcnow() + timedelta(days=1)), 1
+        )
+        response = self.client.get("/changes", headers=self.headers)
+        self.assertEqual(response.status_code, 410)
+        # Clients that had seen the pruned changes can continue
+        last = self.db.query(FileChange).one().seq
+        response = self.client.get(
+            "/changes", params={"since": last - 1}, headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_changes_stream_sends_events(self):
+        self.upload("one.md", b"# One")
+
+        # The test client buffers whole responses, so the endless stream
+        # is read from its generator
+        async def first_event() -> str:
+            events = change_events(self.db, 0)
+            try:
+                return await anext(events)
+            finally:
+                await events.aclose()
+
+        lines = asyncio.run(first_event()).split("\n")
+        self.assertTrue(lines[0].startswith("id: "))
+        self.assertEqual(lines[1], "event: insert")
+        event = json.loads(lines[2].removeprefix("data: "))
+        self.assertEqual(event["file"]["filename"], "one.md")
+
+        response = self.client.get(
+            "/changes/stream", params={"since": 0}, headers={"x-api-key": "wrong"}
+        )
+        self.assertEqual(response.status_code, 401)
+
+    def test_identical_uploads_share_one_blob(self):
+        body = {
+            "filepath": "same.md",
+            "content_base64": base64.b64encode(b"# Same content").decode("utf-8"),
+        }
+        first = self.client.post("/upload-file", json=body, headers=self.headers).json()
+        second = self.client.post(
+            "/upload-file", json=body, headers=self.headers
+        ).json()
+        self.assertEqual(first["bytes_saved"], 0)
+        self.assertEqual(second["bytes_saved"], len(b"# Same content"))
+
+        content_hash = hashlib.sha256(b"# Same content").hexdigest()
+        blob = self.db.get(Blob, content_hash)
+        self.assertEqual(blob.refcount, 2)
+
+        self.client.delete(f"/files/{first['id']}", headers=self.headers)
+        self.db.expire_all()
+        self.assertEqual(self.db.get(Blob, content_hash).refcount, 1)
+
+        self.client.delete(f"/files/{second['id']}", headers=self.headers)
+        self.db.expire_all()
+        self.assertIsNone(self.db.get(Blob, content_hash))
+
+    def test_zip_upload_reports_bytes_saved(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as z:
+            z.writestr("a.md", "# File 0")  # already stored by setUp
+            z.writestr("b.md", "# Twice")
+            z.writestr("c.md", "# Twice")
+        response = self.client.post(
+            "/upload-stream",
+            params={"filepath": "dup.zip"},
+            content=archive.getvalue(),
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            response.json()["bytes_saved"], len(b"# File 0") + len(b"# Twice")
+        )
+        twice = self.db.get(Blob, hashlib.sha256(b"# Twice").hexdigest())
+        self.assertEqual(twice.refcount, 2)
+
+    def upload_markdown(self, filepath: str, text: str) -> str:
+        response = self.client.post(
+            "/upload-stream",
+            params={"filepath": filepath},
+            content=text.encode("utf-8"),
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.json()["id"]
+
+    def search(self, q: str) -> list[dict]:
+        response = self.client.get("/search", params={"q": q}, headers=self.headers)
+        self.assertEqual(response.status_code, 200)
+        return response.json()["results"]
+
+    def test_search_ranks_and_highlights(self):
+        guide = self.upload_markdown("kafka.md", "# Kafka\n\nKafka consumer groups.")
+        notes = self.upload_markdown(
+            "notes.md", "Meeting notes, we mentioned kafka once."
+        )
+        self.upload_markdown("other.md", "Nothing relevant here.")
+
+        results = self.search("kafka")
+        self.assertEqual([r["id"] for r in results], [guide, notes])
+        self.assertIn("<mark>Kafka</mark>", results[0]["snippet"])
+
+        self.assertEqual([r["id"] for r in self.search("kafka consumer")], [guide])
+        self.assertEqual([r["id"] for r in self.search("meet*")], [notes])
+        # FTS5 syntax in the user's text must not raise errors
+        self.assertEqual(self.search('kafka" OR NEAR('), [])
+
+    def test_search_snippet_escapes_html(self):
+        self.upload_markdown(
+            "xss.md",
+            'kafka <script>alert(1)</script> <img src=x onerror="alert(2)">'
+            " \x02kafka\x03",
+        )
+        snippet = self.search("kafka")[0]["snippet"]
+        self.assertNotIn("<script>", snippet)
+        self.assertNotIn("<img", snippet)
+        self.assertIn("&lt;script&gt;alert(1)&lt;/script&gt;", snippet)
+        self.assertIn("&lt;img src=x onerror=&quot;alert(2)&quot;&gt;", snippet)
+        # Only the matched terms become tags, markers in the text are dropped
+        self.assertEqual(snippet.count("<mark>"), 2)
+        self.assertEqual(snippet.count("</mark>"), 2)
+        self.assertEqual(snippet.count("<"), 4)
+
+    def test_search_indexes_zip_markdown_and_prunes_on_delete(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as z:
+            z.writestr("zipped.md", "# Zipped searchable page")
+            z.writestr("zipped.txt", "searchable but not markdown")
+        response = self.client.post(
+            "/upload-stream",
+            params={"filepath": "bundle.zip"},
+            content=archive.getvalue(),
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        results = self.search("searchable")
+        self.assertEqual([r["filename"] for r in results], ["zipped.md"])
+
+        response = self.client.delete(
+            f"/files/{results[0]['id']}", headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.search("searchable"), [])
+
+    def test_search_requires_query(self):
+        response = self.client.get("/search", headers=self.headers)
+        self.assertEqual(response.status_code, 422)
+
+    def test_upload_stream_requires_filepath(self):
+        response = self.client.post(
+            "/upload-stream", content=b"data", headers=self.headers
+        )
+        self.assertEqual(response.status_code, 400)
+
+
+class TestAsyncDatabaseUrl(unittest.TestCase):
+    def test_async_drivers(self):
+        self.assertEqual(
+            async_database_url("sqlite:///./test.db"), "sqlite+aiosqlite:///./test.db"
+        )
+        self.assertEqual(
+            async_database_url("postgresql+psycopg2://u:p@db/rapid"),
+            "postgresql+asyncpg://u:p@db/rapid",
+        )
+        with self.assertRaises(ValueError):
+            async_database_url("mysql://u:p@db/rapid")
+
+
+@unittest.skipUnless(importlib.util.find_spec("aiosqlite"), "aiosqlite not installed")
+class TestAsyncUpload(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        path = os.path.join(self.temp_dir.name, "async.db")
+        self.engine = create_engine(f"sqlite:///{path}")
+        Base.metadata.create_all(self.engine)
+        self.async_engine = create_async_engine(f"sqlite+aiosqlite:///{path}")
+
+        session_patch = patch(
+            "rapid_md.router_api.AsyncSessionLocal",
+            async_sessionmaker(
+                self.async_engine, autoflush=False, expire_on_commit=False
+            ),
+        )
+        session_patch.start()
+        self.addCleanup(session_patch.stop)
+        env = patch.dict("os.environ", {"RAPID_MD_API_KEY": API_KEY})
+        env.start()
+        self.addCleanup(env.stop)
+
+        def override_get_db() -> Generator[Session, None, None]:
+            db = Session(self.engine)
+            try:
+                yield db
+            finally:
+                db.close()
+
+        self.app = FastAPI()
+        self.app.include_router(router)
+        self.app.dependency_overrides = {get_db: override_get_db}
+        self.client = TestClient(self.app)
+
+    def tearDown(self):
+        asyncio.run(self.async_engine.dispose())
+        self.engine.dispose()
+
+    def test_upload_with_async_session(self):
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as z:
+            z.writestr("a.md", "# A")
+            z.writestr("b.md", "# B")
+        response = self.client.post(
+            "/upload-stream",
+            params={"filepath": "docs.zip"},
+            content=archive.getvalue(),
+            headers={"x-api-key": API_KEY},
+        )
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.post(
+            "/upload-file",
+            json={
+                "filepath": "c.md",
+                "content_base64": base64.b64encode(b"# C").decode("utf-8"),
+                "tags": ["t"],
+            },
+            headers={"x-api-key": API_KEY},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["tags"], ["t"])
+
+        with Session(self.engine) as db:
+            names = sorted(f.filename for f in db.query(UploadedFile).all())
+        self.assertEqual(names, ["a.md", "b.md", "c.md"])
+
+    def test_async_session_runs_only_sql_on_the_event_loop(self):
+        def on_event_loop() -> bool:
+            try:
+                asyncio.get_running_loop()
+            except RuntimeError:
+                return False
+            return True
+
+        def recorded(fn):
+            def wrapper(*args, **kwargs):
+                calls.append((fn.__name__, on_event_loop()))
+                return fn(*args, **kwargs)
+
+            return wrapper
+
+        calls = []
+        env = {
+            "RAPID_MD_STORAGE_BACKEND": "fs",
+            "RAPID_MD_STORAGE_PATH": os.path.join(self.temp_dir.name, "blobs"),
+        }
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, "w") as z:
+            z.writestr("a.md", "# A")
+        with (
+            patch.dict("os.environ", env),
+            patch.object(FilesystemBackend, "save", recorded(FilesystemBackend.save)),
+            patch("rapid_md.search.search_row", recorded(search_row)),
+        ):
+            uploads = (("b.md", b"# B"), ("docs.zip", archive.getvalue()))
+            for filepath, content in uploads:
+                response = self.client.post(
+                    "/upload-stream",
+                    params={"filepath": filepath},
+                    content=content,
+                    headers={"x-api-key": API_KEY},
+                )
+                self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(calls),
+            [("save", False)] * 2 + [("search_row", False)] * 2,
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
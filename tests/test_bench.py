@@ -0,0 +1,141 @@
+import asyncio
+import unittest
+from collections import Counter
+
+import httpx
+from fastapi import FastAPI
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from benchmarks.bench import compare, drive, percentile
+from benchmarks.corpus import parse_scale, seed_corpus
+from rapid_md.models import (
+    Blob,
+    FileChange,
+    FileTag,
+    FileTypeEnum,
+    SearchDocument,
+    UploadedFile,
+)
+from rapid_md.versioning import get_data_version
+
+
+def result(**metrics) -> dict:
+    return {"results": {"inprocess": {"home": metrics}}}
+
+
+class TestCorpus(unittest.TestCase):
+    def test_parse_scale(self):
+        self.assertEqual(parse_scale("1k"), 1_000)
+        self.assertEqual(parse_scale("100k"), 100_000)
+        self.assertEqual(parse_scale("1M"), 1_000_000)
+        self.assertEqual(parse_scale("250"), 250)
+
+    def test_seed_corpus(self):
+        engine = create_engine(
+            "sqlite:///:memory:",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        self.assertEqual(seed_corpus(engine, 300), 300)
+
+        with Session(engine) as db:
+            files = db.execute(
+                select(
+                    UploadedFile.filetype, UploadedFile.tags, UploadedFile.content_hash
+                )
+            ).all()
+            self.assertEqual(len(files), 300)
+            self.assertEqual({filetype for filetype, _, _ in files}, set(FileTypeEnum))
+            self.assertGreater(len({h for _, _, h in files}), 1)
+
+            # Blob reference counts match the files sharing each content
+            refcounts = dict(db.execute(select(Blob.content_hash, Blob.refcount)).all())
+            self.assertEqual(refcounts, dict(Counter(h for _, _, h in files)))
+
+            tag_rows = db.execute(select(func.count()).select_from(FileTag)).scalar()
+            self.assertEqual(tag_rows, sum(len(tags or []) for _, tags, _ in files))
+            documents = db.execute(
+                select(func.count()).select_from(SearchDocument)
+            ).scalar()
+            self.assertEqual(
+                documents,
+                sum(filetype == FileTypeEnum.markdown for filetype, _, _ in files),
+            )
+            changes = db.execute(select(func.count()).select_from(FileChange)).scalar()
+            self.assertEqual(changes, 300)
+            self.assertEqual(get_data_version(db)[0], 1)
+
+    def test_seed_corpus_is_deterministic(self):
+        names = []
+        for _ in range(2):
+            engine = create_engine("sqlite:///:memory:", poolclass=StaticPool)
+            seed_corpus(engine, 50, seed=7)
+            with Session(engine) as db:
+                names.append(
+                    db.execute(
+                        select(UploadedFile.id, UploadedFile.filename).order_by(
+                            UploadedFile.filename
+                        )
+                    ).all()
+                )
+        self.assertEqual(names[0], names[1])
+
+
+class TestBench(unittest.TestCase):
+    def test_percentile(self):
+        values = [float(i) for i in range(1, 101)]
+        self.assertEqual(percentile(values, 50), 50.0)
+        self.assertEqual(percentile(values, 95), 95.0)
+        self.assertEqual(percentile(values, 99), 99.0)
+        self.assertEqual(percentile([3.0], 99), 3.0)
+        self.assertEqual(percentile([], 50), 0.0)
+
+    def test_drive_counts_requests_and_errors(self):
+        app = FastAPI()
+
+        @app.get("/item/{n}")
+        def item(n: int) -> dict:
+            if n % 10 == 0:
+                raise ValueError("boom")
+            return {"n": n}
+
+        async def run() -> dict:
+            transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+            async with httpx.AsyncClient(
+                transport=transport, base_url="http://test"
+            ) as client:
+                return await drive(
+                    client,
+                    lambda i: {"method": "GET", "url": f"/item/{i}"},
+                    requests=40,
+                    concurrency=4,
+                    warmup=1,
+                )
+
+        summary = asyncio.run(run())
+        self.assertEqual(summary["requests"], 40)
+        # Requests 10, 20, 30 and 40 fail
+        self.assertEqual(summary["errors"], 4)
+        self.assertGreater(summary["throughput_rps"], 0)
+        self.assertLessEqual(summary["p50_ms"], summary["p99_ms"])
+
+    def test_compare_flags_regressions(self):
+        baseline = result(p95_ms=10.0, throughput_rps=100.0, errors=0)
+        same = result(p95_ms=11.0, throughput_rps=95.0, errors=0)
+        self.assertEqual(compare(baseline, same, 0.2), [])
+
+        slower = result(p95_ms=15.0, throughput_rps=70.0, errors=2)
+        regressions = compare(baseline, slower, 0.2)
+        self.assertEqual(len(regressions), 3)
+        self.assertTrue(regressions[0].startswith("inprocess/home p95_ms"))
+
+        # Faster results and scenarios missing from the baseline are fine
+        faster = result(p95_ms=5.0, throughput_rps=200.0, errors=0)
+        self.assertEqual(compare(baseline, faster, 0.2), [])
+        self.assertEqual(compare({"results": {}}, slower, 0.2), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
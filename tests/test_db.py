@@ -0,0 +1,127 @@
+import asyncio
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from rapid_md.db import (
+    InstrumentedAsyncQueuePool,
+    create_async_db_engine,
+    create_db_engine,
+    pool_options,
+    pool_stats,
+)
+
+
+class TestCreateDbEngine(unittest.TestCase):
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.url = f"sqlite:///{os.path.join(self.temp_dir.name, 'pool.db')}"
+
+    def test_sqlite_pragmas_applied_on_connect(self):
+        engine = create_db_engine(self.url)
+        self.addCleanup(engine.dispose)
+        with engine.connect() as conn:
+            self.assertEqual(conn.execute(text("PRAGMA journal_mode")).scalar(), "wal")
+            # NORMAL == 1
+            self.assertEqual(conn.execute(text("PRAGMA synchronous")).scalar(), 1)
+            self.assertEqual(conn.execute(text("PRAGMA busy_timeout")).scalar(), 5000)
+            self.assertEqual(conn.execute(text("PRAGMA foreign_keys")).scalar(), 1)
+
+    def test_pool_configured_from_environment(self):
+        env = {
+            "RAPID_MD_DB_POOL_SIZE": "3",
+            "RAPID_MD_DB_MAX_OVERFLOW": "2",
+            "RAPID_MD_DB_POOL_TIMEOUT": "7",
+            "RAPID_MD_DB_POOL_RECYCLE": "60",
+        }
+        with patch.dict("os.environ", env):
+            engine = create_db_engine(self.url)
+        self.addCleanup(engine.dispose)
+        self.assertEqual(engine.pool.size(), 3)
+        self.assertEqual(engine.pool._max_overflow, 2)
+        self.assertEqual(engine.pool._timeout, 7)
+        self.assertEqual(engine.pool._recycle, 60)
+
+    def test_checkouts_are_counted(self):
+        engine = create_db_engine(self.url)
+        self.addCleanup(engine.dispose)
+        before = pool_stats.as_dict()["checkouts"]
+        for _ in range(3):
+            with engine.connect() as conn:
+                conn.execute(text("SELECT 1"))
+        stats = pool_stats.as_dict()
+        self.assertEqual(stats["checkouts"], before + 3)
+        self.assertGreaterEqual(stats["wait_seconds_max"], 0.0)
+
+    def test_memory_database_is_left_alone(self):
+        engine = create_db_engine("sqlite:///:memory:")
+        self.addCleanup(engine.dispose)
+        with engine.connect() as conn:
+            self.assertEqual(conn.execute(text("SELECT 1")).scalar(), 1)
+
+
+class TestCreateAsyncDbEngine(unittest.TestCase):
+    def test_pool_configured_from_environment(self):
+        env = {
+            "RAPID_MD_DB_POOL_SIZE": "3",
+            "RAPID_MD_DB_MAX_OVERFLOW": "2",
+            "RAPID_MD_DB_POOL_TIMEOUT": "7",
+            "RAPID_MD_DB_POOL_RECYCLE": "60",
+            "RAPID_MD_DB_POOL_PRE_PING": "0",
+        }
+        # asyncpg may not be installed: only the engine arguments are checked
+        with (
+            patch.dict("os.environ", env),
+            patch("rapid_md.db.create_async_engine") as create,
+        ):
+            create_async_db_engine("postgresql+psycopg2://u:p@db/rapid")
+        create.assert_called_once_with(
+            "postgresql+asyncpg://u:p@db/rapid",
+            poolclass=InstrumentedAsyncQueuePool,
+            pool_size=3,
+            max_overflow=2,
+            pool_timeout=7.0,
+            pool_recycle=60,
+            pool_pre_ping=False,
+        )
+
+    def test_sqlite_keeps_the_driver_pool(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            engine = create_async_db_engine(
+                f"sqlite:///{os.path.join(temp_dir, 'pool.db')}"
+            )
+
+            async def journal_mode():
+                async with engine.connect() as conn:
+                    mode = (await conn.execute(text("PRAGMA journal_mode"))).scalar()
+                await engine.dispose()
+                return mode
+
+            self.assertNotIsInstance(engine.pool, InstrumentedAsyncQueuePool)
+            self.assertEqual(asyncio.run(journal_mode()), "wal")
+
+    def test_async_checkouts_are_counted(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            engine = create_async_engine(
+                f"sqlite+aiosqlite:///{os.path.join(temp_dir, 'pool.db')}",
+                **pool_options(InstrumentedAsyncQueuePool),
+            )
+
+            async def run():
+                for _ in range(2):
+                    async with engine.connect() as conn:
+                        await conn.execute(text("SELECT 1"))
+                await engine.dispose()
+
+            before = pool_stats.as_dict()["checkouts"]
+            asyncio.run(run())
+        self.assertEqual(pool_stats.as_dict()["checkouts"], before + 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+from fastapi import Request
+
+from rapid_md.http_utils import RangeNotSatisfiable, accepts_encoding, parse_range
+
+
+def request_with(accept_encoding: str) -> Request:
+    return Request(
+        {"type": "http", "headers": [(b"accept-encoding", accept_encoding.encode())]}
+    )
+
+
+class TestParseRange(unittest.TestCase):
+    def test_single_and_suffix_ranges(self):
+        self.assertEqual(parse_range("bytes=0-99", 1000), [(0, 99)])
+        self.assertEqual(parse_range("bytes=900-", 1000), [(900, 999)])
+        self.assertEqual(parse_range("bytes=-100", 1000), [(900, 999)])
+        self.assertEqual(parse_range("bytes=-5000", 1000), [(0, 999)])
+
+    def test_end_is_clamped_to_size(self):
+        self.assertEqual(parse_range("bytes=990-2000", 1000), [(990, 999)])
+
+    def test_overlapping_ranges_are_merged(self):
+        self.assertEqual(
+            parse_range("bytes=50-99,0-10,11-20,95-120", 1000),
+            [(0, 20), (50, 120)],
+        )
+
+    def test_invalid_headers_are_ignored(self):
+        self.assertIsNone(parse_range("items=0-1", 1000))
+        self.assertIsNone(parse_range("bytes=abc", 1000))
+        self.assertIsNone(parse_range("bytes=5-1", 1000))
+        too_many = ",".join(f"{i * 10}-{i * 10 + 1}" for i in range(20))
+        self.assertIsNone(parse_range(f"bytes={too_many}", 1000))
+
+    def test_unsatisfiable(self):
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range("bytes=1000-", 1000)
+        with self.assertRaises(RangeNotSatisfiable):
+            parse_range("bytes=0-10", 0)
+
+
+class TestAcceptsEncoding(unittest.TestCase):
+    def test_listed_encodings(self):
+        self.assertTrue(accepts_encoding(request_with("gzip, deflate, br"), "gzip"))
+        self.assertTrue(accepts_encoding(request_with("br;q=1.0, GZIP;q=0.5"), "gzip"))
+        self.assertFalse(accepts_encoding(request_with("br, deflate"), "gzip"))
+        self.assertFalse(accepts_encoding(request_with(""), "gzip"))
+
+    def test_zero_quality_and_wildcard(self):
+        self.assertFalse(accepts_encoding(request_with("gzip;q=0"), "gzip"))
+        self.assertTrue(accepts_encoding(request_with("*"), "gzip"))
+        self.assertFalse(accepts_encoding(request_with("*, gzip;q=0"), "gzip"))
+        self.assertFalse(accepts_encoding(request_with("*;q=0"), "gzip"))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,224 @@
+import base64
+import io
+import re
+import tempfile
+import unittest
+import zipfile
+from unittest.mock import patch
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from rapid_md.jobs import process_ingest_job
+from rapid_md.metrics import (
+    Counter,
+    Histogram,
+    BACKGROUND_ROUTE,
+    Metric,
+    MetricsMiddleware,
+    db_query_duration,
+    http_request_duration,
+    http_requests,
+    markdown_render_duration,
+    registry,
+    upload_bytes,
+    zip_extraction_duration,
+    instrument_engine,
+)
+from rapid_md.router_api import router
+from rapid_md.router_web import render_router
+from tests.helpers import DatabaseTestCase
+
+API_KEY = "test-key"
+
+
+def server_timing(response) -> dict[str, float]:
+    """
+    Parse a Server-Timing header into {metric: duration in ms}
+    """
+    return {
+        match.group(1): float(match.group(2))
+        for match in re.finditer(
+            r"(\w+);dur=([\d.]+)", response.headers["server-timing"]
+        )
+    }
+
+
+class TestMetricTypes(unittest.TestCase):
+    def test_counter_exposition(self):
+        counter = Counter("requests_total", "Requests", ("route",))
+        counter.inc("/")
+        counter.inc("/", amount=2)
+        counter.inc('/a"b')
+        self.assertEqual(counter.value("/"), 3)
+        self.assertEqual(
+            counter.render(),
+            "# HELP requests_total Requests\n"
+            "# TYPE requests_total counter\n"
+            'requests_total{route="/"} 3\n'
+            'requests_total{route="/a\\"b"} 1',
+        )
+
+    def test_metric_is_abstract(self):
+        with self.assertRaises(TypeError):
+            Metric("untyped", "No samples")
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("latency_seconds", "Latency", buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.7, 5.0):
+            histogram.observe(value)
+        lines = histogram.render().splitlines()[2:]
+        self.assertEqual(
+            lines,
+            [
+                'latency_seconds_bucket{le="0.1"} 1',
+                'latency_seconds_bucket{le="1.0"} 3',
+                'latency_seconds_bucket{le="+Inf"} 4',
+                "latency_seconds_sum 6.25",
+                "latency_seconds_count 4",
+            ],
+        )
+        self.assertEqual(histogram.count(), 4)
+
+
+class TestMetricsMiddleware(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        instrument_engine(self.engine)
+        env = patch.dict(
+            "os.environ",
+            {"RAPID_MD_API_KEY": API_KEY, "RAPID_MD_SERVER_TIMING": "1"},
+        )
+        env.start()
+        self.addCleanup(env.stop)
+
+        self.app = FastAPI()
+        self.app.add_middleware(MetricsMiddleware)
+        self.app.include_router(router)
+        self.app.include_router(render_router)
+        self.app.dependency_overrides = self.overrides
+        self.client = TestClient(self.app)
+        self.headers = {"x-api-key": API_KEY}
+
+        self.add_file("doc.md", b"# Title\n\nSome *markdown*")
+        registry.clear()
+
+    def test_render_breakdown(self):
+        response = self.client.get("/render/doc.md")
+        self.assertEqual(response.status_code, 200)
+        timings = server_timing(response)
+        self.assertIn("db", timings)
+        self.assertIn("markdown", timings)
+        self.assertIn("total", timings)
+        self.assertRegex(
+            response.headers["server-timing"], r'db;dur=[\d.]+;desc="\d+ queries"'
+        )
+        self.assertEqual(markdown_render_duration.count(), 1)
+
+        # Rendered once: the second request is served from the cache
+        cached = self.client.get("/render/doc.md")
+        self.assertNotIn("markdown", server_timing(cached))
+
+        route = "/render/{filename:path}"
+        self.assertEqual(http_requests.value("GET", route, "200"), 2)
+        text = self.client.get("/metrics").text
+        self.assertIn(
+            f'rapid_md_http_requests_total{{method="GET",route="{route}",status="200"}} 2',
+            text,
+        )
+        self.assertIn(
+            f'rapid_md_http_request_duration_seconds_count{{method="GET",route="{route}"}} 2',
+            text,
+        )
+        self.assertIn(
+            f'rapid_md_db_queries_per_request_count{{route="{route}"}} 2', text
+        )
+        self.assertIn(
+            f'rapid_md_http_requests_in_flight{{method="GET",route="{route}"}} 0', text
+        )
+        self.assertIn("rapid_md_markdown_render_seconds_count 1", text)
+
+    def test_unknown_paths_share_one_label(self):
+        self.client.get("/nope/1")
+        self.client.get("/nope/2")
+        self.assertEqual(http_requests.value("GET", "unmatched", "404"), 2)
+
+    def test_upload_bytes_and_base64_timing(self):
+        content = b"# Uploaded\n" * 10
+        response = self.client.post(
+            "/upload-file",
+            json={
+                "filepath": "up.md",
+                "content_base64": base64.b64encode(content).decode(),
+            },
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        # Decoding runs in a worker thread but is still attributed to the request
+        self.assertIn("base64", server_timing(response))
+        self.assertEqual(upload_bytes.value("/upload-file"), len(content))
+
+        response = self.client.post(
+            "/upload-stream?filepath=raw.md", content=content, headers=self.headers
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(upload_bytes.value("/upload-stream"), len(content))
+
+    def test_zip_extraction_histogram(self):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as z:
+            z.writestr("a.md", "# A")
+            z.writestr("b.md", "# B")
+        response = self.client.post(
+            "/upload-file",
+            json={
+                "filepath": "docs.zip",
+                "content_base64": base64.b64encode(buffer.getvalue()).decode(),
+            },
+            headers=self.headers,
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("zip", server_timing(response))
+        self.assertEqual(zip_extraction_duration.count(), 1)
+
+    def test_background_job_runs_after_the_request_is_recorded(self):
+        jobs_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(jobs_dir.cleanup)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as z:
+            z.writestr("a.md", "# A")
+        recorded = []
+
+        def job(*args) -> None:
+            recorded.append(http_request_duration.count("POST", "/upload-stream"))
+            process_ingest_job(*args)
+
+        with (
+            patch.dict("os.environ", {"RAPID_MD_JOBS_PATH": jobs_dir.name}),
+            patch("rapid_md.jobs.process_ingest_job", job),
+        ):
+            response = self.client.post(
+                "/upload-stream?filepath=docs.zip&background=true",
+                content=buffer.getvalue(),
+                headers=self.headers,
+            )
+        self.assertEqual(response.status_code, 202)
+        # The request was complete before the job started
+        self.assertEqual(recorded, [1])
+        self.assertEqual(http_requests.value("POST", "/upload-stream", "202"), 1)
+        # The job's statements are not attributed to the request
+        self.assertGreater(db_query_duration.count(BACKGROUND_ROUTE), 0)
+
+    def test_server_timing_disabled_by_default(self):
+        with patch.dict("os.environ", {"RAPID_MD_SERVER_TIMING": ""}):
+            app = FastAPI()
+            app.add_middleware(MetricsMiddleware)
+            app.include_router(render_router)
+            app.dependency_overrides = self.app.dependency_overrides
+            response = TestClient(app).get("/render/doc.md")
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn("server-timing", response.headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
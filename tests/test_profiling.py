@@ -0,0 +1,157 @@
+import contextvars
+import io
+import marshal
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from rapid_md.profiling import ProfilingMiddleware, RequestProfiler, profiling
+from rapid_md.router_web import render_router
+from tests.helpers import DatabaseTestCase
+
+API_KEY = "test-key"
+
+
+def inner(n: int) -> int:
+    return sum(range(n))
+
+
+def outer() -> list[int]:
+    return [inner(100) for _ in range(3)]
+
+
+class TestRequestProfiler(unittest.TestCase):
+    def test_profiles_context_across_threads(self):
+        with profiling(RequestProfiler()) as profiler:
+            outer()
+            # Threads running a copy of the context are profiled too
+            worker = threading.Thread(
+                target=contextvars.copy_context().run, args=(outer,)
+            )
+            worker.start()
+            worker.join()
+            # Other threads are not
+            unrelated = threading.Thread(target=inner, args=(7,))
+            unrelated.start()
+            unrelated.join()
+        self.assertIsNone(sys.getprofile())
+
+        stats = {key[2]: value for key, value in profiler.stats.items()}
+        cc, nc, tt, ct, callers = stats["inner"]
+        self.assertEqual(nc, 6)
+        self.assertGreaterEqual(ct, tt)
+        self.assertEqual([key[2] for key in callers], ["outer"])
+        self.assertEqual(stats["outer"][1], 2)
+
+        collapsed = profiler.collapsed()
+        self.assertRegex(collapsed, r"outer \(test_profiling.py:\d+\);inner \(")
+        self.assertIn("<built-in method builtins.sum> ", collapsed)
+        for line in collapsed.splitlines():
+            self.assertRegex(line, r" \d+$")
+
+    def test_text_summary(self):
+        with profiling(RequestProfiler()) as profiler:
+            outer()
+        text = profiler.text()
+        self.assertIn("Ordered by: cumulative time", text)
+        self.assertIn("(outer)", text)
+
+
+class TestProfilingMiddleware(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        self.profiles = tempfile.TemporaryDirectory()
+        self.addCleanup(self.profiles.cleanup)
+        self.add_file("doc.md", b"# Slow\n\n" + b"Some *markdown* text.\n\n" * 20)
+
+    def client(self, **env: str) -> TestClient:
+        env = {
+            "RAPID_MD_API_KEY": API_KEY,
+            "RAPID_MD_PROFILE_PATH": self.profiles.name,
+            **env,
+        }
+        patcher = patch.dict("os.environ", env)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        app = FastAPI()
+        app.add_middleware(ProfilingMiddleware)
+        app.include_router(render_router)
+        app.dependency_overrides = self.overrides
+        return TestClient(app)
+
+    def test_on_demand_collapsed_stacks(self):
+        client = self.client(RAPID_MD_PROFILING="1")
+        response = client.get(
+            "/render/doc.md?profile=collapsed", headers={"x-api-key": API_KEY}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.headers["x-profiled-status"], "200")
+        self.assertTrue(response.headers["content-type"].startswith("text/plain"))
+        # The endpoint runs in the threadpool and is still profiled
+        self.assertRegex(response.text, r"render_file \(router_web.py:\d+\);")
+        self.assertIn("render_markdown (rendering.py:", response.text)
+        self.assertIsNone(sys.getprofile())
+
+    def test_on_demand_pstats_via_header(self):
+        client = self.client(RAPID_MD_PROFILING="1")
+        response = client.get(
+            "/render/doc.md", headers={"x-api-key": API_KEY, "x-profile": "pstats"}
+        )
+        self.assertEqual(response.status_code, 200)
+        stats = marshal.loads(response.content)
+        self.assertIn("render_file", {key[2] for key in stats})
+        # Loadable by pstats like a cProfile dump
+        with tempfile.NamedTemporaryFile(suffix=".pstats", delete=False) as f:
+            f.write(response.content)
+        self.addCleanup(os.unlink, f.name)
+        output = io.StringIO()
+        pstats.Stats(f.name, stream=output).print_stats(5)
+        self.assertIn("function calls", output.getvalue())
+
+        text = client.get("/render/doc.md?profile", headers={"x-api-key": API_KEY})
+        self.assertIn("Ordered by: cumulative time", text.text)
+
+    def test_on_demand_requires_api_key_and_flag(self):
+        client = self.client(RAPID_MD_PROFILING="1")
+        response = client.get("/render/doc.md?profile=collapsed")
+        self.assertNotIn("x-profiled-status", response.headers)
+        self.assertIn("<h1>Slow</h1>", response.text)
+
+        client = self.client(RAPID_MD_PROFILING="")
+        response = client.get(
+            "/render/doc.md?profile=collapsed", headers={"x-api-key": API_KEY}
+        )
+        self.assertNotIn("x-profiled-status", response.headers)
+
+    def test_sampled_requests_are_stored(self):
+        client = self.client(RAPID_MD_PROFILE_SAMPLE_RATE="2")
+        for _ in range(4):
+            response = client.get("/render/doc.md")
+            self.assertIn("<h1>Slow</h1>", response.text)
+        # The home page is not sampled
+        client.get("/")
+        client.get("/")
+
+        files = sorted(os.listdir(self.profiles.name))
+        self.assertEqual(len(files), 4)
+        self.assertEqual(
+            sorted(os.path.splitext(name)[1] for name in files),
+            [".collapsed", ".collapsed", ".pstats", ".pstats"],
+        )
+        self.assertTrue(all("-render-filename-path-" in name for name in files))
+        output = io.StringIO()
+        pstats.Stats(
+            os.path.join(self.profiles.name, files[-1]), stream=output
+        ).print_stats(5)
+        self.assertIn("function calls", output.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,127 @@
+import time
+import unittest
+import uuid
+from concurrent.futures.process import BrokenProcessPool
+from unittest.mock import patch
+
+import markdown
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from rapid_md.models import FileTypeEnum, RenderedMarkdown
+from rapid_md.render_pool import render_pool
+from rapid_md.rendering import markdown_to_html, render_cache
+from rapid_md.router_api import router
+from rapid_md.router_web import render_router
+from tests.helpers import DatabaseTestCase
+
+API_KEY = "test-key"
+
+CONTENT = b"# Large\n\n" + b"Some *markdown* with a [link](/x).\n\n" * 200
+
+
+def wait_for(predicate, timeout: float = 60) -> None:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            raise AssertionError("Timed out waiting for the render pool")
+        time.sleep(0.05)
+
+
+class TestRenderPool(DatabaseTestCase):
+    def setUp(self):
+        super().setUp()
+        env = patch.dict(
+            "os.environ",
+            {
+                "RAPID_MD_API_KEY": API_KEY,
+                "RAPID_MD_RENDER_PROCESSES": "2",
+                "RAPID_MD_RENDER_POOL_THRESHOLD": "1024",
+            },
+        )
+        env.start()
+        self.addCleanup(env.stop)
+        self.addCleanup(render_pool.shutdown)
+
+        app = FastAPI()
+        app.include_router(router)
+        app.include_router(render_router)
+        app.dependency_overrides = self.overrides
+        self.client = TestClient(app)
+
+    def test_small_documents_skip_the_pool(self):
+        with patch.object(render_pool, "submit") as submit:
+            html = markdown_to_html("small", b"# Small")
+        submit.assert_not_called()
+        self.assertEqual(html, "<h1>Small</h1>")
+
+    def test_large_documents_render_in_pool(self):
+        expected = markdown.markdown(CONTENT.decode())
+        self.assertEqual(markdown_to_html("large", CONTENT), expected)
+        self.assertEqual(render_pool.stats()["processes"], 2)
+
+        # Concurrent requests for the same content share one conversion
+        first = render_pool.submit("shared", CONTENT.decode())
+        second = render_pool.submit("shared", CONTENT.decode())
+        self.assertIs(first, second)
+        self.assertEqual(first.result(timeout=60), expected)
+
+    def test_broken_pool_falls_back_to_inline(self):
+        with (
+            patch.object(render_pool, "submit", side_effect=BrokenProcessPool),
+            patch.object(render_pool, "reset") as reset,
+        ):
+            html = markdown_to_html("broken", CONTENT)
+        reset.assert_called_once()
+        self.assertEqual(html, markdown.markdown(CONTENT.decode()))
+
+    def test_pool_disabled_renders_inline(self):
+        with patch.dict("os.environ", {"RAPID_MD_RENDER_PROCESSES": "0"}):
+            html = markdown_to_html("inline", CONTENT)
+        self.assertEqual(html, markdown.markdown(CONTENT.decode()))
+        self.assertEqual(render_pool.stats()["processes"], 0)
+
+    def test_timeout_serves_source_without_caching(self):
+        file = self.add_file("slow.md", CONTENT + b"<script>")
+        # Starting the worker processes alone takes longer than this
+        with patch.dict("os.environ", {"RAPID_MD_RENDER_TIMEOUT": "0.001"}):
+            response = self.client.get("/render/slow.md")
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("<pre># Large", response.text)
+        self.assertIn("&lt;script&gt;", response.text)
+        self.assertEqual(response.headers["cache-control"], "no-store")
+        self.assertNotIn("etag", response.headers)
+        self.assertIsNone(self.db.get(RenderedMarkdown, file.content_hash))
+
+        # The conversion goes on in the pool and its result is kept
+        wait_for(lambda: render_cache.get(file.content_hash) is not None)
+        response = self.client.get("/render/slow.md")
+        self.assertIn("<h1>Large</h1>", response.text)
+        self.assertIn("etag", response.headers)
+
+    def test_prerender_upload_session(self):
+        first = self.add_file("a.md", CONTENT)
+        self.add_file("copy-of-a.md", CONTENT)
+        second = self.add_file("b.md", b"# Small one")
+        self.add_file("image.png", b"\x89PNG", FileTypeEnum.image)
+        other = self.add_file("other.md", b"# Other", upload_session=uuid.uuid4())
+
+        url = f"/sessions/{self.session}/prerender"
+        self.assertEqual(self.client.post(url).status_code, 401)
+        response = self.client.post(url, headers={"x-api-key": API_KEY})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {"rendered": 2})
+
+        self.db.expire_all()
+        for file, content in ((first, CONTENT), (second, b"# Small one")):
+            rendered = self.db.get(RenderedMarkdown, file.content_hash)
+            self.assertEqual(rendered.html, markdown.markdown(content.decode()))
+        self.assertIsNone(self.db.get(RenderedMarkdown, other.content_hash))
+
+        # Already rendered contents are skipped
+        response = self.client.post(url, headers={"x-api-key": API_KEY})
+        self.assertEqual(response.json(), {"rendered": 0})
+
+
+if __name__ == "__main__":
+    unittest.main()
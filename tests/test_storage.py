@@ -0,0 +1,294 @@
+import gzip
+import hashlib
+import os
+import tempfile
+import time
+import unittest
+from unittest.mock import patch
+
+from sqlalchemy import Select, create_engine
+from sqlalchemy.orm import sessionmaker
+
+from rapid_md.backends import DatabaseBackend, FilesystemBackend
+from rapid_md.manage import gc_storage, migrate_storage
+from rapid_md.models import Base, Blob, FileTypeEnum
+from rapid_md.storage import (
+    decode,
+    iter_blob,
+    prepare_blob,
+    prepare_file_blob,
+    read_blob,
+    read_range,
+    read_ranges,
+    release_blobs,
+    store_blobs,
+)
+
+
+class TestPrepareBlob(unittest.TestCase):
+    def test_text_is_compressed(self):
+        content = b"# Title\n\n" + b"Some repeated markdown text. " * 200
+        blob = prepare_blob("doc.md", FileTypeEnum.markdown, content)
+        self.assertEqual(blob.encoding, "gzip")
+        self.assertEqual(blob.size, len(content))
+        self.assertLess(len(blob.data), len(content) // 5)
+        self.assertEqual(decode(blob.data, blob.encoding), content)
+        # The same content always gives the same stored bytes
+        self.assertEqual(prepare_blob("doc.md", FileTypeEnum.markdown, content), blob)
+
+    def test_compressed_formats_are_stored_as_is(self):
+        content = b"\x89PNG" + b"\x00" * 1000
+        blob = prepare_blob("image.png", FileTypeEnum.image, content)
+        self.assertIsNone(blob.encoding)
+        self.assertEqual(blob.data, content)
+
+        archive = gzip.compress(b"x" * 1000)
+        self.assertIsNone(prepare_blob("a.gz", FileTypeEnum.document, archive).encoding)
+
+    def test_svg_images_are_compressed(self):
+        content = b"<svg>" + b"<rect/>" * 200 + b"</svg>"
+        blob = prepare_blob("icon.svg", FileTypeEnum.image, content)
+        self.assertEqual(blob.encoding, "gzip")
+
+    def test_incompressible_content_is_stored_as_is(self):
+        content = os.urandom(4096)
+        blob = prepare_blob("random.bin", FileTypeEnum.document, content)
+        self.assertIsNone(blob.encoding)
+        self.assertEqual(blob.data, content)
+
+    def test_file_blobs_are_compressed_in_chunks(self):
+        content = b"# Title\n\n" + b"Some repeated markdown text. " * 200
+        content_hash = hashlib.sha256(content).hexdigest()
+        with tempfile.TemporaryFile() as f:
+            f.write(content)
+            blob = prepare_file_blob(
+                "doc.md", FileTypeEnum.markdown, f, content_hash, len(content), 64
+            )
+            self.assertEqual(blob.encoding, "gzip")
+            with blob.data:
+                self.assertEqual(decode(blob.data.read(), blob.encoding), content)
+
+            # Incompressible content is the spooled file itself
+            blob = prepare_file_blob(
+                "image.png", FileTypeEnum.image, f, content_hash, len(content)
+            )
+            self.assertIs(blob.data, f)
+            self.assertEqual(f.tell(), 0)
+
+
+class TestFilesystemBackend(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = tmp.name
+        env = patch.dict(
+            os.environ,
+            {"RAPID_MD_STORAGE_BACKEND": "fs", "RAPID_MD_STORAGE_PATH": self.root},
+        )
+        env.start()
+        self.addCleanup(env.stop)
+
+        engine = create_engine("sqlite:///:memory:")
+        Base.metadata.create_all(engine)
+        self.db = sessionmaker(bind=engine)()
+        self.addCleanup(self.db.close)
+        self.backend = FilesystemBackend(self.root)
+
+    def files(self) -> list[str]:
+        return sorted(self.backend.iter_files())
+
+    def test_blobs_are_written_to_sharded_files(self):
+        content = b"# Title\n\n" + b"markdown body " * 100
+        blob = prepare_blob("doc.md", FileTypeEnum.markdown, content)
+        store_blobs(self.db, [blob])
+        self.db.commit()
+
+        h = blob.content_hash
+        path = os.path.join(self.root, h[:2], h[2:4], h + ".gz")
+        self.assertEqual(self.files(), [path])
+        row = self.db.get(Blob, h)
+        self.assertEqual(row.backend, "fs")
+        self.assertIsNone(row.content)
+        self.assertEqual(read_blob(self.db, h), content)
+        self.assertEqual(read_range(self.db, h, 2, 5), b"Title")
+
+        # A second copy only adds a reference
+        store_blobs(self.db, [blob])
+        self.assertEqual(self.files(), [path])
+
+    def test_file_blobs_are_copied_to_the_backend(self):
+        content = os.urandom(10_000)
+        content_hash = hashlib.sha256(content).hexdigest()
+        with tempfile.TemporaryFile() as f:
+            f.write(content)
+            blob = prepare_file_blob(
+                "random.bin", FileTypeEnum.document, f, content_hash, len(content)
+            )
+            with patch("rapid_md.backends.COPY_CHUNK_SIZE", 1024):
+                store_blobs(self.db, [blob])
+        self.db.commit()
+        self.assertIsNone(self.db.get(Blob, content_hash).content)
+        self.assertEqual(read_blob(self.db, content_hash), content)
+
+    def test_blob_released_during_store_is_inserted_again(self):
+        for backend in ("db", "fs"):
+            content = f"shared {backend} content\n".encode() * 100
+            blob = prepare_blob(f"{backend}.md", FileTypeEnum.markdown, content)
+            with patch.dict(os.environ, {"RAPID_MD_STORAGE_BACKEND": backend}):
+                store_blobs(self.db, [blob])
+                self.db.commit()
+
+                # A concurrent delete releases the last reference right after
+                # store_blobs has seen the blob
+                execute = self.db.execute
+                released = []
+
+                def execute_then_release(statement, *args, **kwargs):
+                    result = execute(statement, *args, **kwargs)
+                    if released or not isinstance(statement, Select):
+                        return result
+                    frozen = result.freeze()
+                    released.append(blob.content_hash)
+                    release_blobs(self.db, released)
+                    return frozen()
+
+                with patch.object(self.db, "execute", execute_then_release):
+                    saved = store_blobs(self.db, [blob])
+                self.db.commit()
+            self.assertEqual(released, [blob.content_hash])
+            self.assertEqual(saved, len(content))
+            row = self.db.get(Blob, blob.content_hash)
+            self.assertEqual(row.refcount, 1)
+            self.assertEqual(read_blob(self.db, blob.content_hash), content)
+
+    def test_range_reads_seek_into_the_file(self):
+        content = os.urandom(4096)
+        blob = prepare_blob("random.bin", FileTypeEnum.document, content)
+        store_blobs(self.db, [blob])
+        self.db.commit()
+        self.assertEqual(
+            read_range(self.db, blob.content_hash, 1000, 10), content[1000:1010]
+        )
+
+    def test_compressed_ranges_are_decompressed_in_streaming(self):
+        text = b"".join(b"line %d of compressible markdown\n" % i for i in range(2000))
+        ranges = [(10, 20), (30_000, 100), (500, 5)]
+        for backend in ("db", "fs"):
+            with patch.dict(os.environ, {"RAPID_MD_STORAGE_BACKEND": backend}):
+                blob = prepare_blob(f"{backend}.md", FileTypeEnum.markdown, text)
+                self.assertEqual(blob.encoding, "gzip")
+                store_blobs(self.db, [blob])
+                self.db.commit()
+            # The whole content is never decompressed at once
+            with patch("gzip.decompress", side_effect=AssertionError):
+                parts = list(read_ranges(self.db, blob.content_hash, ranges))
+                self.assertEqual(
+                    read_range(self.db, blob.content_hash, 2, 4), text[2:6]
+                )
+            self.assertEqual(parts, [text[s : s + n] for s, n in ranges])
+            # Same hash in the next backend: store it again
+            self.db.query(Blob).delete()
+
+    def test_iter_blob_reads_in_chunks(self):
+        text = b"compressible markdown line\n" * 1000
+        data = os.urandom(10_000)
+        for backend in ("db", "fs"):
+            with patch.dict(os.environ, {"RAPID_MD_STORAGE_BACKEND": backend}):
+                blobs = [
+                    prepare_blob(f"{backend}.md", FileTypeEnum.markdown, text),
+                    prepare_blob(f"{backend}.bin", FileTypeEnum.document, data),
+                ]
+                store_blobs(self.db, blobs)
+                self.db.commit()
+            for blob, content in zip(blobs, [text, data]):
+                chunks = list(iter_blob(self.db, blob.content_hash, 4096))
+                self.assertEqual(b"".join(chunks), content)
+                self.assertTrue(all(len(chunk) <= 4096 for chunk in chunks))
+
+    def test_failed_write_leaves_no_file(self):
+        with patch("os.replace", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.backend.save("ab" * 32, None, b"data")
+        self.assertEqual(self.files(), [])
+
+    def test_migrate_storage_between_backends(self):
+        contents = [f"document {i}\n".encode() * 50 for i in range(5)]
+        with patch.dict(os.environ, {"RAPID_MD_STORAGE_BACKEND": "db"}):
+            store_blobs(
+                self.db,
+                [
+                    prepare_blob(f"{i}.txt", FileTypeEnum.document, c)
+                    for i, c in enumerate(contents)
+                ],
+            )
+            self.db.commit()
+        self.assertEqual(self.files(), [])
+
+        self.assertEqual(migrate_storage(self.db, "fs", batch_size=2), 5)
+        self.assertEqual(len(self.files()), 5)
+        for content in contents:
+            self.assertEqual(
+                read_blob(self.db, hashlib.sha256(content).hexdigest()), content
+            )
+
+        self.assertEqual(migrate_storage(self.db, "db"), 5)
+        self.assertEqual(self.files(), [])
+        for content in contents:
+            self.assertEqual(
+                read_blob(self.db, hashlib.sha256(content).hexdigest()), content
+            )
+
+    def test_migrate_storage_copies_stored_bytes_in_chunks(self):
+        blobs = [
+            prepare_blob("doc.md", FileTypeEnum.markdown, b"# Title\n" * 500),
+            prepare_blob("image.png", FileTypeEnum.image, os.urandom(1000)),
+        ]
+        with patch.dict(os.environ, {"RAPID_MD_STORAGE_BACKEND": "db"}):
+            store_blobs(self.db, blobs)
+            self.db.commit()
+
+        # No backend may load a whole blob at once
+        with (
+            patch.object(DatabaseBackend, "read", side_effect=AssertionError),
+            patch.object(FilesystemBackend, "read", side_effect=AssertionError),
+        ):
+            self.assertEqual(migrate_storage(self.db, "fs", chunk_size=64), 2)
+            for blob in blobs:
+                with open(
+                    self.backend.path(blob.content_hash, blob.encoding), "rb"
+                ) as f:
+                    # Compressed blobs are copied as they are, not recompressed
+                    self.assertEqual(f.read(), blob.data)
+            self.assertEqual(migrate_storage(self.db, "db", chunk_size=64), 2)
+        for blob in blobs:
+            stored = self.db.get(Blob, blob.content_hash)
+            self.assertEqual(
+                (stored.content, stored.encoding), (blob.data, blob.encoding)
+            )
+
+    def test_gc_removes_only_old_unreferenced_files(self):
+        kept = prepare_blob("kept.png", FileTypeEnum.image, b"kept")
+        released = prepare_blob("gone.png", FileTypeEnum.image, b"gone")
+        store_blobs(self.db, [kept, released])
+        release_blobs(self.db, [released.content_hash])
+        self.db.commit()
+        interrupted = os.path.join(self.root, ".tmp-interrupted")
+        with open(interrupted, "wb") as f:
+            f.write(b"partial")
+
+        # Files younger than the grace period may belong to uploads in flight
+        self.assertEqual(gc_storage(self.db, grace_seconds=3600), [])
+
+        past = time.time() - 7200
+        for path in self.files():
+            os.utime(path, (past, past))
+        orphans = gc_storage(self.db, grace_seconds=3600)
+        self.assertEqual(
+            sorted(orphans),
+            sorted([interrupted, self.backend.path(released.content_hash, None)]),
+        )
+        self.assertEqual(self.files(), [self.backend.path(kept.content_hash, None)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,40 @@
+import unittest
+
+from rapid_md.template import PageTemplate, TEMPLATE_PATH
+
+
+class TestPageTemplate(unittest.TestCase):
+    def test_render_fills_every_placeholder(self):
+        template = PageTemplate(
+            "<title>__page_title__</title>__navigation__<h1>__title__</h1>"
+            "__tags__<main>__content__</main>"
+        )
+        html = template.render(
+            page_title="Page",
+            title="Title",
+            navigation="<nav/>",
+            tags="<span>t</span>",
+            content="<p>body</p>",
+        )
+        self.assertEqual(
+            html,
+            "<title>Page</title><nav/><h1>Title</h1><span>t</span><main><p>body</p></main>",
+        )
+
+    def test_values_are_not_substituted_again(self):
+        # A document that mentions a placeholder must be left untouched
+        template = PageTemplate("__content__|__tags__")
+        html = template.render(
+            page_title="", title="", navigation="", tags="x", content="__tags__"
+        )
+        self.assertEqual(html, "__tags__|x")
+
+    def test_repository_template_has_all_placeholders(self):
+        html = PageTemplate.from_path(TEMPLATE_PATH).render(
+            page_title="P", title="T", navigation="N", tags="G", content="C"
+        )
+        self.assertNotIn("__", html)
+
+
+if __name__ == "__main__":
+    unittest.main()
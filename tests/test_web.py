@@ -1,61 +1,37 @@
+import os
+import re
+import tempfile
 import unittest
-import base64
 import uuid
 from unittest.mock import patch
 from datetime import datetime
-import os
-import tempfile
-from typing import Generator
 
 
+import markdown
 from fastapi.testclient import TestClient
 from fastapi import FastAPI
-from sqlalchemy import create_engine
-from sqlalchemy.orm import Session, sessionmaker
-from sqlalchemy.pool import StaticPool
+from sqlalchemy import event
 
-from rapid_md.router_web import render_router, get_db
-from rapid_md.models import UploadedFile, FileTypeEnum, Base
+from rapid_md.router_web import render_router
+from rapid_md.models import UploadedFile, FileTypeEnum, RenderedMarkdown
+from rapid_md.rendering import render_cache
+from rapid_md.storage import prepare_blob, store_blobs
+from rapid_md.tags import add_file_tags
+from rapid_md.template import PageTemplate
+from rapid_md.versioning import bump_data_version
+from tests.helpers import DatabaseTestCase, stored_content
 
 
-class TestWebRoutes(unittest.TestCase):
+class TestWebRoutes(DatabaseTestCase):
     def setUp(self):
-        # Create an in-memory SQLite database for testing
-        self.engine = create_engine(
-            "sqlite:///:memory:",
-            connect_args={"check_same_thread": False},
-            poolclass=StaticPool,
-        )
-
-        # Create all tables in the database
-        Base.metadata.create_all(self.engine)
-
-        # Create a session factory
-        TestingSessionLocal = sessionmaker(
-            autocommit=False, autoflush=False, bind=self.engine
-        )
-
-        # Define dependency override for database session
-        def override_get_db() -> Generator[Session, None, None]:
-            db = TestingSessionLocal()
-            try:
-                yield db
-                db.commit()
-            except Exception:
-                db.rollback()
-                raise
-            finally:
-                db.close()
+        super().setUp()
 
         # Create a test app and override dependencies
         self.app = FastAPI()
         self.app.include_router(render_router)
-        self.app.dependency_overrides = {get_db: override_get_db}
+        self.app.dependency_overrides = self.overrides
         self.client = TestClient(self.app)
 
-        # Get a session for test data setup
-        self.db = TestingSessionLocal()
-
         # Create session ID for testing
         self.session_id_1 = uuid.uuid4()
         self.session_id_2 = uuid.uuid4()
@@ -64,7 +40,7 @@ class TestWebRoutes(unittest.TestCase):
         self.test_file_1 = UploadedFile(
             id=uuid.uuid4(),
             filename="test1.md",
-            content=base64.b64encode(b"# Test Markdown").decode("utf-8"),
+            **stored_content(self.db, b"# Test Markdown"),
             created_at=datetime(2025, 10, 15, 10, 0),
             filetype=FileTypeEnum.markdown,
             tags=["category", "test", "priority", "high"],
@@ -74,7 +50,7 @@ class TestWebRoutes(unittest.TestCase):
         self.test_file_2 = UploadedFile(
             id=uuid.uuid4(),
             filename="test2.png",
-            content=base64.b64encode(b"fake-image-data").decode("utf-8"),
+            **stored_content(self.db, b"fake-image-data"),
             created_at=datetime(2025, 10, 16, 11, 0),
             filetype=FileTypeEnum.image,
             tags=["category", "test"],
@@ -84,7 +60,7 @@ class TestWebRoutes(unittest.TestCase):
         self.test_file_3 = UploadedFile(
             id=uuid.uuid4(),
             filename="test3.pdf",
-            content=base64.b64encode(b"fake-pdf-data").decode("utf-8"),
+            **stored_content(self.db, b"fake-pdf-data"),
             created_at=datetime(2025, 10, 17, 12, 0),
             filetype=FileTypeEnum.document,
             tags=["priority", "low"],
@@ -95,6 +71,9 @@ class TestWebRoutes(unittest.TestCase):
         self.db.add(self.test_file_1)
         self.db.add(self.test_file_2)
         self.db.add(self.test_file_3)
+        self.db.flush()
+        for file in (self.test_file_1, self.test_file_2, self.test_file_3):
+            add_file_tags(self.db, file.id, file.tags)
         self.db.commit()
 
         # Template mock
@@ -105,25 +84,15 @@ class TestWebRoutes(unittest.TestCase):
         <div>__content__</div>
         """
 
-        # Create a temporary template file for testing
-        self.temp_dir = tempfile.TemporaryDirectory()
-        self.template_path = os.path.join(self.temp_dir.name, "template.html")
-        with open(self.template_path, "w") as f:
-            f.write(self.mock_template_content)
-
-    def tearDown(self):
-        # Clean up the database by dropping all tables
-        self.db.close()
-        Base.metadata.drop_all(self.engine)
-
-        # Clean up temporary files
-        self.temp_dir.cleanup()
-
-    @patch("pathlib.Path.__truediv__")
-    def test_home_with_files(self, mock_path_div):
-        # Setup - mock the template path to use our temporary file
-        mock_path_div.return_value = self.template_path
+        # Use the mock template instead of the one loaded at startup
+        template_patch = patch(
+            "rapid_md.router_web.page_template",
+            PageTemplate(self.mock_template_content),
+        )
+        template_patch.start()
+        self.addCleanup(template_patch.stop)
 
+    def test_home_with_files(self):
         # Execute
         response = self.client.get("/")
 
@@ -141,11 +110,60 @@ class TestWebRoutes(unittest.TestCase):
         self.assertIn("Files by Tag", content)
         self.assertIn("All Files", content)
 
-    @patch("pathlib.Path.__truediv__")
-    def test_home_empty(self, mock_path_div):
-        # Setup - mock the template path to use our temporary file
-        mock_path_div.return_value = self.template_path
+    def test_home_tag_counts_and_filter(self):
+        response = self.client.get("/")
+        self.assertIn(
+            '<a href="/?tag=category" class="tag">category</a> (2 files)', response.text
+        )
+        self.assertIn(
+            '<a href="/?tag=low" class="tag">low</a> (1 files)', response.text
+        )
+
+        filtered = self.client.get("/", params={"tag": "high"})
+        self.assertEqual(filtered.status_code, 200)
+        self.assertIn("test1.md", filtered.text)
+        self.assertNotIn("test2.png", filtered.text)
+        self.assertNotIn("test3.pdf", filtered.text)
+
+    def test_home_escapes_tags_and_filenames(self):
+        script = "<script>alert(1)</script>"
+        escaped = "&lt;script&gt;alert(1)&lt;/script&gt;"
+        # Reflected from the query string
+        response = self.client.get("/", params={"tag": script})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(f"Files tagged {escaped}", response.text)
+        self.assertNotIn(script, response.text)
+
+        # Stored by an upload
+        file = UploadedFile(
+            id=uuid.uuid4(),
+            filename=f"{script}.md",
+            **stored_content(self.db, b"# Script"),
+            created_at=datetime(2025, 10, 18, 12, 0),
+            filetype=FileTypeEnum.markdown,
+            tags=[script],
+            upload_session=self.session_id_2,
+        )
+        self.db.add(file)
+        self.db.flush()
+        add_file_tags(self.db, file.id, file.tags)
+        bump_data_version(self.db)
+        self.db.commit()
+        for url, params in (
+            ("/", {}),
+            ("/", {"tag": script}),
+            (f"/render/{script}.md", {}),
+        ):
+            response = self.client.get(url, params=params)
+            self.assertEqual(response.status_code, 200)
+            self.assertIn(escaped, response.text)
+            self.assertNotIn(script, response.text)
+        response = self.client.get("/")
+        self.assertIn(
+            'href="/render/%3Cscript%3Ealert%281%29%3C/script%3E.md"', response.text
+        )
 
+    def test_home_empty(self):
         # Clear the database
         self.db.query(UploadedFile).delete()
         self.db.commit()
@@ -160,11 +178,7 @@ class TestWebRoutes(unittest.TestCase):
         content = response.content.decode("utf-8")
         self.assertIn("No files uploaded yet", content)
 
-    @patch("pathlib.Path.__truediv__")
-    def test_render_markdown_file(self, mock_path_div):
-        # Setup - mock the template path to use our temporary file
-        mock_path_div.return_value = self.template_path
-
+    def test_render_markdown_file(self):
         # Execute
         response = self.client.get("/render/test1.md")
 
@@ -186,11 +200,7 @@ class TestWebRoutes(unittest.TestCase):
         self.assertIn("priority", content)
         self.assertIn("high", content)
 
-    @patch("pathlib.Path.__truediv__")
-    def test_render_image_file(self, mock_path_div):
-        # Setup - mock the template path to use our temporary file
-        mock_path_div.return_value = self.template_path
-
+    def test_render_image_file(self):
         # Execute
         response = self.client.get("/render/test2.png")
 
@@ -201,11 +211,7 @@ class TestWebRoutes(unittest.TestCase):
         # Check the raw content is returned
         self.assertEqual(response.content, b"fake-image-data")
 
-    @patch("pathlib.Path.__truediv__")
-    def test_render_document_file(self, mock_path_div):
-        # Setup - mock the template path to use our temporary file
-        mock_path_div.return_value = self.template_path
-
+    def test_render_document_file(self):
         # Execute
         response = self.client.get("/render/test3.pdf")
 
@@ -216,22 +222,405 @@ class TestWebRoutes(unittest.TestCase):
         # Check the raw content is returned
         self.assertEqual(response.content, b"fake-pdf-data")
 
+    def test_render_markdown_is_cached(self):
+        identity = {"Accept-Encoding": "identity"}
+        with patch("rapid_md.rendering.mdlib.markdown", wraps=markdown.markdown) as md:
+            first = self.client.get("/render/test1.md", headers=identity)
+            second = self.client.get("/render/test1.md", headers=identity)
+
+        self.assertEqual(first.content, second.content)
+        self.assertEqual(md.call_count, 1)
+        self.assertEqual(render_cache.hits, 1)
+
+        # The rendered HTML is persisted, so a cold LRU does not parse again
+        rendered = self.db.get(RenderedMarkdown, self.test_file_1.content_hash)
+        self.assertIn("<h1>Test Markdown</h1>", rendered.html)
+        render_cache.clear()
+        with patch("rapid_md.rendering.mdlib.markdown") as md:
+            response = self.client.get("/render/test1.md")
+        md.assert_not_called()
+        self.assertIn("<h1>Test Markdown</h1>", response.text)
+
+    def test_render_markdown_gzip_page_is_cached(self):
+        gzip_headers = {"Accept-Encoding": "gzip"}
+        first = self.client.get("/render/test1.md", headers=gzip_headers)
+        self.assertEqual(first.headers["content-encoding"], "gzip")
+        self.assertEqual(first.headers["vary"], "Accept-Encoding")
+        self.assertTrue(first.headers["etag"].endswith('-gzip"'))
+        self.assertIn("<h1>Test Markdown</h1>", first.text)
+
+        # The compressed page is served again without rendering it
+        with patch("rapid_md.router_web.render_markdown") as render:
+            second = self.client.get("/render/test1.md", headers=gzip_headers)
+        render.assert_not_called()
+        self.assertEqual(second.text, first.text)
+
+        plain = self.client.get(
+            "/render/test1.md", headers={"Accept-Encoding": "identity"}
+        )
+        self.assertNotIn("content-encoding", plain.headers)
+        self.assertNotEqual(plain.headers["etag"], first.headers["etag"])
+        self.assertEqual(plain.text, first.text)
+
+    def test_render_compressed_blob(self):
+        text = b"plain text that compresses well\n" * 100
+        blob = prepare_blob("notes.txt", FileTypeEnum.document, text)
+        self.assertEqual(blob.encoding, "gzip")
+        store_blobs(self.db, [blob])
+        self.db.add(
+            UploadedFile(
+                id=uuid.uuid4(),
+                filename="notes.txt",
+                content_hash=blob.content_hash,
+                size=blob.size,
+                created_at=datetime(2025, 10, 18, 9, 0),
+                filetype=FileTypeEnum.document,
+                tags=None,
+                upload_session=uuid.uuid4(),
+            )
+        )
+        self.db.commit()
+
+        with patch("rapid_md.storage.decode") as decode:
+            compressed = self.client.get(
+                "/render/notes.txt", headers={"Accept-Encoding": "gzip"}
+            )
+        decode.assert_not_called()
+        self.assertEqual(compressed.headers["content-encoding"], "gzip")
+        self.assertEqual(compressed.content, text)
+
+        plain = self.client.get(
+            "/render/notes.txt", headers={"Accept-Encoding": "identity"}
+        )
+        self.assertNotIn("content-encoding", plain.headers)
+        self.assertEqual(plain.content, text)
+
+        partial = self.client.get(
+            "/render/notes.txt",
+            headers={"Accept-Encoding": "gzip", "Range": "bytes=6-9"},
+        )
+        self.assertEqual(partial.status_code, 206)
+        self.assertNotIn("content-encoding", partial.headers)
+        self.assertEqual(partial.content, b"text")
+
+    def test_render_blob_from_filesystem(self):
+        text = b"plain text that compresses well\n" * 100
+        image = b"\x89PNG" + bytes(range(256))
+        with (
+            tempfile.TemporaryDirectory() as root,
+            patch.dict(
+                os.environ,
+                {"RAPID_MD_STORAGE_BACKEND": "fs", "RAPID_MD_STORAGE_PATH": root},
+            ),
+        ):
+            for filename, filetype, content in [
+                ("notes.txt", FileTypeEnum.document, text),
+                ("image.png", FileTypeEnum.image, image),
+            ]:
+                blob = prepare_blob(filename, filetype, content)
+                store_blobs(self.db, [blob])
+                self.db.add(
+                    UploadedFile(
+                        id=uuid.uuid4(),
+                        filename=filename,
+                        content_hash=blob.content_hash,
+                        size=blob.size,
+                        created_at=datetime(2025, 10, 18, 9, 0),
+                        filetype=filetype,
+                        tags=None,
+                        upload_session=uuid.uuid4(),
+                    )
+                )
+            self.db.commit()
+
+            # Both files are served straight from disk
+            with patch("rapid_md.router_web.read_stored_blob") as read:
+                compressed = self.client.get(
+                    "/render/notes.txt", headers={"Accept-Encoding": "gzip"}
+                )
+                raw = self.client.get("/render/image.png")
+            read.assert_not_called()
+            self.assertEqual(compressed.headers["content-encoding"], "gzip")
+            self.assertEqual(compressed.content, text)
+            self.assertEqual(raw.content, image)
+            self.assertEqual(raw.headers["content-length"], str(len(image)))
+            self.assertIn("etag", raw.headers)
+
+            plain = self.client.get(
+                "/render/notes.txt", headers={"Accept-Encoding": "identity"}
+            )
+            self.assertEqual(plain.content, text)
+
+            partial = self.client.get(
+                "/render/image.png", headers={"Range": "bytes=1-3"}
+            )
+            self.assertEqual(partial.status_code, 206)
+            self.assertEqual(partial.content, b"PNG")
+
+    def test_render_duplicate_filename_serves_latest(self):
+        newer = UploadedFile(
+            id=uuid.uuid4(),
+            filename="test2.png",
+            **stored_content(self.db, b"newer-image-data"),
+            created_at=datetime(2025, 10, 20, 9, 0),
+            filetype=FileTypeEnum.image,
+            tags=None,
+            upload_session=uuid.uuid4(),
+        )
+        self.db.add(newer)
+        self.db.commit()
+
+        response = self.client.get("/render/test2.png")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"newer-image-data")
+
+    def test_render_conditional_get(self):
+        response = self.client.get("/render/test2.png")
+        etag = response.headers["etag"]
+        self.assertEqual(etag, f'"{self.test_file_2.content_hash}"')
+        self.assertEqual(response.headers["cache-control"], "public, max-age=3600")
+        self.assertEqual(
+            response.headers["last-modified"], "Thu, 16 Oct 2025 11:00:00 GMT"
+        )
+
+        cached = self.client.get("/render/test2.png", headers={"If-None-Match": etag})
+        self.assertEqual(cached.status_code, 304)
+        self.assertEqual(cached.content, b"")
+        self.assertEqual(cached.headers["etag"], etag)
+
+        stale = self.client.get("/render/test2.png", headers={"If-None-Match": '"x"'})
+        self.assertEqual(stale.status_code, 200)
+
+        since = self.client.get(
+            "/render/test2.png",
+            headers={"If-Modified-Since": "Thu, 16 Oct 2025 11:00:00 GMT"},
+        )
+        self.assertEqual(since.status_code, 304)
+        before = self.client.get(
+            "/render/test2.png",
+            headers={"If-Modified-Since": "Thu, 16 Oct 2025 10:59:59 GMT"},
+        )
+        self.assertEqual(before.status_code, 200)
+
+    def test_render_markdown_etag_changes_with_a_new_upload(self):
+        etag = self.client.get("/render/test1.md").headers["etag"]
+
+        # Same name and content, different tags
+        newer = UploadedFile(
+            id=uuid.uuid4(),
+            filename="test1.md",
+            **stored_content(self.db, b"# Test Markdown"),
+            created_at=datetime(2025, 10, 18, 10, 0),
+            filetype=FileTypeEnum.markdown,
+            tags=["retagged"],
+            upload_session=self.session_id_2,
+        )
+        self.db.add(newer)
+        self.db.commit()
+        response = self.client.get("/render/test1.md", headers={"If-None-Match": etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertIn("retagged", response.text)
+        self.assertNotEqual(response.headers["etag"], etag)
+
+    def test_render_markdown_not_modified_skips_rendering(self):
+        etag = self.client.get("/render/test1.md").headers["etag"]
+        with patch("rapid_md.router_web.render_markdown") as render:
+            response = self.client.get(
+                "/render/test1.md", headers={"If-None-Match": etag}
+            )
+        self.assertEqual(response.status_code, 304)
+        render.assert_not_called()
+
+    def test_home_conditional_get_follows_data_version(self):
+        etag = self.client.get("/").headers["etag"]
+        cached = self.client.get("/", headers={"If-None-Match": etag})
+        self.assertEqual(cached.status_code, 304)
+
+        bump_data_version(self.db)
+        self.db.commit()
+        changed = self.client.get("/", headers={"If-None-Match": etag})
+        self.assertEqual(changed.status_code, 200)
+        self.assertNotEqual(changed.headers["etag"], etag)
+
+    def test_home_is_cached_until_data_version_changes(self):
+        first = self.client.get("/")
+        self.assertIn("test1.md", first.text)
+
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(self.engine, "before_cursor_execute", record)
+        try:
+            second = self.client.get("/")
+        finally:
+            event.remove(self.engine, "before_cursor_execute", record)
+        self.assertEqual(second.text, first.text)
+        # Only the data version is read on a cache hit
+        self.assertEqual(len(statements), 1)
+        self.assertIn("data_version", statements[0])
+
+        # A file added by another process becomes visible once the version moves
+        self.db.add(
+            UploadedFile(
+                id=uuid.uuid4(),
+                filename="late.md",
+                **stored_content(self.db, b"# Late"),
+                created_at=datetime(2025, 10, 18, 12, 0),
+                filetype=FileTypeEnum.markdown,
+                tags=None,
+                upload_session=self.session_id_1,
+            )
+        )
+        self.db.commit()
+        self.assertNotIn("late.md", self.client.get("/").text)
+        bump_data_version(self.db)
+        self.db.commit()
+        self.assertIn("late.md", self.client.get("/").text)
+
+    def test_home_gzip(self):
+        plain = self.client.get("/", headers={"Accept-Encoding": "identity"})
+        response = self.client.get("/", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual(response.headers["content-encoding"], "gzip")
+        self.assertEqual(response.headers["vary"], "Accept-Encoding")
+        self.assertEqual(response.text, plain.text)
+        self.assertNotEqual(response.headers["etag"], plain.headers["etag"])
+
+        cached = self.client.get(
+            "/",
+            headers={
+                "Accept-Encoding": "gzip",
+                "If-None-Match": response.headers["etag"],
+            },
+        )
+        self.assertEqual(cached.status_code, 304)
+        self.assertNotIn("content-encoding", cached.headers)
+        self.assertEqual(cached.headers["vary"], "Accept-Encoding")
+        self.assertEqual(cached.headers["etag"], response.headers["etag"])
+
+    def test_render_markdown_gzip_not_modified(self):
+        response = self.client.get(
+            "/render/test1.md", headers={"Accept-Encoding": "gzip"}
+        )
+        cached = self.client.get(
+            "/render/test1.md",
+            headers={
+                "Accept-Encoding": "gzip",
+                "If-None-Match": response.headers["etag"],
+            },
+        )
+        self.assertEqual(cached.status_code, 304)
+        self.assertNotIn("content-encoding", cached.headers)
+        self.assertEqual(cached.headers["vary"], "Accept-Encoding")
+        self.assertEqual(cached.headers["etag"], response.headers["etag"])
+
+    def test_render_single_range(self):
+        response = self.client.get("/render/test3.pdf", headers={"Range": "bytes=5-7"})
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, b"pdf")
+        self.assertEqual(response.headers["content-range"], "bytes 5-7/13")
+        self.assertEqual(response.headers["accept-ranges"], "bytes")
+
+        suffix = self.client.get("/render/test3.pdf", headers={"Range": "bytes=-4"})
+        self.assertEqual(suffix.status_code, 206)
+        self.assertEqual(suffix.content, b"data")
+
+        open_ended = self.client.get("/render/test3.pdf", headers={"Range": "bytes=9-"})
+        self.assertEqual(open_ended.content, b"data")
+
+    def test_render_multiple_ranges(self):
+        response = self.client.get(
+            "/render/test3.pdf", headers={"Range": "bytes=0-3,9-12"}
+        )
+        self.assertEqual(response.status_code, 206)
+        content_type = response.headers["content-type"]
+        self.assertTrue(content_type.startswith("multipart/byteranges; boundary="))
+        boundary = content_type.split("boundary=")[1]
+        body = response.content.decode("ascii")
+        self.assertIn("Content-Range: bytes 0-3/13\r\n\r\nfake\r\n", body)
+        self.assertIn("Content-Range: bytes 9-12/13\r\n\r\ndata\r\n", body)
+        self.assertTrue(body.endswith(f"--{boundary}--\r\n"))
+
+    def test_render_range_not_satisfiable(self):
+        response = self.client.get(
+            "/render/test3.pdf", headers={"Range": "bytes=100-200"}
+        )
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response.headers["content-range"], "bytes */13")
+
+    def test_render_range_ignored_when_if_range_does_not_match(self):
+        response = self.client.get(
+            "/render/test3.pdf",
+            headers={"Range": "bytes=0-3", "If-Range": '"old-etag"'},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b"fake-pdf-data")
+
+        etag = response.headers["etag"]
+        response = self.client.get(
+            "/render/test3.pdf", headers={"Range": "bytes=0-3", "If-Range": etag}
+        )
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response.content, b"fake")
+
+    def test_listing_does_not_load_content(self):
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            statements.append(statement)
+
+        event.listen(self.engine, "before_cursor_execute", record)
+        try:
+            response = self.client.get("/")
+        finally:
+            event.remove(self.engine, "before_cursor_execute", record)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(statements)
+        self.assertFalse([s for s in statements if "blobs" in s])
+
+    def test_home_is_paginated(self):
+        older = [
+            UploadedFile(
+                id=uuid.uuid4(),
+                filename=f"old{i}.md",
+                **stored_content(self.db, b"# Old"),
+                created_at=datetime(2025, 1, 1, 0, i),
+                filetype=FileTypeEnum.markdown,
+                tags=None,
+                upload_session=self.session_id_2,
+            )
+            for i in range(3)
+        ]
+        self.db.add_all(older)
+        self.db.commit()
+
+        with patch("rapid_md.router_web.HOME_PAGE_SIZE", 3):
+            first = self.client.get("/")
+            self.assertIn("test3.pdf", first.text)
+            self.assertNotIn("old2.md", first.text)
+            next_link = re.search(r'href="(/\?cursor=[^"]+)"', first.text)
+            self.assertIsNotNone(next_link)
+
+            second = self.client.get(next_link.group(1))
+            self.assertIn("old2.md", second.text)
+            self.assertIn("old0.md", second.text)
+            self.assertNotIn("test3.pdf", second.text)
+            self.assertNotIn("?cursor=", second.text)
+
     def test_render_file_not_found(self):
         # Execute and verify
         response = self.client.get("/render/nonexistent.md")
         self.assertEqual(response.status_code, 404)
         self.assertIn("File not found", response.json()["detail"])
 
-    @patch("pathlib.Path.__truediv__")
-    def test_render_file_unknown_extension(self, mock_path_div):
-        # Setup - mock the template path to use our temporary file
-        mock_path_div.return_value = self.template_path
-
+    def test_render_file_unknown_extension(self):
         # Create unknown file type
         unknown_file = UploadedFile(
             id=uuid.uuid4(),
             filename="test.unknown",
-            content=base64.b64encode(b"unknown-data").decode("utf-8"),
+            **stored_content(self.db, b"unknown-data"),
             created_at=datetime(2025, 10, 17, 12, 0),
             filetype=FileTypeEnum.document,
             tags=None,